@@ -2,50 +2,155 @@ import socket
 import json
 import threading
 import time
+import itertools
+import queue
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from game_server import GameServer
+from protocol import client_handshake
 class Client:
+    RECONNECT_ATTEMPTS = 5
+    REQUEST_TIMEOUT = 5  # 秒
+
     def __init__(self, host='127.0.0.1', port=12345):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.connect((host, port))
+        self.protocol = client_handshake(self.server_socket)  # 協商長度前綴分幀
+        self.address = (host, port)
         self.current_room = None
-        self.response_queue = {}
+        self.pending_requests = {}  # request_id -> (等待回覆的 Future, 請求)，斷線重連後重發
+        self.request_ids = itertools.count(1)  # 單調遞增，同一執行緒連續發同一個動作也不會重複
+        self.events = queue.Queue()  # 服務器推送的消息，由事件執行緒依序處理
         self.message_lock = threading.Lock()
+        self.presence_lock = threading.Lock()
+        self.online_players = {}  # 本地維護的在線玩家列表，由增量推送更新
+        self.presence_version = None
+        self.presence_epoch = None  # 服務器本次運行的標識，重啟後版本號不再可比
+        self.session_token = None  # 登錄後由服務器發出，斷線重連時用來恢復會話
+        self.rooms_response = None  # 登錄時一起取回的房間列表
+        self.closing = False
         self.is_playing = False
         self.is_handling_invite = False
         
         self.listen_thread = threading.Thread(target=self.listen_for_messages)
         self.listen_thread.daemon = True
         self.listen_thread.start()
+        self.event_thread = threading.Thread(target=self.handle_events)
+        self.event_thread.daemon = True
+        self.event_thread.start()
 
     def send_request(self, action, **kwargs):
+        """發送請求並等待對應的回覆；多個執行緒可以同時在一條連線上等待各自的回覆"""
         request = {'action': action}
         request.update(kwargs)
-        
-        request_id = f"{action}_{threading.get_ident()}"
-        request['request_id'] = request_id
+        future = Future()
         
         with self.message_lock:
-            self.response_queue[request_id] = None
-            self.server_socket.send(json.dumps(request).encode('utf-8'))
+            request_id = next(self.request_ids)
+            request['request_id'] = request_id
+            self.pending_requests[request_id] = (future, request)
+            try:
+                self.server_socket.sendall(self.protocol.encode(request))
+            except OSError:
+                del self.pending_requests[request_id]
+                raise
         
-        for _ in range(50):
+        # 監聽執行緒收到回覆時立即喚醒，不再輪詢
+        try:
+            return future.result(timeout=self.REQUEST_TIMEOUT)
+        except FutureTimeout:
             with self.message_lock:
-                response = self.response_queue.get(request_id)
-                if response:
-                    del self.response_queue[request_id]
-                    return response
-            time.sleep(0.1)
-        
-        return {'status': 'error', 'message': '請求超時'}
+                self.pending_requests.pop(request_id, None)
+            return {'status': 'error', 'message': '請求超時'}
+
+    def send_batch(self, requests, stop_on_error=False):
+        """把多個請求放進一個 batch，一次往返取回按順序排列的回覆
+
+        requests 是 {'action': ..., 其他參數} 的列表；沒有執行的請求（batch 失敗或前面的請求失敗）也會有錯誤回覆。
+        """
+        response = self.send_request('batch', requests=requests, stop_on_error=stop_on_error)
+        if response['status'] != 'success':
+            return [response] * len(requests)
+        responses = response['responses']
+        skipped = {'status': 'error', 'message': '前面的請求失敗，沒有執行'}
+        return responses + [skipped] * (len(requests) - len(responses))
+
+    def fail_pending(self, message):
+        """連線中斷：舊連線上的請求不會再有回覆，讓等待的執行緒立即返回"""
+        with self.message_lock:
+            pending, self.pending_requests = self.pending_requests, {}
+        for future, _ in pending.values():
+            future.set_result({'status': 'error', 'message': message})
 
     def register(self, username, password):
         return self.send_request('register', username=username, password=password)
 
+    def send_nowait(self, action, **kwargs):
+        """只發送請求不等待回覆"""
+        request = {'action': action}
+        request.update(kwargs)
+        with self.message_lock:
+            self.server_socket.sendall(self.protocol.encode(request))
+
     def login(self, username, password):
-        return self.send_request('login', username=username, password=password)
+        """登錄，並在同一個 batch 中取回登錄後要顯示的房間列表，之後用 list_rooms(response=self.rooms_response) 顯示"""
+        request = {'action': 'login', 'username': username, 'password': password}
+        # 之前登錄過時帶上本地版本，服務器只返回這段時間的增量
+        if self.presence_version is not None:
+            request['presence_version'] = self.presence_version
+            request['presence_epoch'] = self.presence_epoch
+        responses = self.send_batch([request, {'action': 'list_rooms'}], stop_on_error=True)
+        response = responses[0]
+        if response['status'] == 'success':
+            self.apply_login(response)
+            self.rooms_response = responses[1]
+        return response
+
+    def apply_login(self, response):
+        """記錄登錄或恢復會話後的令牌，並更新本地的在線玩家列表"""
+        self.session_token = response.get('session_token')
+        self.presence_epoch = response.get('presence_epoch')
+        if 'changes' in response:
+            self.apply_presence(response['presence_version'], changes=response['changes'],
+                                from_version=self.presence_version)
+        else:
+            self.apply_presence(response['presence_version'], players=response.get('players', {}))
+
+    def apply_presence(self, version, players=None, changes=None, from_version=None):
+        """套用快照或增量；增量與本地版本不連續時返回 False"""
+        with self.presence_lock:
+            if players is not None:
+                self.online_players = dict(players)
+                self.presence_version = version
+                return True
+            if self.presence_version is None or version <= self.presence_version:
+                return True  # 還沒有快照，或已經包含在本地版本中
+            if from_version > self.presence_version:
+                return False
+            for user, status in changes.items():
+                if status is None:
+                    self.online_players.pop(user, None)
+                else:
+                    self.online_players[user] = status
+            self.presence_version = version
+            return True
+
+    def handle_presence(self, message):
+        if message.get('reset'):
+            self.apply_presence(message['version'], players=message['players'])
+        elif not self.apply_presence(message['version'], changes=message['changes'],
+                                     from_version=message['from_version']):
+            # 漏掉了部分增量，從本地版本補齊；回覆同樣是 presence 推送
+            self.send_nowait('sync_presence', since=self.presence_version, epoch=self.presence_epoch)
 
     def logout(self, username):
-        return self.send_request('logout', username=username)
+        response = self.send_request('logout', username=username)
+        if response['status'] == 'success':
+            self.session_token = None
+        return response
+
+    def get_stats(self):
+        """查詢服務器各 action 的延遲統計"""
+        return self.send_request('stats')
 
     def show_status(self):
         response = self.send_request('status')
@@ -57,20 +162,29 @@ class Client:
             else:
                 print("目前無玩家在線")
 
-    def list_rooms(self):
-        response = self.send_request('list_rooms')
+    def list_rooms(self, cursor=None, room_status=None, response=None):
+        """列出房間；已經取回的回覆（例如登錄時一起取回的）直接顯示，不再請求"""
+        if response is None:
+            response = self.send_request('list_rooms', cursor=cursor, room_status=room_status)
         if response['status'] == 'success' and response['rooms']:
             print("-------------------------------------------------")
             print("Game rooms available:")
             for room_id, room_info in response['rooms'].items():
                 print(f"Room Name: {room_id}, Type: {room_info['type']}, Room Creator: {room_info['creator']}, Status: {room_info['status']}")
+            if response.get('next_cursor'):
+                print(f"(共 {response['total']} 個房間，僅顯示前 {len(response['rooms'])} 個)")
             print("-------------------------------------------------")
         else:
             print("-------------------------------------------------")
             print("Game rooms:\nNo game room available")
             print("-------------------------------------------------")
 
+    def list_players(self, player_status=None, cursor=None):
+        """分頁獲取在線玩家，可按狀態篩選"""
+        return self.send_request('list_players', player_status=player_status, cursor=cursor)
+
     def close(self):
+        self.closing = True
         self.server_socket.close()
 
     def create_room(self, room_type, room_name):
@@ -83,60 +197,104 @@ class Client:
             print("\n=== 等待房主開始遊戲 ===")
         return response
 
+    def finish_game(self, room_name):
+        """遊戲結束後通知大廳回收房間；在事件執行緒中調用，結果不影響之後的流程，因此只發送不等待回覆"""
+        try:
+            self.send_nowait('finish_game', room_name=room_name)
+        except Exception as e:
+            print(f"通知遊戲結束時出錯: {e}")
+
     def invite_player(self, room_name, invited_player):
         self.is_handling_invite = True
         return self.send_request('invite_player', room_name=room_name, invited_player=invited_player)
 
     def listen_for_messages(self):
-        buffer = ""
         while True:
             try:
-                data = self.server_socket.recv(1024).decode('utf-8')
+                data = self.server_socket.recv(65536)
                 if not data:
-                    break
-                
-                buffer += data
+                    raise ConnectionError('服務器關閉了連線')
                 
-                while buffer:
-                    try:
-                        message = json.loads(buffer)
-                        buffer = ""  # 清空緩衝區
-                        
-                        # 檢查是否是請求的響應
-                        if 'request_id' in message:
-                            with self.message_lock:
-                                self.response_queue[message['request_id']] = message
-                        else:
-                            # 處理服務器推送的消息
-                            self.handle_server_message(message)
-                        break
-                    except json.JSONDecodeError as e:
-                        # 檢查是否有多個JSON消息
-                        try:
-                            pos = buffer.index("}{")
-                            first_json = buffer[:pos+1]
-                            buffer = buffer[pos+1:]
-                            message = json.loads(first_json)
-                            
-                            # 檢查是否是請求的響應
-                            if 'request_id' in message:
-                                with self.message_lock:
-                                    self.response_queue[message['request_id']] = message
-                            else:
-                                # 處理服務器推送的消息
-                                self.handle_server_message(message)
-                        except ValueError:
-                            # 如果沒有找到多個JSON的分隔點，說明消息不完整
-                            break
-                        except json.JSONDecodeError:
-                            # 如果解析失敗，丟棄損壞的數據
-                            print("接收到損壞的數據，已丟棄")
-                            buffer = ""
-                            break
+                # 每條消息都帶長度前綴，一次 recv 可能包含多條或半條消息
+                for message in self.protocol.feed(data):
+                    self.dispatch_message(message)
                         
             except Exception as e:
+                if self.closing:
+                    self.fail_pending('與服務器的連線中斷')
+                    break
                 print(f"監聽錯誤: {e}")
-                break
+                # 已登錄時用會話令牌重新連線並重發等待中的請求，恢復失敗才停止監聽
+                if not self.session_token or not self.reconnect():
+                    self.fail_pending('與服務器的連線中斷')
+                    break
+
+    def dispatch_message(self, message):
+        # 檢查是否是請求的響應
+        if 'request_id' in message:
+            with self.message_lock:
+                pending = self.pending_requests.pop(message['request_id'], None)
+            if pending is not None:  # 已超時的請求直接丟棄回覆
+                pending[0].set_result(message)
+        else:
+            # 服務器推送的消息交給事件執行緒，處理時等待請求的回覆不會卡住監聽執行緒
+            self.events.put(message)
+
+    def handle_events(self):
+        while True:
+            self.handle_server_message(self.events.get())
+
+    def reconnect(self):
+        """連線中斷後重新連線，並用會話令牌恢復原來的登錄狀態，成功時返回 True"""
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            time.sleep(min(0.5 * 2 ** attempt, 5))
+            try:
+                sock = socket.create_connection(self.address, timeout=5)
+                protocol = client_handshake(sock)
+                sock.sendall(protocol.encode({
+                    'action': 'resume_session',
+                    'session_token': self.session_token,
+                    'presence_version': self.presence_version,
+                    'presence_epoch': self.presence_epoch,
+                    'request_id': 'resume_session',
+                }))
+                # 恢復回覆之前或同一批數據中可能夾著推送消息，先收起來
+                response, pushed = None, []
+                while response is None:
+                    data = sock.recv(65536)
+                    if not data:
+                        raise ConnectionError('服務器關閉了連線')
+                    for message in protocol.feed(data):
+                        if message.get('request_id') == 'resume_session':
+                            response = message
+                        else:
+                            pushed.append(message)
+                sock.settimeout(None)
+            except Exception as e:
+                print(f"重新連線失敗 ({attempt + 1}/{self.RECONNECT_ATTEMPTS}): {e}")
+                continue
+
+            if response['status'] != 'success':
+                print(f"無法恢復會話: {response['message']}")
+                self.session_token = None
+                sock.close()
+                return False
+            with self.message_lock:
+                old_socket = self.server_socket
+                self.server_socket, self.protocol = sock, protocol
+                # 斷線前發出但沒收到回覆的請求沿用原來的 request_id 重發，已經處理過的由服務器返回第一次的回覆
+                try:
+                    for _, request in self.pending_requests.values():
+                        sock.sendall(protocol.encode(request))
+                except OSError:
+                    pass  # 新連線又斷了，監聽執行緒會再次重連
+            old_socket.close()
+            self.apply_login(response)
+            print(f"\n已重新連線大廳，狀態: {response['player_status']}，請繼續上面的選擇......")
+            for message in pushed:
+                self.dispatch_message(message)
+            return True
+        return False
 
     def handle_server_message(self, message):
         try:
@@ -146,6 +304,8 @@ class Client:
                 self.handle_invite_accepted(message)
             elif message['status'] == 'game_start':
                 self.handle_game_start(message)
+            elif message['status'] == 'presence':
+                self.handle_presence(message)
         except Exception as e:
             print(f"處理消息時出錯: {e}")
 
@@ -195,6 +355,7 @@ class Client:
             game_server.start()  
             
             # 遊戲結束後
+            self.finish_game(message['room_name'])
             self.is_playing = False
             self.is_handling_invite = False
             print("\n返回大廳...")
@@ -329,7 +490,7 @@ if __name__ == "__main__":
                     print("-------------------------------------------------")
                     
                   
-                    online_players = response.get('players', {})
+                    online_players = dict(client.online_players)
                     print("Online players:")
                     if online_players:
                         if len(online_players) > 1:
@@ -337,8 +498,10 @@ if __name__ == "__main__":
                                 print(f"Username: {user}  Status: {status}")
                         else:
                             print('No other online player available')
+                        if response.get('next_cursor'):
+                            print(f"(共 {response['total']} 位玩家在線，僅顯示前 {len(online_players)} 位)")
 
-                    client.list_rooms()
+                    client.list_rooms(response=client.rooms_response)
 
                     # 修改登錄後的操作循環
                     while True:
@@ -359,8 +522,9 @@ if __name__ == "__main__":
 
                                 if room_type == 'private':
                                     print("-------------------------------------------------")
-                                    for user, status in online_players.items():
-                                        if status == 'idle':
+                                    idle_players = client.list_players('idle').get('players', {})
+                                    for user, status in idle_players.items():
+                                        if user != username:
                                             print(f"Username: {user}  Status: {status}")
                                     print("-------------------------------------------------")
                                     invitee = input("請輸入您想要邀請的玩家名稱: ")
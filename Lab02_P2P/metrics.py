@@ -0,0 +1,119 @@
+import math
+import os
+import threading
+import time
+
+
+class LatencyHistogram:
+    """對數分桶的延遲直方圖
+
+    每個 2 的冪次再細分成 SUB_BUCKETS 個桶，記錄與查詢都是 O(桶數)，
+    百分位數的相對誤差約 9%。
+    """
+
+    SUB_BUCKETS = 8
+    MIN_VALUE = 1e-6  # 1 微秒以下都算在第一個桶
+
+    def __init__(self):
+        self.counts = {}  # 桶編號 -> 次數
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= self.MIN_VALUE:
+            index = 0
+        else:
+            index = int(math.log2(seconds / self.MIN_VALUE) * self.SUB_BUCKETS) + 1
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def bucket_upper(self, index):
+        return self.MIN_VALUE * 2 ** (index / self.SUB_BUCKETS)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.bucket_upper(index), self.max)
+        return self.max
+
+
+class ActionStats:
+    """單個 action 的調用次數、錯誤次數與延遲分佈"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self):
+        latency = self.latency
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(latency.total / latency.count * 1000, 3) if latency.count else 0.0,
+            'p50_ms': round(latency.percentile(0.50) * 1000, 3),
+            'p95_ms': round(latency.percentile(0.95) * 1000, 3),
+            'p99_ms': round(latency.percentile(0.99) * 1000, 3),
+            'max_ms': round(latency.max * 1000, 3),
+        }
+
+
+class RequestMetrics:
+    """按 action 統計請求處理情況"""
+
+    def __init__(self):
+        self.actions = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, action, seconds, error=False):
+        with self.lock:
+            stats = self.actions.get(action)
+            if stats is None:
+                stats = self.actions[action] = ActionStats()
+            stats.count += 1
+            if error:
+                stats.errors += 1
+            stats.latency.record(seconds)
+
+    def wrap(self, action, handler):
+        """包裝 handler：記錄耗時，返回 error 狀態或拋出異常都算錯誤"""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = handler(*args, **kwargs)
+            except Exception:
+                self.record(action, time.perf_counter() - start, error=True)
+                raise
+            error = isinstance(response, dict) and response.get('status') == 'error'
+            self.record(action, time.perf_counter() - start, error)
+            return response
+        return timed
+
+    def snapshot(self):
+        with self.lock:
+            return {action: stats.snapshot() for action, stats in sorted(self.actions.items())}
+
+
+def current_rss_kb():
+    """當前行程的常駐記憶體 (KB)；沒有 /proc 時退回峰值，都取不到時返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
@@ -0,0 +1,153 @@
+import bisect
+import secrets
+from collections import deque
+
+
+class PresenceRegistry:
+    """在線玩家的狀態表，並按狀態維護玩家索引
+
+    用法與 username -> status 的字典相同；每種狀態另外保存一份有序的用戶名列表，
+    查找空閒玩家或分頁列出某種狀態的玩家時不需要掃描全部在線玩家。
+    分頁以用戶名作為游標，用二分查找定位。
+
+    每次變化都使版本號加一並記入有限長度的變更日誌，
+    客戶端可以從某個版本開始獲取之後的增量（狀態為 None 表示已離線）。
+    版本號每次啟動都從 0 開始，epoch 每次啟動隨機生成，用來識別版本來自哪一次運行。
+    """
+
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+    LOG_SIZE = 10000  # 保留的變更條數，更舊的版本只能重新獲取快照
+
+    def __init__(self, on_change=None):
+        self.status = {}  # username -> status
+        self.by_status = {}  # status -> 有序的用戶名列表
+        self.everyone = []  # 全部在線玩家，有序
+        self.version = 0
+        self.epoch = secrets.token_hex(4)  # 本次運行的標識，區分重啟前後的版本號
+        self.log = deque(maxlen=self.LOG_SIZE)  # (version, username, status)
+        self.on_change = on_change  # 每次變化後調用
+
+    def __contains__(self, username):
+        return username in self.status
+
+    def __getitem__(self, username):
+        return self.status[username]
+
+    def __len__(self):
+        return len(self.status)
+
+    def get(self, username, default=None):
+        return self.status.get(username, default)
+
+    def items(self):
+        return self.status.items()
+
+    def __setitem__(self, username, status):
+        old = self.status.get(username)
+        if old == status:
+            return
+        if old is None:
+            bisect.insort(self.everyone, username)
+        else:
+            self._unindex(self.by_status, old, username)
+        bisect.insort(self.by_status.setdefault(status, []), username)
+        self.status[username] = status
+        self._record(username, status)
+
+    def __delitem__(self, username):
+        status = self.status.pop(username)
+        self._unindex(self.by_status, status, username)
+        i = bisect.bisect_left(self.everyone, username)
+        del self.everyone[i]
+        self._record(username, None)
+
+    def _record(self, username, status):
+        self.version += 1
+        self.log.append((self.version, username, status))
+        if self.on_change is not None:
+            self.on_change()
+
+    def changes_since(self, version):
+        """返回 version 之後每個玩家的最新狀態；日誌已不包含這些變化時返回 None"""
+        if version > self.version:
+            return None
+        if version < self.version and (not self.log or self.log[0][0] > version + 1):
+            return None
+        changes = {}
+        for entry_version, username, status in reversed(self.log):
+            if entry_version <= version:
+                break
+            changes.setdefault(username, status)
+        return changes
+
+    def _unindex(self, indexes, key, username):
+        names = indexes[key]
+        i = bisect.bisect_left(names, username)
+        if i < len(names) and names[i] == username:
+            del names[i]
+        if not names:
+            del indexes[key]
+
+    def count(self, status=None):
+        if status is None:
+            return len(self.status)
+        return len(self.by_status.get(status, ()))
+
+    def counts(self):
+        return {status: len(names) for status, names in self.by_status.items()}
+
+    def list_page(self, status=None, cursor=None, limit=None):
+        """返回一頁玩家 {username: status}，next_cursor 為下一頁的游標（沒有下一頁時為 None）"""
+        names = self.by_status.get(status, []) if status else self.everyone
+        limit = min(max(int(limit or self.DEFAULT_PAGE_SIZE), 1), self.MAX_PAGE_SIZE)
+        start = bisect.bisect_right(names, cursor) if cursor else 0
+        page = names[start:start + limit]
+        return {
+            'players': {username: self.status[username] for username in page},
+            'total': len(names),
+            'next_cursor': page[-1] if start + limit < len(names) else None,
+        }
+
+
+class PresenceFeed:
+    """把一個時間窗口內的在線狀態變化合併成一條增量推送
+
+    推送格式: {'status': 'presence', 'from_version': 舊版本, 'version': 新版本,
+    'changes': {username: status 或 None}}。
+    客戶端發現 from_version 與本地版本不連續時，用 sync_presence 從本地版本補齊。
+    """
+
+    def __init__(self, presence, deliver, call_later, window=0.05):
+        self.presence = presence
+        self.deliver = deliver  # deliver(message) -> 收到推送的客戶端數
+        self.call_later = call_later
+        self.window = window
+        self.pushed_version = presence.version
+        self.scheduled = False
+        self.pushes = 0
+
+    def changed(self):
+        if self.window <= 0:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.call_later(self.window, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if self.pushed_version == self.presence.version:
+            return
+        message = self.delta(self.pushed_version, self.presence.epoch)
+        self.pushed_version = self.presence.version
+        self.deliver(message)
+        self.pushes += 1
+
+    def delta(self, since, epoch=None):
+        """從 since 到當前版本的增量；日誌不夠或 since 來自之前的運行時返回第一頁快照並標記 reset"""
+        changes = self.presence.changes_since(since) if epoch == self.presence.epoch else None
+        if changes is None:
+            return {'status': 'presence', 'reset': True, 'version': self.presence.version,
+                    **self.presence.list_page()}
+        return {'status': 'presence', 'from_version': since, 'version': self.presence.version,
+                'changes': changes}
@@ -0,0 +1,143 @@
+import codecs
+import json
+import socket
+import struct
+
+# 連線建立後客戶端先送出 FRAME_MAGIC + 編碼代號，服務器回覆相同格式確認。
+# 之後每條消息都是 4 字節大端長度 + 內容。
+# 沒有送出前導碼的舊版客戶端仍然使用直接串接的 JSON。
+FRAME_MAGIC = b'NPF1'
+HELLO_SIZE = len(FRAME_MAGIC) + 1
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+CODEC_JSON = 0
+
+
+class ProtocolError(Exception):
+    """收到不符合協議的數據"""
+
+
+def encode_frame(payload):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f'消息過大: {len(payload)} bytes')
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """增量解析 長度 + 內容 的幀
+
+    每次 feed 只從上次停下的位置往後讀取幀頭，已解析的數據直接從緩衝區前端刪除，
+    大消息分多次到達時不會重複掃描已收到的內容。
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.expected = None  # 當前幀的內容長度（已讀到幀頭時）
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        end = len(buffer)
+        while True:
+            if self.expected is None:
+                if end - pos < HEADER.size:
+                    break
+                (self.expected,) = HEADER.unpack_from(buffer, pos)
+                if self.expected > self.max_frame_size:
+                    raise ProtocolError(f'幀長度超出上限: {self.expected} bytes')
+                pos += HEADER.size
+            if end - pos < self.expected:
+                break
+            frames.append(bytes(buffer[pos:pos + self.expected]))
+            pos += self.expected
+            self.expected = None
+        if pos:
+            del buffer[:pos]
+        return frames
+
+
+class FramedProtocol:
+    """長度前綴分幀 + JSON 內容"""
+
+    framed = True
+
+    def __init__(self, codec_id=CODEC_JSON):
+        self.codec_id = codec_id
+        self.decoder = FrameDecoder()
+
+    def encode(self, message):
+        return encode_frame(json.dumps(message).encode('utf-8'))
+
+    def feed(self, data):
+        return [json.loads(payload) for payload in self.decoder.feed(data)]
+
+
+class LegacyProtocol:
+    """舊版協議：直接串接的 JSON 物件，沒有長度信息"""
+
+    framed = False
+    max_buffer_size = 1024 * 1024
+
+    def __init__(self):
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+
+    def encode(self, message):
+        return json.dumps(message).encode('utf-8')
+
+    def feed(self, data):
+        self.buffer += self.text_decoder.decode(data)
+        messages = []
+        pos = 0
+        while pos < len(self.buffer):
+            while pos < len(self.buffer) and self.buffer[pos].isspace():
+                pos += 1
+            if pos == len(self.buffer):
+                break
+            try:
+                message, pos = self.json_decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                break  # 消息不完整，等待更多數據
+            messages.append(message)
+        self.buffer = self.buffer[pos:]
+        if len(self.buffer) > self.max_buffer_size:
+            raise ProtocolError('未完成的消息過大')
+        return messages
+
+
+def hello(codec_id=CODEC_JSON):
+    return FRAME_MAGIC + bytes([codec_id])
+
+
+def detect_protocol(data):
+    """服務器端：根據連線最先收到的數據判斷協議
+
+    返回 (protocol, 需要回覆的握手數據, 剩餘數據)；數據不足以判斷時返回 None。
+    """
+    if data[:len(FRAME_MAGIC)] == FRAME_MAGIC[:len(data)]:
+        if len(data) < HELLO_SIZE:
+            return None
+        # 目前只支持 JSON，未知的編碼代號回退到 JSON
+        protocol = FramedProtocol(CODEC_JSON)
+        return protocol, hello(protocol.codec_id), data[HELLO_SIZE:]
+    return LegacyProtocol(), b'', data
+
+
+def client_handshake(sock, codec_id=CODEC_JSON):
+    """客戶端：送出前導碼並等待服務器確認，返回協商好的協議"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 消息都很小，不等延遲確認
+    sock.sendall(hello(codec_id))
+    reply = b''
+    while len(reply) < HELLO_SIZE:
+        data = sock.recv(HELLO_SIZE - len(reply))
+        if not data:
+            raise ProtocolError('服務器在握手時關閉連線')
+        reply += data
+    if reply[:len(FRAME_MAGIC)] != FRAME_MAGIC:
+        raise ProtocolError('服務器不支持分幀協議')
+    return FramedProtocol(reply[-1])
@@ -0,0 +1,37 @@
+from collections import OrderedDict
+
+
+class ReplayCache:
+    """最近處理過的請求：request_id -> 回覆
+
+    客戶端重發請求（例如斷線重連後重發還沒收到回覆的請求）時沿用原來的 request_id，
+    服務器直接返回第一次的回覆，join_room、register 之類的請求不會被執行兩次。
+    只保留最近 capacity 個請求，每個會話的記憶體佔用有上限。
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.responses = OrderedDict()  # request_id -> 回覆，還在處理中時為 None
+
+    def __contains__(self, request_id):
+        return request_id in self.responses
+
+    def get(self, request_id):
+        """返回第一次的回覆；請求還在處理中（例如在等密碼雜湊）時返回 None"""
+        return self.responses.get(request_id)
+
+    def begin(self, request_id):
+        self.responses[request_id] = None
+        while len(self.responses) > self.capacity:
+            self.responses.popitem(last=False)
+
+    def finish(self, request_id, response):
+        if request_id in self.responses:
+            self.responses[request_id] = response
+
+    def discard(self, request_id):
+        """處理失敗時移除，重發的請求重新執行"""
+        self.responses.pop(request_id, None)
+
+    def __len__(self):
+        return len(self.responses)
@@ -0,0 +1,168 @@
+import bisect
+import time
+
+# 房間生命週期: waiting -> playing -> finished / abandoned，結束後立即回收
+ROOM_STATES = ('waiting', 'playing', 'finished', 'abandoned')
+
+
+class RoomRegistry:
+    """房間存儲，並為公開房間維護索引
+
+    每個房間創建時分配遞增的序號，公開房間按序號保存在有序列表中：
+    全部公開房間、按狀態、按創建者各一份。
+    分頁時以序號作為游標，用二分查找定位，成本只與頁大小有關，與房間總數無關。
+    另外記錄每個玩家所在的房間和每個房間進入當前狀態的時間，供回收使用。
+    """
+
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
+    def __init__(self):
+        self.rooms = {}  # room_name -> room
+        self.seqs = {}  # room_name -> 序號
+        self.names = {}  # 序號 -> room_name
+        self.next_seq = 1
+        self.indexes = {}  # 索引鍵 -> 有序的序號列表
+        self.version = 0  # 公開房間列表每次變化都加一，用於判斷快取是否失效
+        self.player_rooms = {}  # username -> 所在的房間名稱集合
+        self.since = {}  # room_name -> 進入當前狀態的時間 (time.monotonic)
+        self.status_counts = dict.fromkeys(ROOM_STATES, 0)
+        self.reclaimed = {}  # 回收原因 -> 次數
+
+    def __contains__(self, room_name):
+        return room_name in self.rooms
+
+    def __getitem__(self, room_name):
+        return self.rooms[room_name]
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, room_name, default=None):
+        return self.rooms.get(room_name, default)
+
+    def items(self):
+        return self.rooms.items()
+
+    def create(self, room_name, room_type, creator):
+        room = {
+            'type': room_type,
+            'status': 'waiting',
+            'players': [creator],
+            'creator': creator,
+            'invited_players': []
+        }
+        seq = self.next_seq
+        self.next_seq += 1
+        self.rooms[room_name] = room
+        self.seqs[room_name] = seq
+        self.names[seq] = room_name
+        self.since[room_name] = time.monotonic()
+        self.status_counts['waiting'] += 1
+        self.player_rooms.setdefault(creator, set()).add(room_name)
+        if room_type == 'public':
+            for key in self.index_keys(room):
+                self.indexes.setdefault(key, []).append(seq)  # 新序號最大，直接追加仍然有序
+            self.version += 1
+        return room
+
+    def add_player(self, room_name, username):
+        self.rooms[room_name]['players'].append(username)
+        self.player_rooms.setdefault(username, set()).add(room_name)
+
+    def rooms_of(self, username):
+        return list(self.player_rooms.get(username, ()))
+
+    def set_status(self, room_name, status):
+        room = self.rooms[room_name]
+        if room['status'] == status:
+            return
+        if room['type'] == 'public':
+            seq = self.seqs[room_name]
+            self.unindex(('status', room['status']), seq)
+            bisect.insort(self.indexes.setdefault(('status', status), []), seq)
+            self.version += 1
+        self.status_counts[room['status']] -= 1
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        room['status'] = status
+        self.since[room_name] = time.monotonic()
+
+    def remove(self, room_name, reason=None):
+        room = self.rooms.pop(room_name, None)
+        if room is None:
+            return None
+        seq = self.seqs.pop(room_name)
+        del self.names[seq]
+        del self.since[room_name]
+        self.status_counts[room['status']] -= 1
+        if reason:
+            self.reclaimed[reason] = self.reclaimed.get(reason, 0) + 1
+        for player in set(room['players']) | {room['creator']}:
+            names = self.player_rooms.get(player)
+            if names is not None:
+                names.discard(room_name)
+                if not names:
+                    del self.player_rooms[player]
+        if room['type'] == 'public':
+            for key in self.index_keys(room):
+                self.unindex(key, seq)
+            self.version += 1
+        return room
+
+    def expired(self, ttls, now=None):
+        """返回在某個狀態停留超過 ttls[狀態] 秒的房間"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        for room_name, since in self.since.items():
+            ttl = ttls.get(self.rooms[room_name]['status'])
+            if ttl is not None and now - since > ttl:
+                expired.append(room_name)
+        return expired
+
+    def counts(self):
+        return {'total': len(self.rooms), **self.status_counts}
+
+    def index_keys(self, room):
+        return [('all',), ('status', room['status']), ('creator', room['creator'])]
+
+    def unindex(self, key, seq):
+        seqs = self.indexes.get(key)
+        if not seqs:
+            return
+        i = bisect.bisect_left(seqs, seq)
+        if i < len(seqs) and seqs[i] == seq:
+            del seqs[i]
+        if not seqs:
+            del self.indexes[key]
+
+    def list_public(self, status=None, creator=None, cursor=None, limit=None):
+        """返回一頁公開房間，next_cursor 為下一頁的游標（沒有下一頁時為 None）"""
+        if status and creator:
+            # 兩個條件同時存在時，在較小的索引上過濾
+            by_status = self.indexes.get(('status', status), [])
+            by_creator = self.indexes.get(('creator', creator), [])
+            seqs = by_creator if len(by_creator) <= len(by_status) else by_status
+            other = 'status' if seqs is by_creator else 'creator'
+            value = status if other == 'status' else creator
+            seqs = [seq for seq in seqs if self.rooms[self.names[seq]][other] == value]
+        elif status:
+            seqs = self.indexes.get(('status', status), [])
+        elif creator:
+            seqs = self.indexes.get(('creator', creator), [])
+        else:
+            seqs = self.indexes.get(('all',), [])
+
+        limit = min(max(int(limit or self.DEFAULT_PAGE_SIZE), 1), self.MAX_PAGE_SIZE)
+        start = bisect.bisect_right(seqs, int(cursor)) if cursor else 0
+        page = seqs[start:start + limit]
+
+        rooms = {}
+        for seq in page:
+            room_name = self.names[seq]
+            room = self.rooms[room_name]
+            rooms[room_name] = {'type': room['type'], 'creator': room['creator'], 'status': room['status']}
+        return {
+            'rooms': rooms,
+            'total': len(seqs),
+            'next_cursor': page[-1] if start + limit < len(seqs) else None,
+        }
@@ -1,106 +1,254 @@
 import socket
 import threading
-import json
+import argparse
+import asyncio
+import time
+from connection import ThreadedConnection, AsyncConnection
+from metrics import RequestMetrics, current_rss_kb
+from rooms import RoomRegistry
+from presence import PresenceRegistry, PresenceFeed
+from sessions import SessionRegistry
 
 class LobbyServer:
-    def __init__(self, host='127.0.0.1', port=12345):
+    SWEEP_INTERVAL = 30  # 秒，檢查超時房間的間隔
+    PRESENCE_WINDOW = 0.05  # 秒，合併在線狀態變化的時間窗口
+    MAX_BATCH = 32  # 一個 batch 請求最多包含的子請求數
+    # 會改變狀態的請求：重發時返回第一次的回覆，不再執行一次；只讀的請求重新執行即可
+    REPLAYED_ACTIONS = frozenset({
+        'register', 'login', 'logout', 'resume_session', 'create_room', 'join_room', 'invite_player',
+        'respond_to_invite', 'set_game_server', 'finish_game', 'batch',
+    })
+
+    def __init__(self, host='127.0.0.1', port=12345, verbose=False, waiting_ttl=600, playing_ttl=7200,
+                 session_grace=30):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((host, port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(1024)
+        self.lock = threading.RLock()  # 執行緒模式下保護共享狀態
         self.players = {}  # Stores usernames and passwords
-        self.player_status = {}  # Stores player statuses
-        self.client_sockets = {}  # Stores connected clients
-        self.rooms = {}  # Stores room information
+        self.player_status = PresenceRegistry()  # Stores player statuses (並按狀態索引)
+        self.client_sockets = {}  # Stores connected clients (username -> connection)
+        self.rooms = RoomRegistry()  # Stores room information
+        self.room_list_cache = {}  # (篩選條件, 游標, 頁大小) -> list_rooms 回覆
+        self.room_list_version = self.rooms.version
         self.game_servers = {}  # 存储游戏服务器信息
+        self.room_ttls = {'waiting': waiting_ttl, 'playing': playing_ttl}  # 房間在各狀態最多停留的秒數
+        self.loop = None  # asyncio 模式下的事件迴圈
+        self.presence_feed = PresenceFeed(self.player_status, self.broadcast, self.call_later, self.PRESENCE_WINDOW)
+        self.player_status.on_change = self.presence_feed.changed  # 在線狀態變化以增量推送
+        self.verbose = verbose  # 是否打印每個請求
+        self.sessions = SessionRegistry(self.call_later, self.logout, session_grace)  # 斷線後可在寬限期內恢復
+        self.metrics = RequestMetrics()
+        self.handlers = {}  # action -> handler
+        self.replayed = 0  # 重發的請求直接返回快取回覆的次數
+        self.setup_handlers()
 
-    def send_message(self, client_socket, message):
+    def send_message(self, connection, message):
         try:
-            message_str = json.dumps(message)
-            client_socket.send(message_str.encode('utf-8'))
+            connection.send_message(message)
         except Exception as e:
             print(f"發送消息時出錯: {e}")
 
-    def handle_client(self, client_socket):
-        username = None
+    def handle_client(self, client_socket, addr=None):
+        """執行緒模式：每個連線一個執行緒，阻塞讀取請求"""
+        connection = ThreadedConnection(client_socket, addr)
         while True:
             try:
-                request = client_socket.recv(1024).decode('utf-8')
-                if not request:
+                data = client_socket.recv(65536)
+                if not data:
                     break  # Client has disconnected
-                response = self.process_request(request, client_socket, username)
-                
-                # Update username if successfully logged in
-                if response and response['status'] == 'success' and 'username' in response:
-                    username = response['username']
-                
-                if response:
-                    self.send_message(client_socket, response)
+                for request in connection.receive(data):
+                    with self.lock:
+                        response = self.process_request(request, connection)
+                    if response:
+                        self.send_message(connection, response)
             except Exception as e:
                 print(f"處理客戶端請求時出錯: {e}")
                 break
-        
+
         # Clean up after client disconnects
-        if username:
-            self.logout(username)
-        client_socket.close()
+        with self.lock:
+            self.disconnect(connection)
 
-    def process_request(self, request, client_socket, username):
-        data = json.loads(request)
+    async def handle_client_async(self, reader, writer):
+        """asyncio 模式：所有連線共用一個事件迴圈，閒置連線只佔用一個協程"""
+        connection = AsyncConnection(reader, writer)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break  # Client has disconnected
+                for request in connection.receive(data):
+                    response = self.process_request(request, connection)
+                    if response:
+                        self.send_message(connection, response)
+                await connection.drain()
+        except Exception as e:
+            print(f"處理客戶端請求時出錯: {e}")
+        finally:
+            self.disconnect(connection)
+
+    def disconnect(self, connection):
+        """連線斷開：有會話令牌時保留玩家狀態等待重新連線，否則直接登出"""
+        username = connection.username
+        if username and self.client_sockets.get(username) is connection:
+            del self.client_sockets[username]  # 寬限期內不再向這個連線推送
+            if not self.sessions.detach(username):
+                self.logout(username)
+        connection.close()
+
+    def setup_handlers(self):
+        """建立 action -> handler 的分派表，每個 handler 都包裝了耗時統計"""
+        handlers = {
+            'register': lambda data, conn: self.register(data['username'], data['password'], conn),
+            'login': lambda data, conn: self.login(data['username'], data['password'], conn, self.presence_since(data)),
+            'logout': lambda data, conn: self.logout(conn.username),
+            'resume_session': lambda data, conn: self.resume_session(
+                data['session_token'], conn, self.presence_since(data)),
+            'create_room': lambda data, conn: self.create_room(data['room_type'], conn.username, data['room_name']),
+            'join_room': lambda data, conn: self.join_room(data['room_name'], conn.username),
+            'list_rooms': lambda data, conn: self.list_rooms(
+                data.get('room_status'), data.get('creator'), data.get('cursor'), data.get('limit')),
+            'sync_presence': lambda data, conn: self.presence_feed.delta(int(data['since']), data.get('epoch')),
+            'list_players': lambda data, conn: self.list_players(
+                data.get('player_status'), data.get('cursor'), data.get('limit')),
+            'invite_player': lambda data, conn: self.invite_player(data['room_name'], conn.username, data['invited_player']),
+            'respond_to_invite': lambda data, conn: self.handle_invite_response(data['room_name'], conn.username, data['response']),
+            'set_game_server': lambda data, conn: self.set_game_server(data['room_name'], data['ip'], data['port']),
+            'get_game_server': lambda data, conn: self.get_game_server(data['room_name']),
+            'finish_game': lambda data, conn: self.finish_game(data['room_name'], conn.username),
+            'stats': lambda data, conn: self.get_stats(),
+            'batch': lambda data, conn: self.process_batch(data['requests'], conn, data.get('stop_on_error', False)),
+        }
+        for action, handler in handlers.items():
+            self.handlers[action] = self.metrics.wrap(action, handler)
+
+    def process_request(self, data, connection):
         action = data.get('action')
         request_id = data.get('request_id')  
 
-        print(f"Received request: {data}")
-        if action == 'register':
-            response = self.register(data['username'], data['password'], client_socket)
-        elif action == 'login':
-            response = self.login(data['username'], data['password'], client_socket)
-        elif action == 'logout':
-            response = self.logout(username)
-        elif action == 'create_room':
-            response = self.create_room(data['room_type'], username, data['room_name'])
-        elif action == 'join_room':
-            response = self.join_room(data['room_name'], username)
-        elif action == 'list_rooms':
-            response = self.list_rooms()
-        elif action == 'invite_player':
-            response = self.invite_player(data['room_name'], username, data['invited_player'])
-        elif action == 'respond_to_invite':
-            response = self.handle_invite_response(data['room_name'], username, data['response'])
-        elif action == 'set_game_server':
-            response = self.set_game_server(data['room_name'], data['ip'], data['port'])
-        elif action == 'get_game_server':
-            response = self.get_game_server(data['room_name'])
+        if self.verbose:
+            print(f"Received request: {data}")
+        replay = connection.replay if request_id is not None and action in self.REPLAYED_ACTIONS else None
+        if replay is not None:
+            if request_id in replay:
+                self.replayed += 1  # 重發的請求，返回第一次的回覆
+                return replay.get(request_id)
+            replay.begin(request_id)
+
+        handler = self.handlers.get(action)
+        if handler is not None:
+            try:
+                response = handler(data, connection)
+            except (KeyError, TypeError, ValueError) as e:
+                response = {'status': 'error', 'message': f'請求格式錯誤: {e!r}'}  # 缺少字段或參數類型不對
+            except Exception:
+                if replay is not None:
+                    replay.discard(request_id)  # 不能讓這個 request_id 一直停在處理中
+                raise
         else:
+            self.metrics.record('invalid', 0.0, error=True)
             response = {'status': 'error', 'message': 'Invalid action.'}
+
+        # Update username if successfully logged in
+        if response['status'] == 'success' and 'username' in response:
+            connection.username = response['username']
+        elif action == 'logout' and response['status'] == 'success':
+            connection.username = None
         
         # 在響應中加入請求ID
         if request_id:
             response['request_id'] = request_id
-        
+
+        if replay is not None:
+            replay.finish(request_id, response)
         return response
 
-    def register(self, username, password, client_socket):
+    def process_batch(self, requests, connection, stop_on_error=False):
+        """按順序執行一組子請求，合併成一個回覆，一次往返完成登錄、列出房間等多個操作
+
+        子請求與單獨發送時的處理完全相同，前面的 login 成功後，後面的子請求已是登錄狀態。
+        stop_on_error 為真時，遇到第一個失敗的子請求就不再執行後面的請求。
+        """
+        if not isinstance(requests, list) or len(requests) > self.MAX_BATCH:
+            return {'status': 'error', 'message': f'batch 必須是最多 {self.MAX_BATCH} 個請求的列表'}
+        responses = []
+        for request in requests:
+            if not isinstance(request, dict) or request.get('action') == 'batch':
+                response = {'status': 'error', 'message': 'Invalid action.'}
+            else:
+                response = self.process_request(request, connection) or {
+                    'status': 'error', 'message': '相同 request_id 的請求還在處理中'}
+            responses.append(response)
+            if stop_on_error and response['status'] == 'error':
+                break
+        return {'status': 'success', 'responses': responses}
+
+    def register(self, username, password, connection):
         if username in self.players:
             return {'status': 'error', 'message': 'User already exists.'}
         self.players[username] = password
         return {'status': 'success', 'message': 'Registration successful.'}
 
-    def login(self, username, password, client_socket):
+    def login(self, username, password, connection, presence_version=None):
         if username not in self.players:
             return {'status': 'error', 'message': 'User does not exist.'}
         elif self.players[username] != password:
             return {'status': 'error', 'message': 'Incorrect password.'}
         else:
+            if username not in self.client_sockets and username in self.player_status:
+                self.abandon_rooms(username)  # 斷線後沒有恢復會話而是重新登錄，之前的房間作廢
             self.player_status[username] = 'idle' 
-            self.client_sockets[username] = client_socket
+            self.client_sockets[username] = connection
             return {
                 'status': 'success', 
                 'message': 'Login successful.', 
-                'players': self.get_all_players(),
-                'username': username 
+                'username': username,
+                'session_token': self.sessions.issue(username, connection.replay),
+                **self.presence_snapshot(presence_version),
             }
 
+    def presence_snapshot(self, presence_version=None):
+        """客戶端帶著上次的版本時只返回增量，否則返回第一頁快照（其餘用 list_players 分頁獲取）"""
+        snapshot = {'presence_version': self.player_status.version, 'presence_epoch': self.player_status.epoch}
+        changes = None if presence_version is None else self.player_status.changes_since(int(presence_version))
+        if changes is not None:
+            snapshot['changes'] = changes
+        else:
+            snapshot.update(self.player_status.list_page())
+        return snapshot
+
+    def presence_since(self, data):
+        """請求中客戶端上次看到的在線狀態版本；來自服務器之前的運行（epoch 不同）時當作沒有"""
+        if data.get('presence_epoch') != self.player_status.epoch:
+            return None
+        return data.get('presence_version')
+
+    def resume_session(self, token, connection, presence_version=None):
+        """用會話令牌恢復斷線前的登錄狀態：狀態和房間都不變，也不廣播上下線"""
+        username = self.sessions.resume(token)
+        if username is None:
+            return {'status': 'error', 'message': '會話已過期，請重新登錄'}
+        old = self.client_sockets.get(username)
+        if old is not None and old is not connection:
+            old.username = None  # 服務器還沒發現舊連線已斷開，關閉時不要再清理
+            old.close()
+        self.client_sockets[username] = connection
+        connection.replay = self.sessions.replays[token]  # 斷線前發出、重連後重發的請求在這裡找到回覆
+        return {
+            'status': 'success',
+            'message': 'Session resumed.',
+            'username': username,
+            'session_token': token,
+            'player_status': self.player_status.get(username),
+            'rooms': self.rooms.rooms_of(username),
+            **self.presence_snapshot(presence_version),
+        }
+
     def logout(self, username):
+        self.sessions.revoke(username)
+        self.abandon_rooms(username)
         if username in self.client_sockets:
             del self.client_sockets[username]
         if username in self.player_status:
@@ -109,19 +257,16 @@ class LobbyServer:
         #del self.players[username]  
         return {'status': 'success', 'message': 'Logout successful.'}
 
-    def get_all_players(self):
-        return {username: status for username, status in self.player_status.items()}
+    def list_players(self, status=None, cursor=None, limit=None):
+        """分頁列出在線玩家，可按狀態篩選（例如只列出 idle 的玩家）"""
+        return {'status': 'success', **self.player_status.list_page(status, cursor, limit)}
 
     def create_room(self, room_type, creator, room_name):
         if not creator:
             return {'status': 'error', 'message': 'User must be logged in to create a room.'}
-        self.rooms[room_name] = {
-            'type': room_type,
-            'status': 'waiting',
-            'players': [creator],
-            'creator': creator,
-            'invited_players':[]
-        }
+        if room_name in self.rooms:
+            return {'status': 'error', 'message': 'Room already exists.'}
+        self.rooms.create(room_name, room_type, creator)
         self.player_status[creator] = 'in room'
         return {'status': 'success', 'message': f'{room_name} created as {room_type} room.'}
 
@@ -134,9 +279,9 @@ class LobbyServer:
         
         room = self.rooms[room_name]
         if room['status'] == 'waiting':
-            room['players'].append(username)
+            self.rooms.add_player(room_name, username)
             if len(room['players']) > 1:
-                room['status'] = 'playing'
+                self.rooms.set_status(room_name, 'playing')
                 for player in room['players']:
                     self.player_status[player] = 'playing'
                 
@@ -148,19 +293,24 @@ class LobbyServer:
                         'room_name': room_name,
                         'player': username
                     }
-                    self.client_sockets[creator].send(json.dumps(accept_message).encode('utf-8'))
+                    self.send_message(self.client_sockets[creator], accept_message)
                 
             return {'status': 'success', 'message': f'Joined {room_name}.'}
         else:
             return {'status': 'error', 'message': 'Room is already in game.'}
 
-    def list_rooms(self):
-        available_rooms = {
-            room_name: {'type': room['type'], 'creator': room['creator'], 'status': room['status']}
-            for room_name, room in self.rooms.items() if room['type'] == 'public'
-
-        }
-        return {'status': 'success', 'rooms': available_rooms}
+    def list_rooms(self, room_status=None, creator=None, cursor=None, limit=None):
+        """分頁列出公開房間，同一頁的回覆在房間變化前只構建一次"""
+        if self.room_list_version != self.rooms.version:
+            self.room_list_cache.clear()
+            self.room_list_version = self.rooms.version
+        key = (room_status, creator, cursor, limit)
+        response = self.room_list_cache.get(key)
+        if response is None:
+            response = {'status': 'success', **self.rooms.list_public(room_status, creator, cursor, limit)}
+            if len(self.room_list_cache) < 256:
+                self.room_list_cache[key] = response
+        return dict(response)  # 淺拷貝，請求 ID 不能寫進快取
     
     def invite_player(self, room_name, inviter, invited_player):
         if room_name not in self.rooms:
@@ -180,15 +330,23 @@ class LobbyServer:
                 'room_name': room_name,
                 'inviter': inviter
             }
-            self.client_sockets[invited_player].send(json.dumps(invite_message).encode('utf-8'))
+            self.send_message(self.client_sockets[invited_player], invite_message)
             room['invited_players'].append(invited_player)
             return {'status': 'success', 'message': f'已向 {invited_player} 发送邀请'}
         return {'status': 'error', 'message': '玩家不在线'}
 
     def handle_invite_response(self, room_name, username, response):
+        if room_name not in self.rooms:
+            return {'status': 'error', 'message': '房间不存在'}
+        room = self.rooms[room_name]
+        if username not in room['invited_players'] or room['status'] != 'waiting':
+            return {'status': 'error', 'message': '邀请已失效'}  # 没有收到邀请，或房间已开始游戏
+        room['invited_players'].remove(username)
         if response:  # 接受邀请
-            room = self.rooms[room_name]
-            room['players'].append(username)
+            self.rooms.add_player(room_name, username)
+            self.rooms.set_status(room_name, 'playing')
+            for player in room['players']:
+                self.player_status[player] = 'playing'
             # 通知房主邀请已被接受
             creator = room['creator']
             if creator in self.client_sockets:
@@ -197,11 +355,13 @@ class LobbyServer:
                     'room_name': room_name,
                     'player': username
                 }
-                self.client_sockets[creator].send(json.dumps(accept_message).encode('utf-8'))
+                self.send_message(self.client_sockets[creator], accept_message)
             return {'status': 'success', 'message': '已接受邀请'}
         return {'status': 'error', 'message': '已拒绝邀请'}
 
     def set_game_server(self, room_name, ip, port):
+        if room_name not in self.rooms:
+            return {'status': 'error', 'message': '房间不存在'}
         self.game_servers[room_name] = {'ip': ip, 'port': port}
         # 通知所有房間玩家遊戲服務器信息
         room = self.rooms[room_name]
@@ -212,7 +372,7 @@ class LobbyServer:
                     'ip': ip,
                     'port': port
                 }
-                self.client_sockets[player].send(json.dumps(server_info).encode('utf-8'))
+                self.send_message(self.client_sockets[player], server_info)
         return {'status': 'success', 'message': '遊戲服務器信息已設置'}
 
     def get_game_server(self, room_name):
@@ -220,17 +380,148 @@ class LobbyServer:
             return {'status': 'success', 'server_info': self.game_servers[room_name]}
         return {'status': 'error', 'message': '游戏服务器信息不存在'}
 
+    def finish_game(self, room_name, username):
+        """房間內的玩家回報遊戲結束，房間立即回收"""
+        room = self.rooms.get(room_name)
+        if room is None:
+            return {'status': 'success', 'message': '房間已回收'}  # 另一位玩家已經回報過
+        if username not in room['players']:
+            return {'status': 'error', 'message': '你不在這個房間中'}
+        self.close_room(room_name, 'finished')
+        return {'status': 'success', 'message': f'{room_name} 遊戲結束'}
+
+    def close_room(self, room_name, state, reason=None):
+        """房間進入終止狀態 (finished / abandoned) 後回收：刪除房間、索引和遊戲服務器信息，在線玩家回到 idle"""
+        self.rooms.set_status(room_name, state)
+        room = self.rooms.remove(room_name, reason or state)
+        self.game_servers.pop(room_name, None)
+        for player in set(room['players']):
+            if player in self.player_status and not self.rooms.rooms_of(player):
+                self.player_status[player] = 'idle'
+
+    def abandon_rooms(self, username):
+        """玩家離開大廳時，他創建或參與的房間都無法再繼續，標記為 abandoned 並回收"""
+        for room_name in self.rooms.rooms_of(username):
+            self.close_room(room_name, 'abandoned')
+
+    def sweep_rooms(self):
+        """回收在 waiting / playing 停留過久的房間（例如遊戲結束後沒有回報），然後重新排程"""
+        expired = self.rooms.expired(self.room_ttls)
+        for room_name in expired:
+            self.close_room(room_name, 'abandoned', 'expired')
+        if expired:
+            print(f"回收了 {len(expired)} 個超時房間")
+        self.call_later(self.SWEEP_INTERVAL, self.sweep_rooms)
+
+    def get_stats(self):
+        """各 action 的調用次數、錯誤次數與延遲百分位數，以及房間與記憶體佔用"""
+        return {
+            'status': 'success',
+            'stats': {
+                'uptime': round(time.time() - self.metrics.started, 1),
+                'online': len(self.client_sockets),
+                'players': self.player_status.counts(),
+                'presence_version': self.player_status.version,
+                'sessions': self.sessions.stats(),
+                'replayed': self.replayed,
+                'actions': self.metrics.snapshot(),
+                'rooms': self.rooms.counts(),
+                'rooms_reclaimed': dict(self.rooms.reclaimed),
+                'game_servers': len(self.game_servers),
+                'rss_kb': current_rss_kb(),
+            }
+        }
+
+    def broadcast(self, message):
+        """推送消息給所有已登錄的客戶端，返回收到消息的客戶端數"""
+        encoded = {}  # 相同協議的連線只編碼一次
+        sent = 0
+        for connection in list(self.client_sockets.values()):
+            protocol = connection.protocol
+            if protocol is None:
+                continue
+            try:
+                if protocol.framed not in encoded:
+                    encoded[protocol.framed] = protocol.encode(message)
+                connection.write(encoded[protocol.framed])
+                sent += 1
+            except Exception as e:
+                print(f"發送消息時出錯: {e}")
+        return sent
+
+    def call_later(self, delay, callback):
+        """延遲執行 callback：asyncio 模式用事件迴圈計時，執行緒模式用計時器執行緒並持有 self.lock"""
+        if self.loop is not None:
+            return self.loop.call_later(delay, callback)
+        timer = threading.Timer(delay, self.run_locked, args=(callback,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def run_locked(self, callback):
+        with self.lock:
+            callback()
+
     def run(self):
+        """執行緒模式（每個連線一個執行緒）"""
         print("Lobby server is running...")
+        self.call_later(self.SWEEP_INTERVAL, self.sweep_rooms)
         while True:
             client_socket, addr = self.server_socket.accept()
             print(f"Connection from {addr}")
-            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
+            client_handler = threading.Thread(target=self.handle_client, args=(client_socket, addr))
+            client_handler.daemon = True
             client_handler.start()
 
+    def run_async(self):
+        """asyncio 模式（單一行程、單一事件迴圈服務所有連線）"""
+        raise_fd_limit()
+        print("Lobby server is running (asyncio)...")
+        try:
+            asyncio.run(self.serve_async())
+        except KeyboardInterrupt:
+            pass
+
+    async def serve_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.call_later(self.SWEEP_INTERVAL, self.sweep_rooms)
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_client_async, sock=self.server_socket)
+        async with server:
+            await server.serve_forever()
+
+def raise_fd_limit():
+    """盡量提高可開啟的文件描述符上限，以容納大量閒置連線"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
 if __name__ == "__main__":
-    server = LobbyServer()
-    server.run()
+    parser = argparse.ArgumentParser(description='遊戲大廳服務器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread',
+                        help='thread: 每個連線一個執行緒; async: 單執行緒 asyncio 事件迴圈')
+    parser.add_argument('--verbose', action='store_true', help='打印每個收到的請求')
+    parser.add_argument('--waiting-ttl', type=float, default=600,
+                        help='房間等待玩家的最長時間（秒），超時回收')
+    parser.add_argument('--playing-ttl', type=float, default=7200,
+                        help='房間遊戲中的最長時間（秒），超時回收')
+    parser.add_argument('--session-grace', type=float, default=30,
+                        help='斷線後保留會話等待重新連線的時間（秒）')
+    args = parser.parse_args()
+
+    server = LobbyServer(args.host, args.port, verbose=args.verbose,
+                         waiting_ttl=args.waiting_ttl, playing_ttl=args.playing_ttl,
+                         session_grace=args.session_grace)
+    if args.mode == 'async':
+        server.run_async()
+    else:
+        server.run()
 
 #所有公開遊戲的房間(包含創建者、遊戲類型、房間狀態)。
 #status 換成idle
\ No newline at end of file
@@ -0,0 +1,78 @@
+import secrets
+
+
+class SessionRegistry:
+    """登錄會話令牌
+
+    登錄成功時發給客戶端一個令牌。連線意外斷開時會話先保留 grace 秒，
+    期間客戶端用令牌重新連線即可恢復原來的用戶名、狀態與房間；
+    超過寬限期仍未恢復才調用 expire(username) 真正登出。
+    每個會話帶一個 ReplayCache，恢復後重發的請求仍能取回斷線前的回覆。
+    """
+
+    def __init__(self, call_later, expire, grace=30):
+        self.call_later = call_later
+        self.expire = expire
+        self.grace = grace
+        self.tokens = {}  # token -> username
+        self.by_user = {}  # username -> token
+        self.detached = {}  # token -> 寬限期計時器
+        self.replays = {}  # token -> 會話的 ReplayCache
+        self.resumed = 0
+        self.expired = 0
+
+    def issue(self, username, replay):
+        """發出新令牌，同一用戶之前的令牌作廢；replay 是登錄所在連線的 ReplayCache，由會話接手"""
+        self.revoke(username)
+        token = secrets.token_urlsafe(24)
+        self.tokens[token] = username
+        self.by_user[username] = token
+        self.replays[token] = replay
+        return token
+
+    def revoke(self, username):
+        token = self.by_user.pop(username, None)
+        if token is None:
+            return
+        del self.tokens[token]
+        del self.replays[token]
+        timer = self.detached.pop(token, None)
+        if timer is not None:
+            timer.cancel()
+
+    def detach(self, username):
+        """連線斷開：保留會話，寬限期後過期。沒有會話時返回 False"""
+        token = self.by_user.get(username)
+        if token is None:
+            return False
+        if token not in self.detached:
+            self.detached[token] = self.call_later(self.grace, lambda: self.expire_token(token))
+        return True
+
+    def expire_token(self, token):
+        if self.detached.pop(token, None) is None:
+            return  # 已經恢復或已作廢
+        username = self.tokens.pop(token)
+        del self.by_user[username]
+        del self.replays[token]
+        self.expired += 1
+        self.expire(username)
+
+    def resume(self, token):
+        """用令牌恢復會話，返回用戶名；令牌無效或已過期時返回 None。會話的 ReplayCache 見 replays[token]"""
+        username = self.tokens.get(token)
+        if username is None:
+            return None
+        timer = self.detached.pop(token, None)
+        if timer is not None:
+            timer.cancel()
+        self.resumed += 1
+        return username
+
+    def stats(self):
+        return {
+            'active': len(self.tokens) - len(self.detached),
+            'detached': len(self.detached),
+            'resumed': self.resumed,
+            'expired': self.expired,
+        }
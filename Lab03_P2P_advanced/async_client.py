@@ -0,0 +1,354 @@
+import asyncio
+import hashlib
+import inspect
+import itertools
+import os
+
+from protocol import CODEC_JSON, HELLO_SIZE, UPLOAD_ACK, UPLOAD_RECEIVING, UPLOAD_DONE, data_preamble, file_sha256, hello, parse_hello_reply
+
+
+class AsyncClient:
+    """asyncio 版的大廳客戶端，供機器人對手與壓力測試使用
+
+    每個實例只有一條連線和一個讀取協程，沒有執行緒，也不調用 input()，
+    同一個行程中可以同時運行上千個模擬玩家。所有動作都是協程，返回服務器的回覆。
+
+    服務器推送的消息：presence 增量自動套用到 online_players（track_presence=False 時忽略），
+    其他推送交給 on_push(message)（普通函數或協程函數），
+    也可以用 wait_for_push(status) 等待某種推送，例如機器人等待邀請。
+    """
+
+    REQUEST_TIMEOUT = 5  # 秒
+    TRANSFER_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, host='127.0.0.1', port=12222, codec_id=CODEC_JSON, on_push=None, track_presence=True):
+        self.address = (host, port)
+        self.codec_id = codec_id
+        self.on_push = on_push
+        self.track_presence = track_presence
+        self.reader = None
+        self.writer = None
+        self.protocol = None
+        self.read_task = None
+        self.pending_requests = {}  # request_id -> (Future, 請求)，恢復會話後重發
+        self.request_ids = itertools.count(1)
+        self.push_waiters = {}  # status -> 等待這種推送的 Future 列表
+        self.username = None
+        self.session_token = None
+        self.online_players = {}
+        self.presence_version = None
+        self.presence_epoch = None  # 服務器本次運行的標識，重啟後版本號不再可比
+        self.game_catalog = {}
+        self.catalog_version = None
+        self.catalog_epoch = None  # 服務器本次運行的標識，重啟後版本號不再可比
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(*self.address)
+        self.writer.write(hello(self.codec_id))
+        self.protocol = parse_hello_reply(await self.reader.readexactly(HELLO_SIZE))
+        self.codec_id = self.protocol.codec_id
+        self.read_task = asyncio.ensure_future(self.read_messages())
+        return self
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        if self.read_task is not None:
+            await self.read_task
+        self.fail_pending('連線已關閉')
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def read_messages(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for message in self.protocol.feed(data):
+                    self.dispatch_message(message)
+        except (OSError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            # 數據無法解碼或處理消息時出錯：這條連線已不可用，關閉它，等待中的請求都以這個異常結束
+            self.writer.close()
+            self.fail_pending('與服務器的連線出錯', error=e)
+        finally:
+            # 連線已關閉；已登錄時保留等待中的請求，resume() 恢復會話後重發，否則它們不會再有回覆
+            if self.session_token is None:
+                self.fail_pending('與服務器的連線中斷')
+
+    def fail_pending(self, message, error=None):
+        """結束所有等待中的請求：返回錯誤回覆，帶 error 時改為拋出該異常"""
+        pending, self.pending_requests = self.pending_requests, {}
+        for future, _ in pending.values():
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result({'status': 'error', 'message': message})
+
+    def dispatch_message(self, message):
+        if 'request_id' in message:
+            future, _ = self.pending_requests.pop(message['request_id'], (None, None))
+            if future is not None and not future.done():
+                future.set_result(message)
+            return
+        if message['status'] == 'presence':
+            if self.track_presence:
+                self.handle_presence(message)
+            return
+        for future in self.push_waiters.pop(message['status'], ()):
+            if not future.done():
+                future.set_result(message)
+        if self.on_push is not None:
+            result = self.on_push(message)
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result)
+
+    def wait_for_push(self, status, timeout=None):
+        """等待下一條指定狀態的推送（例如 'invite'、'game_start'）"""
+        future = asyncio.get_running_loop().create_future()
+        self.push_waiters.setdefault(status, []).append(future)
+        return asyncio.wait_for(future, timeout)
+
+    def send_nowait(self, action, **kwargs):
+        request = {'action': action}
+        request.update(kwargs)
+        self.writer.write(self.protocol.encode(request))
+
+    async def request(self, action, **kwargs):
+        """發送請求並等待回覆；同一條連線上可以同時有任意多個請求在等待"""
+        request = {'action': action}
+        request.update(kwargs)
+        request_id = next(self.request_ids)
+        request['request_id'] = request_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[request_id] = (future, request)
+        self.writer.write(self.protocol.encode(request))
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(future, self.REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {'status': 'error', 'message': '請求超時'}
+        except OSError as e:
+            return {'status': 'error', 'message': f'發送請求失敗: {e}'}
+        finally:
+            self.pending_requests.pop(request_id, None)
+
+    async def batch(self, requests, stop_on_error=False):
+        """把多個請求放進一個 batch，一次往返取回按順序排列的回覆；沒有執行的請求也有錯誤回覆"""
+        response = await self.request('batch', requests=requests, stop_on_error=stop_on_error)
+        if response['status'] != 'success':
+            return [response] * len(requests)
+        responses = response['responses']
+        skipped = {'status': 'error', 'message': '前面的請求失敗，沒有執行'}
+        return responses + [skipped] * (len(requests) - len(responses))
+
+    # 帳號與會話
+
+    async def register(self, username, password):
+        return await self.request('register', username=username, password=password)
+
+    async def login(self, username, password):
+        if self.presence_version is not None:
+            response = await self.request('login', username=username, password=password,
+                                          presence_version=self.presence_version, presence_epoch=self.presence_epoch)
+        else:
+            response = await self.request('login', username=username, password=password)
+        if response['status'] == 'success':
+            self.username = username
+            self.apply_login(response)
+        return response
+
+    async def logout(self):
+        response = await self.request('logout')
+        if response['status'] == 'success':
+            self.username = None
+            self.session_token = None
+        return response
+
+    async def resume(self):
+        """連線斷開後在寬限期內重新連線，用會話令牌恢復登錄狀態"""
+        if self.read_task is not None:
+            await self.read_task
+        await self.connect()
+        response = await self.request('resume_session', session_token=self.session_token,
+                                      presence_version=self.presence_version, presence_epoch=self.presence_epoch)
+        if response['status'] == 'success':
+            self.apply_login(response)
+            # 斷線前沒收到回覆的請求沿用原來的 request_id 重發，已經處理過的由服務器返回第一次的回覆
+            for _, request in self.pending_requests.values():
+                self.writer.write(self.protocol.encode(request))
+        else:
+            self.session_token = None
+            self.fail_pending('會話已過期')
+        return response
+
+    def apply_login(self, response):
+        self.session_token = response.get('session_token')
+        self.presence_epoch = response.get('presence_epoch')
+        if 'changes' in response:
+            self.apply_presence(response['presence_version'], changes=response['changes'],
+                                from_version=self.presence_version)
+        else:
+            self.apply_presence(response['presence_version'], players=response.get('players', {}))
+
+    def apply_presence(self, version, players=None, changes=None, from_version=None):
+        """套用快照或增量；增量與本地版本不連續時返回 False"""
+        if players is not None:
+            self.online_players = dict(players)
+            self.presence_version = version
+            return True
+        if self.presence_version is None or version <= self.presence_version:
+            return True
+        if from_version > self.presence_version:
+            return False
+        for user, status in changes.items():
+            if status is None:
+                self.online_players.pop(user, None)
+            else:
+                self.online_players[user] = status
+        self.presence_version = version
+        return True
+
+    def handle_presence(self, message):
+        if message.get('reset'):
+            self.apply_presence(message['version'], players=message['players'])
+        elif not self.apply_presence(message['version'], changes=message['changes'],
+                                     from_version=message['from_version']):
+            self.send_nowait('sync_presence', since=self.presence_version, epoch=self.presence_epoch)
+
+    async def list_players(self, player_status=None, cursor=None, limit=None):
+        return await self.request('list_players', player_status=player_status, cursor=cursor, limit=limit)
+
+    async def get_stats(self):
+        return await self.request('stats')
+
+    # 房間與邀請
+
+    async def create_room(self, room_type, room_name):
+        return await self.request('create_room', room_type=room_type, room_name=room_name)
+
+    async def join_room(self, room_name):
+        return await self.request('join_room', room_name=room_name)
+
+    async def list_rooms(self, room_status=None, creator=None, cursor=None, limit=None):
+        return await self.request('list_rooms', room_status=room_status, creator=creator, cursor=cursor, limit=limit)
+
+    async def invite_player(self, room_name, invited_player):
+        return await self.request('invite_player', room_name=room_name, invited_player=invited_player)
+
+    async def respond_to_invite(self, room_name, response):
+        return await self.request('respond_to_invite', room_name=room_name, response=response)
+
+    async def set_game_server(self, room_name, ip, port, game_type):
+        return await self.request('set_game_server', room_name=room_name, ip=ip, port=port, game_type=game_type)
+
+    async def get_game_server(self, room_name):
+        return await self.request('get_game_server', room_name=room_name)
+
+    async def finish_game(self, room_name):
+        return await self.request('finish_game', room_name=room_name)
+
+    # 遊戲目錄、上傳與下載
+
+    async def sync_games(self):
+        """同步本地的遊戲目錄，有本地版本時只取回之後的變化"""
+        if self.catalog_version is None:
+            response = await self.request('list_games')
+        else:
+            response = await self.request('list_games', since=self.catalog_version, epoch=self.catalog_epoch)
+        if response['status'] != 'success':
+            return response
+        if 'changes' in response:
+            for name, game in response['changes'].items():
+                if game is None:
+                    self.game_catalog.pop(name, None)
+                else:
+                    self.game_catalog[name] = game
+        else:
+            self.game_catalog = {game['name']: game for game in response.get('games', [])}
+        self.catalog_version = response.get('version')
+        self.catalog_epoch = response.get('epoch')
+        return {'status': 'success', 'games': [self.game_catalog[name] for name in sorted(self.game_catalog)]}
+
+    async def search_games(self, query='', cursor=None, limit=None):
+        return await self.request('search_games', query=query, cursor=cursor, limit=limit)
+
+    async def upload_game(self, game_path, description):
+        """通過數據連線上傳遊戲；服務器已有同樣的內容時不傳輸，中斷過的上傳從斷點續傳"""
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(game_path)
+        sha256 = await loop.run_in_executor(None, file_sha256, game_path)  # 不在事件迴圈中計算雜湊
+        response = await self.request('begin_upload', game_name=os.path.basename(game_path), size=size,
+                                      sha256=sha256, description=description)
+        if response['status'] != 'success' or response.get('complete'):
+            return response
+
+        chunk_size, window = response['chunk_size'], response['window']
+        reader, writer = await asyncio.open_connection(*self.address)
+        try:
+            writer.write(data_preamble(bytes.fromhex(response['transfer_token'])))
+            await writer.drain()
+            with open(game_path, 'rb') as file:
+                sent = acked = response['offset']
+                while sent < size:
+                    count = min(chunk_size, size - sent)
+                    await loop.sendfile(writer.transport, file, sent, count)
+                    sent += count
+                    while sent < size and sent - acked >= window * chunk_size:
+                        acked, status = UPLOAD_ACK.unpack(await reader.readexactly(UPLOAD_ACK.size))
+                while True:
+                    acked, status = UPLOAD_ACK.unpack(await reader.readexactly(UPLOAD_ACK.size))
+                    if status != UPLOAD_RECEIVING:
+                        break
+        except (OSError, asyncio.IncompleteReadError) as e:
+            return {'status': 'error', 'message': f'上傳中斷: {e}'}
+        finally:
+            writer.close()
+        if status != UPLOAD_DONE:
+            return {'status': 'error', 'message': '上傳的文件校驗失敗'}
+        return {'status': 'success', 'message': '遊戲上傳成功'}
+
+    async def download_game(self, game_name, target_path, cached_sha256=None):
+        """下載遊戲到 target_path；帶上本地版本的 sha256 時，沒有變化的遊戲只收到 not_modified"""
+        if cached_sha256:
+            response = await self.request('download_game', game_name=game_name, stream=True, sha256=cached_sha256)
+        else:
+            response = await self.request('download_game', game_name=game_name, stream=True)
+        if response['status'] != 'success':
+            return response
+
+        size = response['size']
+        hasher = hashlib.sha256()
+        received = 0
+        temp_path = target_path + '.part'
+        reader, writer = await asyncio.open_connection(*self.address)
+        try:
+            writer.write(data_preamble(bytes.fromhex(response['transfer_token'])))
+            with open(temp_path, 'wb') as file:
+                while received < size:
+                    data = await reader.read(min(self.TRANSFER_CHUNK_SIZE, size - received))
+                    if not data:
+                        break
+                    file.write(data)
+                    hasher.update(data)
+                    received += len(data)
+        finally:
+            writer.close()
+        if received != size or hasher.hexdigest() != response['sha256']:
+            os.remove(temp_path)
+            return {'status': 'error', 'message': f'下載不完整或校驗失敗 ({received}/{size} 字節)'}
+        os.replace(temp_path, target_path)
+        return {'status': 'success', 'path': target_path, 'sha256': response['sha256'], 'size': size}
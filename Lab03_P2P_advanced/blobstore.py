@@ -0,0 +1,106 @@
+import os
+import re
+import shutil
+import time
+
+from protocol import file_sha256
+
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def is_sha256(value):
+    """是否是 64 位小寫十六進制的 sha256；客戶端送來的值會拼進文件路徑，必須先檢查"""
+    return isinstance(value, str) and SHA256_PATTERN.fullmatch(value) is not None
+
+
+class BlobStore:
+    """以內容 sha256 命名的遊戲文件倉庫
+
+    內容保存在 Lobby/blobs/<前兩位>/<sha256>，同樣的內容只保存一份；
+    Lobby/games/<遊戲名>.py 是指向 blob 的硬鏈接，下載和啟動遊戲仍按名稱讀取。
+    未完成的上傳保存在 Lobby/blobs/partial/<sha256>.part，斷線後可以從已寫入的位置續傳。
+    """
+
+    PARTIAL_TTL = 24 * 3600  # 秒，超過這個時間沒有續傳的臨時文件在啟動時清除
+
+    def __init__(self, root='Lobby', games_dir='Lobby/games'):
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.partial_dir = os.path.join(self.blob_dir, 'partial')
+        self.games_dir = games_dir
+        os.makedirs(self.partial_dir, exist_ok=True)
+        os.makedirs(self.games_dir, exist_ok=True)
+        self.dedup_hits = 0
+        self.resumed = 0
+        self.count = sum(len(files) for directory, _, files in os.walk(self.blob_dir)
+                         if directory != self.partial_dir)
+        self.prune_partials()
+
+    def blob_path(self, sha256):
+        self.check(sha256)
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def partial_path(self, sha256):
+        self.check(sha256)
+        return os.path.join(self.partial_dir, sha256 + '.part')
+
+    @staticmethod
+    def check(sha256):
+        if not is_sha256(sha256):
+            raise ValueError(f'無效的 sha256: {sha256!r}')  # 防止 ../ 之類的值把路徑帶出倉庫
+
+    def game_path(self, game_name):
+        return os.path.join(self.games_dir, game_name)
+
+    def has(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+
+    def partial_size(self, sha256):
+        """已經收到的字節數，沒有未完成的上傳時為 0"""
+        try:
+            return os.path.getsize(self.partial_path(sha256))
+        except OSError:
+            return 0
+
+    def commit(self, sha256, path):
+        """把已校驗的文件移入倉庫；同樣的內容已存在時直接丟棄"""
+        target = self.blob_path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        self.count += 1
+
+    def store(self, path):
+        """計算文件的雜湊並移入倉庫，返回 sha256"""
+        sha256 = file_sha256(path)
+        self.commit(sha256, path)
+        return sha256
+
+    def link(self, sha256, game_name):
+        """讓 Lobby/games/<game_name> 指向 blob；先建在臨時名稱再替換，讀取方不會看到半個文件"""
+        target = self.game_path(game_name)
+        temp_path = f'{target}.{sha256[:8]}.link'
+        try:
+            os.link(self.blob_path(sha256), temp_path)
+        except FileExistsError:
+            os.remove(temp_path)
+            os.link(self.blob_path(sha256), temp_path)
+        except OSError:
+            shutil.copyfile(self.blob_path(sha256), temp_path)  # 文件系統不支持硬鏈接
+        os.replace(temp_path, target)
+
+    def prune_partials(self):
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            if now - os.path.getmtime(path) > self.PARTIAL_TTL:
+                os.remove(path)
+
+    def stats(self):
+        return {
+            'blobs': self.count,
+            'partials': len(os.listdir(self.partial_dir)),
+            'dedup_hits': self.dedup_hits,
+            'resumed': self.resumed,
+        }
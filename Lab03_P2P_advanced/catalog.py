@@ -0,0 +1,215 @@
+import bisect
+import csv
+import os
+import re
+import secrets
+from collections import deque
+
+from codec import PreparedMessage
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """小寫後按非文字字符和底線切分；連續的中文字作為一個詞，靠前綴匹配查找"""
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+class GameCatalog:
+    """遊戲目錄：啟動時讀一次 games.csv，之後都在內存中查詢和更新
+
+    上傳時就地更新內存中的記錄，CSV 在一個短窗口後整體重寫一次（同名遊戲只保留一行）。
+    list_games 的回覆預先構建並編碼，目錄變化時才重新生成。
+
+    另外維護名稱、發布者、描述的倒排索引（詞 -> 遊戲名稱集合）與有序詞表，
+    search_games 的每個查詢詞按前綴在詞表中二分查找。
+
+    每次變化版本號加一並記入有限長度的變更日誌，
+    客戶端帶著上次看到的版本即可只取回之後新增、修改或刪除的遊戲。
+    版本號每次啟動都從 0 開始，因此另外帶一個每次啟動隨機生成的 epoch，
+    客戶端的 epoch 與當前不同時說明版本來自之前的運行，只能返回完整列表。
+    """
+
+    FLUSH_DELAY = 1.0  # 秒，合併多次上傳的寫入
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    LOG_SIZE = 10000  # 保留的變更條數，更舊的版本只能重新獲取完整列表
+
+    def __init__(self, csv_path='Lobby/games.csv', call_later=None):
+        self.csv_path = csv_path
+        self.call_later = call_later  # 為 None 時每次更新立即寫入
+        self.games = {}  # game_name -> {'name', 'publisher', 'description', 'sha256'}
+        self.version = 0
+        self.epoch = secrets.token_hex(4)  # 本次運行的標識，區分重啟前後的版本號
+        self.dirty = False
+        self.scheduled = False
+        self.writes = 0
+        self.list_cache = None
+        self.list_version = -1
+        self.index = {}  # 詞 -> 遊戲名稱集合
+        self.terms = []  # 有序的詞表，用於前綴查找
+        self.names = []  # 有序的遊戲名稱，用於分頁
+        self.log = deque(maxlen=self.LOG_SIZE)  # (version, game_name)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.csv_path):
+            return
+        with open(self.csv_path, mode='r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                self.games[row['game_name']] = {
+                    'name': row['game_name'],
+                    'publisher': row['publisher'],
+                    'description': row['description'],
+                    'sha256': row.get('sha256') or None  # 舊的 CSV 沒有這一列
+                }
+        for game in self.games.values():
+            self.index_game(game)
+
+    def __contains__(self, game_name):
+        return game_name in self.games
+
+    def __len__(self):
+        return len(self.games)
+
+    def get(self, game_name, default=None):
+        return self.games.get(game_name, default)
+
+    def upsert(self, game_name, publisher, description, sha256=None):
+        """新增或更新一個遊戲，並安排寫回 CSV"""
+        old = self.games.get(game_name)
+        if old is not None:
+            self.unindex_game(old)
+        game = self.games[game_name] = {'name': game_name, 'publisher': publisher, 'description': description,
+                                        'sha256': sha256}
+        self.index_game(game)
+        self.changed(game_name)
+
+    def remove(self, game_name):
+        game = self.games.pop(game_name, None)
+        if game is None:
+            return False
+        self.unindex_game(game)
+        del self.names[bisect.bisect_left(self.names, game_name)]
+        self.changed(game_name)
+        return True
+
+    def changed(self, game_name):
+        self.version += 1
+        self.log.append((self.version, game_name))
+        self.dirty = True
+        if self.call_later is None:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.call_later(self.FLUSH_DELAY, self.flush)
+
+    def changes_since(self, version, epoch=None):
+        """返回 version 之後變化的遊戲 {name: 最新記錄，已刪除為 None}；
+        日誌不夠或版本來自之前的運行（epoch 不同）時返回 None"""
+        if epoch != self.epoch or version > self.version:
+            return None
+        if version < self.version and (not self.log or self.log[0][0] > version + 1):
+            return None
+        changes = {}
+        for entry_version, game_name in reversed(self.log):
+            if entry_version <= version:
+                break
+            if game_name not in changes:
+                changes[game_name] = self.games.get(game_name)
+        return changes
+
+    def game_terms(self, game):
+        return tokenize(game['name']) | tokenize(game['publisher']) | tokenize(game['description'])
+
+    def index_game(self, game):
+        for term in self.game_terms(game):
+            names = self.index.get(term)
+            if names is None:
+                names = self.index[term] = set()
+                bisect.insort(self.terms, term)
+            names.add(game['name'])
+        i = bisect.bisect_left(self.names, game['name'])
+        if i == len(self.names) or self.names[i] != game['name']:
+            self.names.insert(i, game['name'])
+
+    def unindex_game(self, game):
+        for term in self.game_terms(game):
+            names = self.index.get(term)
+            if names is None:
+                continue
+            names.discard(game['name'])
+            if not names:
+                del self.index[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def prefix_matches(self, prefix):
+        """所有以 prefix 開頭的詞對應的遊戲名稱"""
+        matches = set()
+        i = bisect.bisect_left(self.terms, prefix)
+        while i < len(self.terms) and self.terms[i].startswith(prefix):
+            matches |= self.index[self.terms[i]]
+            i += 1
+        return matches
+
+    def search(self, query='', cursor=None, limit=None):
+        """每個查詢詞都要匹配（前綴匹配），結果按遊戲名稱排序並分頁"""
+        limit = min(max(int(limit or self.DEFAULT_PAGE_SIZE), 1), self.MAX_PAGE_SIZE)
+        words = sorted(tokenize(query or ''), key=len, reverse=True)  # 長的詞匹配少，先求交集
+        if words:
+            names = None
+            for word in words:
+                matches = self.prefix_matches(word)
+                names = matches if names is None else names & matches
+                if not names:
+                    break
+            names = sorted(names)
+        else:
+            names = self.names
+        start = bisect.bisect_right(names, cursor) if cursor else 0
+        page = names[start:start + limit]
+        return {
+            'games': [self.games[name] for name in page],
+            'total': len(names),
+            'next_cursor': page[-1] if start + limit < len(names) else None,
+        }
+
+    def flush(self):
+        """把整個目錄寫入臨時文件再替換，避免寫到一半時留下殘缺的 CSV"""
+        self.scheduled = False
+        if not self.dirty:
+            return
+        self.dirty = False
+        os.makedirs(os.path.dirname(self.csv_path) or '.', exist_ok=True)
+        temp_path = self.csv_path + '.tmp'
+        with open(temp_path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['game_name', 'publisher', 'description', 'sha256'])
+            for game in self.games.values():
+                writer.writerow([game['name'], game['publisher'], game['description'], game['sha256'] or ''])
+        os.replace(temp_path, self.csv_path)
+        self.writes += 1
+
+    def list_response(self, since=None, epoch=None):
+        """list_games 的回覆
+
+        帶 since、epoch 與本次運行相同且日誌足夠時只返回之後的變化，否則返回完整列表；
+        完整列表在目錄沒有變化時重複使用同一個已編碼的消息。
+        """
+        changes = None if since is None else self.changes_since(int(since), epoch)
+        if changes is not None:
+            return {'status': 'success', 'from_version': int(since), 'version': self.version, 'epoch': self.epoch,
+                    'changes': changes}
+        if self.list_version != self.version:
+            if self.games:
+                message = {'status': 'success', 'games': list(self.games.values()), 'message': '成功獲取遊戲列表'}
+            else:
+                message = {'status': 'success', 'games': [], 'message': '目前沒有任何遊戲'}
+            message['version'] = self.version
+            message['epoch'] = self.epoch
+            self.list_cache = PreparedMessage(message)
+            self.list_version = self.version
+        return self.list_cache
+
+    def stats(self):
+        return {'count': len(self.games), 'version': self.version, 'writes': self.writes, 'terms': len(self.terms)}
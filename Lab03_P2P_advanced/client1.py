@@ -1,53 +1,169 @@
 import socket
-import json
 import threading
 import time
+import itertools
+import queue
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from game_server import GameServer
+from protocol import client_handshake, MessageSocket, CODEC_JSON, data_preamble
+from protocol import UPLOAD_ACK, UPLOAD_RECEIVING, UPLOAD_DONE
+from codec import CODEC_NAMES
+from gamecache import GameCache
 import os
+import hashlib
+import argparse
 
 class Client:
-    def __init__(self, host='140.113.235.151', port=12222):
+    RECONNECT_ATTEMPTS = 5
+    REQUEST_TIMEOUT = 5  # 秒
+    TRANSFER_CHUNK_SIZE = 64 * 1024  # 數據連線每次接收的字節數
+
+    def __init__(self, host='140.113.235.151', port=12222, codec_id=CODEC_JSON):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.connect((host, port))
+        self.protocol = client_handshake(self.server_socket, codec_id)  # 協商分幀與編碼
+        self.codec_id = self.protocol.codec_id
+        self.address = (host, port)
         self.current_room = None
-        self.response_queue = {}
+        self.pending_requests = {}  # request_id -> (等待回覆的 Future, 請求)，斷線重連後重發
+        self.request_ids = itertools.count(1)  # 單調遞增，同一執行緒連續發同一個動作也不會重複
+        self.events = queue.Queue()  # 服務器推送的消息，由事件執行緒依序處理
         self.message_lock = threading.Lock()
+        self.presence_lock = threading.Lock()
+        self.online_players = {}  # 本地維護的在線玩家列表，由增量推送更新
+        self.presence_version = None
+        self.presence_epoch = None  # 服務器本次運行的標識，重啟後版本號不再可比
+        self.session_token = None  # 登錄後由服務器發出，斷線重連時用來恢復會話
+        self.rooms_response = None  # 登錄時一起取回的房間列表
+        self.game_catalog = {}  # 本地的遊戲目錄副本 name -> 遊戲信息
+        self.catalog_version = None
+        self.catalog_epoch = None  # 服務器本次運行的標識，重啟後版本號不再可比
+        self.game_cache = GameCache('Client/download_games')  # 已下載的遊戲，按內容雜湊判斷是否需要重新下載
+        self.closing = False
         self.is_playing = False
         self.is_handling_invite = False
         
         self.listen_thread = threading.Thread(target=self.listen_for_messages)
         self.listen_thread.daemon = True
         self.listen_thread.start()
+        self.event_thread = threading.Thread(target=self.handle_events)
+        self.event_thread.daemon = True
+        self.event_thread.start()
 
     def send_request(self, action, **kwargs):
+        """發送請求並等待對應的回覆；多個執行緒可以同時在一條連線上等待各自的回覆"""
         request = {'action': action}
         request.update(kwargs)
-        
-        request_id = f"{action}_{threading.get_ident()}"
-        request['request_id'] = request_id
+        future = Future()
         
         with self.message_lock:
-            self.response_queue[request_id] = None
-            self.server_socket.send(json.dumps(request).encode('utf-8'))
+            request_id = next(self.request_ids)
+            request['request_id'] = request_id
+            self.pending_requests[request_id] = (future, request)
+            try:
+                self.server_socket.sendall(self.protocol.encode(request))
+            except OSError:
+                del self.pending_requests[request_id]
+                raise
         
-        for _ in range(50):
+        # 監聽執行緒收到回覆時立即喚醒，不再輪詢
+        try:
+            return future.result(timeout=self.REQUEST_TIMEOUT)
+        except FutureTimeout:
             with self.message_lock:
-                response = self.response_queue.get(request_id)
-                if response:
-                    del self.response_queue[request_id]
-                    return response
-            time.sleep(0.1)
-        
-        return {'status': 'error', 'message': '請求超時'}
+                self.pending_requests.pop(request_id, None)
+            return {'status': 'error', 'message': '請求超時'}
+
+    def send_batch(self, requests, stop_on_error=False):
+        """把多個請求放進一個 batch，一次往返取回按順序排列的回覆
+
+        requests 是 {'action': ..., 其他參數} 的列表；沒有執行的請求（batch 失敗或前面的請求失敗）也會有錯誤回覆。
+        """
+        response = self.send_request('batch', requests=requests, stop_on_error=stop_on_error)
+        if response['status'] != 'success':
+            return [response] * len(requests)
+        responses = response['responses']
+        skipped = {'status': 'error', 'message': '前面的請求失敗，沒有執行'}
+        return responses + [skipped] * (len(requests) - len(responses))
+
+    def fail_pending(self, message):
+        """連線中斷：舊連線上的請求不會再有回覆，讓等待的執行緒立即返回"""
+        with self.message_lock:
+            pending, self.pending_requests = self.pending_requests, {}
+        for future, _ in pending.values():
+            future.set_result({'status': 'error', 'message': message})
 
     def register(self, username, password):
         return self.send_request('register', username=username, password=password)
 
+    def send_nowait(self, action, **kwargs):
+        """只發送請求不等待回覆"""
+        request = {'action': action}
+        request.update(kwargs)
+        with self.message_lock:
+            self.server_socket.sendall(self.protocol.encode(request))
+
     def login(self, username, password):
-        return self.send_request('login', username=username, password=password)
+        """登錄，並在同一個 batch 中取回登錄後要顯示的房間列表，之後用 list_rooms(response=self.rooms_response) 顯示"""
+        request = {'action': 'login', 'username': username, 'password': password}
+        # 之前登錄過時帶上本地版本，服務器只返回這段時間的增量
+        if self.presence_version is not None:
+            request['presence_version'] = self.presence_version
+            request['presence_epoch'] = self.presence_epoch
+        responses = self.send_batch([request, {'action': 'list_rooms'}, self.catalog_request()], stop_on_error=True)
+        response = responses[0]
+        if response['status'] == 'success':
+            self.apply_login(response)
+            self.rooms_response = responses[1]
+            self.apply_catalog(responses[2])
+        return response
+
+    def apply_login(self, response):
+        """記錄登錄或恢復會話後的令牌，並更新本地的在線玩家列表"""
+        self.session_token = response.get('session_token')
+        self.presence_epoch = response.get('presence_epoch')
+        if 'changes' in response:
+            self.apply_presence(response['presence_version'], changes=response['changes'],
+                                from_version=self.presence_version)
+        else:
+            self.apply_presence(response['presence_version'], players=response.get('players', {}))
+
+    def apply_presence(self, version, players=None, changes=None, from_version=None):
+        """套用快照或增量；增量與本地版本不連續時返回 False"""
+        with self.presence_lock:
+            if players is not None:
+                self.online_players = dict(players)
+                self.presence_version = version
+                return True
+            if self.presence_version is None or version <= self.presence_version:
+                return True  # 還沒有快照，或已經包含在本地版本中
+            if from_version > self.presence_version:
+                return False
+            for user, status in changes.items():
+                if status is None:
+                    self.online_players.pop(user, None)
+                else:
+                    self.online_players[user] = status
+            self.presence_version = version
+            return True
+
+    def handle_presence(self, message):
+        if message.get('reset'):
+            self.apply_presence(message['version'], players=message['players'])
+        elif not self.apply_presence(message['version'], changes=message['changes'],
+                                     from_version=message['from_version']):
+            # 漏掉了部分增量，從本地版本補齊；回覆同樣是 presence 推送
+            self.send_nowait('sync_presence', since=self.presence_version, epoch=self.presence_epoch)
 
     def logout(self, username):
-        return self.send_request('logout', username=username)
+        response = self.send_request('logout', username=username)
+        if response['status'] == 'success':
+            self.session_token = None
+        return response
+
+    def get_stats(self):
+        """查詢服務器各 action 的延遲統計"""
+        return self.send_request('stats')
 
     def show_status(self):
         response = self.send_request('status')
@@ -59,20 +175,29 @@ class Client:
             else:
                 print("目前無玩家在線")
 
-    def list_rooms(self):
-        response = self.send_request('list_rooms')
+    def list_rooms(self, cursor=None, room_status=None, response=None):
+        """列出房間；已經取回的回覆（例如登錄時一起取回的）直接顯示，不再請求"""
+        if response is None:
+            response = self.send_request('list_rooms', cursor=cursor, room_status=room_status)
         if response['status'] == 'success' and response['rooms']:
             print("-------------------------------------------------")
             print("Game rooms available:")
             for room_id, room_info in response['rooms'].items():
                 print(f"Room Name: {room_id}, Type: {room_info['type']}, Room Creator: {room_info['creator']}, Status: {room_info['status']}")
+            if response.get('next_cursor'):
+                print(f"(共 {response['total']} 個房間，僅顯示前 {len(response['rooms'])} 個)")
             print("-------------------------------------------------")
         else:
             print("-------------------------------------------------")
             print("Game rooms:\nNo game room available")
             print("-------------------------------------------------")
 
+    def list_players(self, player_status=None, cursor=None):
+        """分頁獲取在線玩家，可按狀態篩選"""
+        return self.send_request('list_players', player_status=player_status, cursor=cursor)
+
     def close(self):
+        self.closing = True
         self.server_socket.close()
 
     def create_room(self, room_type, room_name):
@@ -85,60 +210,104 @@ class Client:
             print("\n=== 等待房主開始遊戲 ===")
         return response
 
+    def finish_game(self, room_name):
+        """遊戲結束後通知大廳回收房間；在事件執行緒中調用，結果不影響之後的流程，因此只發送不等待回覆"""
+        try:
+            self.send_nowait('finish_game', room_name=room_name)
+        except Exception as e:
+            print(f"通知遊戲結束時出錯: {e}")
+
     def invite_player(self, room_name, invited_player):
         self.is_handling_invite = True
         return self.send_request('invite_player', room_name=room_name, invited_player=invited_player)
 
     def listen_for_messages(self):
-        buffer = ""
         while True:
             try:
-                data = self.server_socket.recv(1024).decode('utf-8')
+                data = self.server_socket.recv(65536)
                 if not data:
-                    break
+                    raise ConnectionError('服務器關閉了連線')
                 
-                buffer += data
-                
-                while buffer:
-                    try:
-                        message = json.loads(buffer)
-                        buffer = ""  # 清空緩衝區
-                        
-                        # 檢查是否是請求的響應
-                        if 'request_id' in message:
-                            with self.message_lock:
-                                self.response_queue[message['request_id']] = message
-                        else:
-                            # 處理服務器推送的消息
-                            self.handle_server_message(message)
-                        break
-                    except json.JSONDecodeError as e:
-                        # 檢查是否有多個JSON消息
-                        try:
-                            pos = buffer.index("}{")
-                            first_json = buffer[:pos+1]
-                            buffer = buffer[pos+1:]
-                            message = json.loads(first_json)
-                            
-                            # 檢查是否是請求的響應
-                            if 'request_id' in message:
-                                with self.message_lock:
-                                    self.response_queue[message['request_id']] = message
-                            else:
-                                # 處理服務器推送的消息
-                                self.handle_server_message(message)
-                        except ValueError:
-                            # 如果沒有找到多個JSON的分隔點，說明消息不完整
-                            break
-                        except json.JSONDecodeError:
-                            # 如果解析失敗，丟棄損壞的數據
-                            print("接收到損壞的數據，已丟棄")
-                            buffer = ""
-                            break
+                # 每條消息都帶長度前綴，一次 recv 可能包含多條或半條消息
+                for message in self.protocol.feed(data):
+                    self.dispatch_message(message)
                         
             except Exception as e:
+                if self.closing:
+                    self.fail_pending('與服務器的連線中斷')
+                    break
                 print(f"監聽錯誤: {e}")
-                break
+                # 已登錄時用會話令牌重新連線並重發等待中的請求，恢復失敗才停止監聽
+                if not self.session_token or not self.reconnect():
+                    self.fail_pending('與服務器的連線中斷')
+                    break
+
+    def dispatch_message(self, message):
+        # 檢查是否是請求的響應
+        if 'request_id' in message:
+            with self.message_lock:
+                pending = self.pending_requests.pop(message['request_id'], None)
+            if pending is not None:  # 已超時的請求直接丟棄回覆
+                pending[0].set_result(message)
+        else:
+            # 服務器推送的消息交給事件執行緒，處理時等待請求的回覆不會卡住監聽執行緒
+            self.events.put(message)
+
+    def handle_events(self):
+        while True:
+            self.handle_server_message(self.events.get())
+
+    def reconnect(self):
+        """連線中斷後重新連線，並用會話令牌恢復原來的登錄狀態，成功時返回 True"""
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            time.sleep(min(0.5 * 2 ** attempt, 5))
+            try:
+                sock = socket.create_connection(self.address, timeout=5)
+                protocol = client_handshake(sock, self.codec_id)
+                sock.sendall(protocol.encode({
+                    'action': 'resume_session',
+                    'session_token': self.session_token,
+                    'presence_version': self.presence_version,
+                    'presence_epoch': self.presence_epoch,
+                    'request_id': 'resume_session',
+                }))
+                # 恢復回覆之前或同一批數據中可能夾著推送消息，先收起來
+                response, pushed = None, []
+                while response is None:
+                    data = sock.recv(65536)
+                    if not data:
+                        raise ConnectionError('服務器關閉了連線')
+                    for message in protocol.feed(data):
+                        if message.get('request_id') == 'resume_session':
+                            response = message
+                        else:
+                            pushed.append(message)
+                sock.settimeout(None)
+            except Exception as e:
+                print(f"重新連線失敗 ({attempt + 1}/{self.RECONNECT_ATTEMPTS}): {e}")
+                continue
+
+            if response['status'] != 'success':
+                print(f"無法恢復會話: {response['message']}")
+                self.session_token = None
+                sock.close()
+                return False
+            with self.message_lock:
+                old_socket = self.server_socket
+                self.server_socket, self.protocol = sock, protocol
+                # 斷線前發出但沒收到回覆的請求沿用原來的 request_id 重發，已經處理過的由服務器返回第一次的回覆
+                try:
+                    for _, request in self.pending_requests.values():
+                        sock.sendall(protocol.encode(request))
+                except OSError:
+                    pass  # 新連線又斷了，監聽執行緒會再次重連
+            old_socket.close()
+            self.apply_login(response)
+            print(f"\n已重新連線大廳，狀態: {response['player_status']}，請繼續上面的選擇......")
+            for message in pushed:
+                self.dispatch_message(message)
+            return True
+        return False
 
     def handle_server_message(self, message):
         try:
@@ -154,8 +323,16 @@ class Client:
                 return
             elif message['status'] == 'game_start':
                 self.handle_game_start(message)
+            elif message['status'] == 'presence':
+                self.handle_presence(message)
             elif message['status'] == 'notification':
                 print(f"\n通知: {message['message']},請繼續上面的選擇......")
+            elif message['status'] == 'notifications':
+                # 服務器把短時間內的多條通知合併成一次推送
+                print()
+                for text in message['messages']:
+                    print(f"通知: {text}")
+                print("請繼續上面的選擇......")
         except Exception as e:
             print(f"處理消息時出錯: {e}")
 
@@ -189,14 +366,9 @@ class Client:
                 print(f"\n玩家 {message['player']} 加入了游戲,請輸入任意鍵以繼續.....")
                 input()
             
-            # 直接讀取 Lobby/games 目錄下的遊戲文件
-            games_dir = 'Lobby/games'
-            if not os.path.exists(games_dir):
-                print("\n目前沒有任何可用的遊戲")
-                return
-            
-            # 獲取遊戲列表並移除.py後綴
-            games = [f.replace('.py', '') for f in os.listdir(games_dir) if f.endswith('.py')]
+            # 從大廳的遊戲目錄中選擇
+            response = self.sync_games()
+            games = [game['name'] for game in response.get('games', [])]
             if not games:
                 print("\n目前沒有任何可用的遊戲")
                 return
@@ -219,18 +391,10 @@ class Client:
             selected_game = games[choice - 1]
             game_type = selected_game  # 設置game_type為選擇的遊戲名稱
             
-            # 複製選定的遊戲到下載目錄（需要加回.py後綴）
-            download_dir = 'Client/download_games/'
-            os.makedirs(download_dir, exist_ok=True)
-            
-            # 複製遊戲文件
-            source_path = os.path.join(games_dir, f"{selected_game}.py")
-            target_path = os.path.join(download_dir, f"{selected_game}.py")
-            
-            with open(source_path, 'r', encoding='utf-8') as source:
-                game_content = source.read()
-            with open(target_path, 'w', encoding='utf-8') as target:
-                target.write(game_content)
+            # 確保本地有這個遊戲的最新版本，沒有變化時不重新下載
+            response = self.fetch_game(selected_game)
+            if response['status'] not in ('success', 'not_modified'):
+                raise RuntimeError(response.get('message', '下載遊戲失敗'))
             
             print(f"\n遊戲 '{selected_game}' 已準備就緒")
 
@@ -258,6 +422,7 @@ class Client:
             game_server.start()  
             
             # 遊戲結束後
+            self.finish_game(message['room_name'])
             self.is_playing = False
             self.is_handling_invite = False
             print("\n返回大廳...")
@@ -272,9 +437,9 @@ class Client:
     def play_game(self, game_socket):
         
         try:
+            game_socket = MessageSocket.connect(game_socket, self.codec_id)
             while True:
-                data = game_socket.recv(1024).decode()
-                game_data = json.loads(data)
+                game_data = game_socket.recv()
                 if 'game_over' in game_data:  # 處理遊戲結束
                     print("\n===== 遊戲結束 =====")
                     print(f"結果: {game_data['final_result']}")
@@ -290,9 +455,9 @@ class Client:
                             break
                         print("無效選擇，請重新輸入")
                     
-                    game_socket.send(json.dumps({"choice": choice}).encode())
+                    game_socket.send({"choice": choice})
                     
-                    result_data = json.loads(game_socket.recv(1024).decode())
+                    result_data = game_socket.recv()
                     print("\n===== 本回合結果 =====")
                     print(f"結果: {result_data['result']}")
                     print(f"房主選擇: {result_data['host_choice']}")
@@ -336,7 +501,7 @@ class Client:
                     
                     
                     move = int(input("請輸入位置 (0-8): "))
-                    game_socket.send(json.dumps({"move": move}).encode())
+                    game_socket.send({"move": move})
             
                 
         except Exception as e:
@@ -360,21 +525,12 @@ class Client:
         # 從消息中獲取遊戲類型
         game_type = message['game_type']
         
-        # 下載遊戲文件
-        games_dir = 'Lobby/games'
-        download_dir = 'Client/download_games/'
-        os.makedirs(download_dir, exist_ok=True)
-        
-        # 複製遊戲文件（需要加上.py後綴）
-        source_path = os.path.join(games_dir, f"{game_type}.py")
-        target_path = os.path.join(download_dir, f"{game_type}.py")
-        
-        with open(source_path, 'r', encoding='utf-8') as source:
-            game_content = source.read()
-        with open(target_path, 'w', encoding='utf-8') as target:
-            target.write(game_content)
-        
-        print(f"\n遊戲 '{game_type}' 已準備就緒")
+        # 下載遊戲文件，本地快取的版本沒有變化時不重新下載
+        response = self.fetch_game(game_type)
+        if response['status'] not in ('success', 'not_modified'):
+            print(f"\n下載遊戲失敗: {response.get('message', '未知錯誤')}")
+        else:
+            print(f"\n遊戲 '{game_type}' 已準備就緒")
         
         print("\n=== 遊戲開始 ===")
         game_thread = threading.Thread(target=self.play_game, args=(game_socket,))
@@ -383,52 +539,77 @@ class Client:
 
     def upload_game(self, game_path, description):
         try:
-            with open(game_path, 'r', encoding='utf-8') as file:
-                game_content = file.read()
-                game_content = repr(game_content)[1:-1] 
-            
-            chunk_size = 512 
-            chunks = [game_content[i:i+chunk_size] for i in range(0, len(game_content), chunk_size)]
-            total_chunks = len(chunks)
-            
             game_name = os.path.basename(game_path)
-            
+            size = os.path.getsize(game_path)
+            sha256 = hashlib.sha256()
+            with open(game_path, 'rb') as file:
+                for block in iter(lambda: file.read(self.TRANSFER_CHUNK_SIZE), b''):
+                    sha256.update(block)
+
             print(f"\n開始上傳 {game_name}")
-            print("上傳進度: [", end="")
-            
-            # 發送第一個請求，包含文件信息
-            response = self.send_request(
-                'upload_game',
-                game_name=game_name,
-                total_chunks=total_chunks,
-                chunk_index=0,
-                game_content=chunks[0],
-                description=description
-            )
-            print("=", end="", flush=True)
-            
-            # 發送剩餘的塊
-            for i in range(1, total_chunks):
-                if response['status'] != 'success':
-                    break
-                    
+            for attempt in range(self.RECONNECT_ATTEMPTS):
                 response = self.send_request(
-                    'upload_game_chunk',
+                    'begin_upload',
                     game_name=game_name,
-                    chunk_index=i,
-                    game_content=chunks[i]
+                    size=size,
+                    sha256=sha256.hexdigest(),
+                    description=description
                 )
-                
-                # 顯示進度
-                if i % (total_chunks // 50 + 1) == 0: 
-                    print("=", end="", flush=True)
-            
-            print("] 100%")
-            
-            return response
+                if response['status'] != 'success' or response.get('complete'):
+                    return response  # 服務器已有同樣的內容時不需要傳輸
+
+                offset = response['offset']
+                if offset:
+                    print(f"從 {offset}/{size} 字節處續傳")
+                print("上傳進度: [", end="")
+                try:
+                    ok = self.send_transfer(response['transfer_token'], game_path, size,
+                                            response['chunk_size'], response['window'], offset)
+                except OSError as e:
+                    print(f"]\n上傳中斷: {e}")
+                    time.sleep(min(2 ** attempt * 0.5, 5))
+                    continue
+                print("] 100%" if ok else "]")
+
+                if not ok:
+                    return {'status': 'error', 'message': '上傳的文件校驗失敗'}
+                return {'status': 'success', 'message': '遊戲上傳成功'}
+            return {'status': 'error', 'message': '多次嘗試後仍無法完成上傳'}
         except Exception as e:
             print(f"\n上傳過程中出錯: {e}")
             return {'status': 'error', 'message': str(e)}
+
+    def send_transfer(self, transfer_token, game_path, size, chunk_size, window, offset=0):
+        """在數據連線上從 offset 起分塊送出文件，最多 window 塊未確認；返回服務器的校驗結果
+
+        整個上傳只打開一次文件，每塊用 sendfile 直接從文件發送。
+        """
+        with socket.create_connection(self.address, timeout=30) as sock, open(game_path, 'rb') as file:
+            sock.sendall(data_preamble(bytes.fromhex(transfer_token)))
+            sent = acked = offset
+            marks = 0
+            while sent < size:
+                count = min(chunk_size, size - sent)
+                sock.sendfile(file, sent, count)
+                sent += count
+                while marks < sent * 50 // size:
+                    print("=", end="", flush=True)
+                    marks += 1
+                while sent < size and sent - acked >= window * chunk_size:
+                    acked, status = self.read_upload_ack(sock)
+            while True:
+                acked, status = self.read_upload_ack(sock)
+                if status != UPLOAD_RECEIVING:
+                    return status == UPLOAD_DONE
+
+    def read_upload_ack(self, sock):
+        data = b''
+        while len(data) < UPLOAD_ACK.size:
+            chunk = sock.recv(UPLOAD_ACK.size - len(data))
+            if not chunk:
+                raise ConnectionError('上傳連線已中斷')
+            data += chunk
+        return UPLOAD_ACK.unpack(data)
         
     def handle_game_management(self):
         while True:
@@ -437,7 +618,8 @@ class Client:
                 print("1. 查看大廳遊戲")
                 print("2. 上傳遊戲")
                 print("3. 下載遊戲")
-                print("4. 返回")
+                print("4. 搜尋遊戲")
+                print("5. 返回")
                 
                 game_action = input("請選擇操作: ")
                 
@@ -488,6 +670,9 @@ class Client:
                 elif game_action == '3':
                     self.download_game()
                 elif game_action == '4':
+                    query = input("請輸入關鍵字（可只輸入開頭幾個字）: ")
+                    self.list_all_games(query)
+                elif game_action == '5':
                     break
                 else:
                     print("無效的選擇")
@@ -495,39 +680,143 @@ class Client:
             except Exception as e:
                 print(f"遊戲管理出錯: {e}")
 
-    def list_all_games(self):
-        """列出所有可用的游戏"""
+    def catalog_request(self):
+        """同步遊戲目錄的請求：有本地版本時只要之後的變化"""
+        if self.catalog_version is None:
+            return {'action': 'list_games'}
+        return {'action': 'list_games', 'since': self.catalog_version, 'epoch': self.catalog_epoch}
+
+    def sync_games(self):
+        """同步本地的遊戲目錄：有本地版本時只取回之後的變化，返回按名稱排序的遊戲列表"""
+        request = self.catalog_request()
+        return self.apply_catalog(self.send_request(request.pop('action'), **request))
+
+    def apply_catalog(self, response):
+        """把 list_games 的回覆（完整列表或增量）套用到本地目錄"""
+        if response['status'] != 'success':
+            return response
+        if 'changes' in response:
+            for name, game in response['changes'].items():
+                if game is None:
+                    self.game_catalog.pop(name, None)
+                else:
+                    self.game_catalog[name] = game
+        else:
+            self.game_catalog = {game['name']: game for game in response.get('games', [])}
+        self.catalog_version = response.get('version')
+        self.catalog_epoch = response.get('epoch')
+        return {'status': 'success', 'games': [self.game_catalog[name] for name in sorted(self.game_catalog)]}
+
+    def search_games(self, query='', cursor=None):
+        return self.send_request('search_games', query=query, cursor=cursor)
+
+    def list_all_games(self, query=''):
+        """分頁列出遊戲，有關鍵字時只列出匹配的遊戲"""
         try:
-            response = self.send_request('list_games')
-            if response['status'] == 'success':
+            cursor = None
+            shown = 0
+            while True:
+                response = self.search_games(query, cursor)
+                if response['status'] != 'success':
+                    print(f"\n獲取遊戲列表失敗: {response.get('message', '未知錯誤')}")
+                    return
                 games = response.get('games', [])
-                if games:
+                if not games:
+                    if query:
+                        print(f"\n沒有找到與 '{query}' 相關的遊戲\n")
+                    else:
+                        print("\n目前大廳沒有任何遊戲")
+                        print("您可以通過'上傳遊戲'功能來添加遊戲\n")
+                    return
+
+                if cursor is None:
                     print("\n=== 大廳遊戲列表 ===")
                     print("{:<15} {:<15} {:<30}".format("遊戲名稱", "發布者", "描述"))
                     print("-" * 60)
-                    
-                    for game in games:
-                        print("{:<15} {:<15} {:<30}".format(
-                            game['name'],
-                            game['publisher'],
-                            game['description']
-                        ))
+                for game in games:
+                    print("{:<15} {:<15} {:<30}".format(
+                        game['name'],
+                        game['publisher'],
+                        game['description']
+                    ))
+                shown += len(games)
+
+                cursor = response.get('next_cursor')
+                if not cursor:
                     print("-" * 60)
-                    print(f"總共有 {len(games)} 個遊戲\n")
+                    print(f"總共有 {response['total']} 個遊戲\n")
+                    return
+                more = input(f"已顯示 {shown}/{response['total']} 個遊戲，按 Enter 顯示下一頁，輸入 q 返回: ")
+                if more.strip().lower() == 'q':
+                    return
+
+        except Exception as e:
+            print(f"列出遊戲時出錯: {e}")
+
+    def fetch_transfer(self, transfer_token, size, target_path, sha256=None):
+        """開一條數據連線，憑令牌接收 size 字節並寫入 target_path
+
+        數據直接收進固定的緩衝區再寫入臨時文件，收齊並校驗 sha256 後才替換目標文件，
+        中途斷線不會留下殘缺的遊戲文件。
+        """
+        buffer = bytearray(self.TRANSFER_CHUNK_SIZE)
+        view = memoryview(buffer)
+        hasher = hashlib.sha256()
+        received = 0
+        temp_path = target_path + '.part'
+        with socket.create_connection(self.address, timeout=30) as sock, open(temp_path, 'wb') as f:
+            sock.sendall(data_preamble(bytes.fromhex(transfer_token)))
+            while received < size:
+                n = sock.recv_into(view, min(len(buffer), size - received))
+                if not n:
+                    break
+                f.write(view[:n])
+                hasher.update(view[:n])
+                received += n
+        if received != size:
+            os.remove(temp_path)
+            raise ConnectionError(f'文件傳輸中斷，只收到 {received}/{size} 字節')
+        if sha256 and hasher.hexdigest() != sha256:
+            os.remove(temp_path)
+            raise ValueError('下載的文件校驗失敗')
+        os.replace(temp_path, target_path)
+
+    def fetch_game(self, game_name):
+        """確保本地快取有遊戲的最新版本，回覆中的 path 為本地文件路徑
+
+        帶上本地快取的 sha256，服務器確認沒有變化時回覆 not_modified，不傳輸文件內容。
+        """
+        try:
+            cached = self.game_cache.lookup(game_name)
+            if cached:
+                response = self.send_request('download_game', game_name=game_name, stream=True, sha256=cached)
+            else:
+                response = self.send_request('download_game', game_name=game_name, stream=True)
+
+            game_path = self.game_cache.path(game_name)
+            if response['status'] == 'not_modified':
+                self.game_cache.touch(game_name)
+            elif response['status'] == 'success':
+                if 'transfer_token' in response:
+                    self.fetch_transfer(response['transfer_token'], response['size'], game_path,
+                                        response.get('sha256'))
                 else:
-                    print("\n目前大廳沒有任何遊戲")
-                    print("您可以通過'上傳遊戲'功能來添加遊戲\n")
+                    # 舊版服務器直接在回覆中附帶內容
+                    with open(game_path, 'w', encoding='utf-8') as f:
+                        f.write(response['game_content'])
+                self.game_cache.put(game_name, response.get('sha256'))
             else:
-                print(f"\n獲取遊戲列表失敗: {response.get('message', '未知錯誤')}")
-            
+                return response
+            response['path'] = game_path
+            return response
         except Exception as e:
-            print(f"列出遊戲時出錯: {e}")
+            return {'status': 'error', 'message': f'下載遊戲時出錯: {e}'}
 
     def download_game(self):
         """下載選定的遊戲"""
         try:
-            # 獲取可用遊戲列表
-            response = self.send_request('list_games')
+            # 獲取可用遊戲列表（只同步上次之後變化的部分）
+            response = self.sync_games()
             if response['status'] != 'success':
                 print(f"\n獲取遊戲列表失敗: {response.get('message', '未知錯誤')}")
                 return
@@ -554,20 +843,12 @@ class Client:
                 selected_game = games[choice - 1]
                 game_name = selected_game['name']
 
-                # 發送下載請求
-                response = self.send_request('download_game', game_name=game_name)
+                response = self.fetch_game(game_name)
                 
-                if response['status'] == 'success':
-                    # 確保目標目錄存在
-                    download_dir = 'Client/download_games/'
-                    os.makedirs(download_dir, exist_ok=True)
-                    
-                    # 保存遊戲文件
-                    game_path = os.path.join(download_dir, f"{game_name}.py")
-                    with open(game_path, 'w', encoding='utf-8') as f:
-                        f.write(response['game_content'])
-                    
-                    print(f"\n遊戲 '{game_name}' 已成功下載到 {game_path}")
+                if response['status'] == 'not_modified':
+                    print(f"\n遊戲 '{game_name}' 已是最新版本: {response['path']}")
+                elif response['status'] == 'success':
+                    print(f"\n遊戲 '{game_name}' 已成功下載到 {response['path']}")
                 else:
                     print(f"\n下載失敗: {response.get('message', '未知錯誤')}")
 
@@ -580,7 +861,14 @@ class Client:
             print(f"下載遊戲時出錯: {e}")
 
 if __name__ == "__main__":
-    client = Client()
+    parser = argparse.ArgumentParser(description='遊戲大廳客戶端')
+    parser.add_argument('--host', default='140.113.235.151')
+    parser.add_argument('--port', type=int, default=12222)
+    parser.add_argument('--codec', choices=sorted(CODEC_NAMES), default='json',
+                        help='消息編碼：json 編解碼更快，適合本機與局域網；binary 消息約小一半，適合慢速網絡')
+    args = parser.parse_args()
+
+    client = Client(args.host, args.port, CODEC_NAMES[args.codec])
     
     while True:
         try:
@@ -610,7 +898,7 @@ if __name__ == "__main__":
                     print("-------------------------------------------------")
                     
                   
-                    online_players = response.get('players', {})
+                    online_players = dict(client.online_players)
                     print("Online players:")
                     if online_players:
                         if len(online_players) > 1:
@@ -618,8 +906,10 @@ if __name__ == "__main__":
                                 print(f"Username: {user}  Status: {status}")
                         else:
                             print('No other online player available')
+                        if response.get('next_cursor'):
+                            print(f"(共 {response['total']} 位玩家在線，僅顯示前 {len(online_players)} 位)")
 
-                    client.list_rooms()
+                    client.list_rooms(response=client.rooms_response)
 
                     # 修改登錄後的操作循環
                     while True:
@@ -640,8 +930,9 @@ if __name__ == "__main__":
 
                                 if room_type == 'private':
                                     print("-------------------------------------------------")
-                                    for user, status in online_players.items():
-                                        if status == 'idle':
+                                    idle_players = client.list_players('idle').get('players', {})
+                                    for user, status in idle_players.items():
+                                        if user != username:
                                             print(f"Username: {user}  Status: {status}")
                                     print("-------------------------------------------------")
                                     invitee = input("請輸入您想要邀請的玩家名稱: ")
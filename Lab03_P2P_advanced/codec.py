@@ -0,0 +1,341 @@
+import json
+import struct
+
+# 二進制編碼使用的固定表。服務器與客戶端必須使用相同的表，
+# 因此只能在末尾追加，不能刪除或調整順序。
+KEYS = [
+    'action', 'status', 'message', 'request_id', 'username', 'password',
+    'players', 'rooms', 'room_name', 'room_type', 'type', 'creator',
+    'invited_player', 'inviter', 'player', 'response', 'ip', 'port',
+    'game_type', 'server_info', 'game_name', 'game_content', 'description',
+    'publisher', 'chunk_index', 'total_chunks', 'games', 'name',
+    'board', 'move', 'winner', 'choice', 'result', 'host_choice',
+    'client_choice', 'scores', 'host', 'client', 'game_over',
+    'final_result', 'final_scores',
+    'messages',
+    'stats', 'uptime', 'online', 'actions', 'notifications', 'count', 'errors',
+    'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+    'room_status', 'cursor', 'limit', 'next_cursor', 'total',
+    'rooms_reclaimed', 'game_servers', 'rss_kb', 'waiting', 'playing', 'finished', 'abandoned', 'expired',
+    'player_status',
+    'presence_version', 'from_version', 'version', 'changes', 'reset', 'since',
+    'session_token',
+    'query',
+    'stream', 'transfer_token', 'size',
+    'sha256', 'chunk_size', 'window',
+    'offset', 'complete',
+    'requests', 'responses', 'stop_on_error',
+    'replayed',
+    'epoch',
+    'presence_epoch',
+]
+
+# action / status 的值以及常見的短字符串，編碼成一個小整數
+SYMBOLS = [
+    # actions
+    'register', 'login', 'logout', 'create_room', 'join_room', 'list_rooms',
+    'invite_player', 'respond_to_invite', 'set_game_server', 'get_game_server',
+    'upload_game', 'upload_game_chunk', 'list_games', 'download_game',
+    # statuses
+    'success', 'error', 'notification', 'invite', 'invite_accepted',
+    'invite_rejected', 'game_start',
+    # 常見的值
+    'idle', 'in room', 'playing', 'waiting', 'public', 'private',
+    'X', 'O', ' ', '平局',
+    'notifications', 'stats',
+    'finish_game', 'finished', 'abandoned',
+    'list_players',
+    'presence', 'sync_presence',
+    'resume_session',
+    'search_games',
+    'begin_upload',
+    'not_modified',
+    'batch',
+]
+
+KEY_IDS = {key: index for index, key in enumerate(KEYS)}
+SYMBOL_IDS = {symbol: index for index, symbol in enumerate(SYMBOLS)}
+
+# 井字棋棋盤等只由 ' '、'X'、'O' 組成的列表，每格壓縮成 2 bits
+CELLS = [' ', 'X', 'O']
+CELL_IDS = {cell: index for index, cell in enumerate(CELLS)}
+
+T_NONE = 0
+T_FALSE = 1
+T_TRUE = 2
+T_INT = 3
+T_FLOAT = 4
+T_STR = 5
+T_BYTES = 6
+T_LIST = 7
+T_DICT = 8
+T_SYMBOL = 9
+T_CELLS = 10
+
+FLOAT = struct.Struct('!d')
+
+
+class CodecError(ValueError):
+    """無法編碼或解碼的消息"""
+
+
+class PreparedMessage:
+    """內容固定、會被重複發送的消息（例如快取的列表回覆）
+
+    每種編碼只序列化一次；with_fields 返回附加少量字段（如 request_id）的副本，
+    副本共用已編碼的內容，發送時只需編碼附加的字段。
+    """
+
+    def __init__(self, message, extra=None, cache=None):
+        self.message = message
+        self.extra = extra or {}
+        self.cache = {} if cache is None else cache  # codec_id -> 已編碼的內容
+
+    def with_fields(self, **fields):
+        return PreparedMessage(self.message, {**self.extra, **fields}, self.cache)
+
+    def to_dict(self):
+        return {**self.message, **self.extra}
+
+    def get(self, key, default=None):
+        if key in self.extra:
+            return self.extra[key]
+        return self.message.get(key, default)
+
+    def __getitem__(self, key):
+        if key in self.extra:
+            return self.extra[key]
+        return self.message[key]
+
+    def __contains__(self, key):
+        return key in self.extra or key in self.message
+
+
+class JsonCodec:
+    """JSON 編碼，可讀性好，方便調試"""
+
+    codec_id = 0
+    name = 'json'
+
+    def encode(self, message):
+        if isinstance(message, PreparedMessage):
+            return self.encode_prepared(message)
+        return json.dumps(message).encode('utf-8')
+
+    def encode_prepared(self, prepared):
+        body = prepared.cache.get(self.codec_id)
+        if body is None:
+            body = prepared.cache[self.codec_id] = json.dumps(prepared.message).encode('utf-8')
+        if not prepared.extra:
+            return body
+        if not prepared.message or prepared.extra.keys() & prepared.message.keys():
+            return json.dumps(prepared.to_dict()).encode('utf-8')
+        # 把附加字段接在已編碼對象的末尾: {...} -> {..., "request_id": ...}
+        return body[:-1] + b', ' + json.dumps(prepared.extra).encode('utf-8')[1:]
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class BinaryCodec:
+    """緊湊的二進制編碼
+
+    每個值以一個類型字節開頭；整數使用 zigzag varint，
+    已知的字典鍵、action/status 等常見字符串編碼成表中的序號，
+    井字棋棋盤打包成每格 2 bits。
+    """
+
+    codec_id = 1
+    name = 'binary'
+
+    def encode(self, message):
+        if isinstance(message, PreparedMessage):
+            return self.encode_prepared(message)
+        out = bytearray()
+        self._encode_value(out, message)
+        return bytes(out)
+
+    def encode_prepared(self, prepared):
+        if prepared.extra.keys() & prepared.message.keys():
+            return self.encode(prepared.to_dict())
+        items = prepared.cache.get(self.codec_id)
+        if items is None:
+            # 只快取字典的各個鍵值對，字典頭部的數量在發送時重新寫入
+            encoded = bytearray()
+            self._encode_items(encoded, prepared.message)
+            items = prepared.cache[self.codec_id] = bytes(encoded)
+        out = bytearray([T_DICT])
+        _write_varint(out, len(prepared.message) + len(prepared.extra))
+        out += items
+        self._encode_items(out, prepared.extra)
+        return bytes(out)
+
+    def _encode_items(self, out, mapping):
+        for key, item in mapping.items():
+            if not isinstance(key, str):
+                key = str(key)  # 與 JSON 一致，鍵一律為字符串
+            key_id = KEY_IDS.get(key)
+            if key_id is not None:
+                _write_varint(out, key_id + 1)
+            else:
+                data = key.encode('utf-8')
+                out.append(0)
+                _write_varint(out, len(data))
+                out += data
+            self._encode_value(out, item)
+
+    def decode(self, payload):
+        view = bytes(payload)
+        value, pos = self._decode_value(view, 0)
+        if pos != len(view):
+            raise CodecError('消息末尾有多餘的數據')
+        return value
+
+    def _encode_value(self, out, value):
+        if value is None:
+            out.append(T_NONE)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif isinstance(value, str):
+            symbol = SYMBOL_IDS.get(value)
+            if symbol is not None:
+                out.append(T_SYMBOL)
+                _write_varint(out, symbol)
+            else:
+                data = value.encode('utf-8')
+                out.append(T_STR)
+                _write_varint(out, len(data))
+                out += data
+        elif isinstance(value, int):
+            out.append(T_INT)
+            _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+        elif isinstance(value, dict):
+            out.append(T_DICT)
+            _write_varint(out, len(value))
+            self._encode_items(out, value)
+        elif isinstance(value, (list, tuple)):
+            if value and all(isinstance(item, str) and item in CELL_IDS for item in value):
+                out.append(T_CELLS)
+                _write_varint(out, len(value))
+                for start in range(0, len(value), 4):
+                    packed = 0
+                    for shift, item in enumerate(value[start:start + 4]):
+                        packed |= CELL_IDS[item] << (shift * 2)
+                    out.append(packed)
+            else:
+                out.append(T_LIST)
+                _write_varint(out, len(value))
+                for item in value:
+                    self._encode_value(out, item)
+        elif isinstance(value, float):
+            out.append(T_FLOAT)
+            out += FLOAT.pack(value)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            out.append(T_BYTES)
+            _write_varint(out, len(value))
+            out += value
+        elif isinstance(value, PreparedMessage):
+            self._encode_value(out, value.to_dict())
+        else:
+            raise CodecError(f'無法編碼的類型: {type(value).__name__}')
+
+    def _decode_value(self, view, pos):
+        try:
+            tag = view[pos]
+        except IndexError:
+            raise CodecError('消息不完整')
+        pos += 1
+        if tag == T_SYMBOL:
+            index, pos = _read_varint(view, pos)
+            try:
+                return SYMBOLS[index], pos
+            except IndexError:
+                raise CodecError(f'未知的符號: {index}')
+        if tag == T_STR:
+            length, pos = _read_varint(view, pos)
+            _check_length(view, pos, length)
+            return view[pos:pos + length].decode('utf-8'), pos + length
+        if tag == T_INT:
+            raw, pos = _read_varint(view, pos)
+            return (raw >> 1) ^ -(raw & 1), pos
+        if tag == T_DICT:
+            count, pos = _read_varint(view, pos)
+            result = {}
+            for _ in range(count):
+                key_id, pos = _read_varint(view, pos)
+                if key_id:
+                    try:
+                        key = KEYS[key_id - 1]
+                    except IndexError:
+                        raise CodecError(f'未知的鍵: {key_id}')
+                else:
+                    length, pos = _read_varint(view, pos)
+                    _check_length(view, pos, length)
+                    key = view[pos:pos + length].decode('utf-8')
+                    pos += length
+                result[key], pos = self._decode_value(view, pos)
+            return result, pos
+        if tag == T_LIST:
+            count, pos = _read_varint(view, pos)
+            result = []
+            for _ in range(count):
+                item, pos = self._decode_value(view, pos)
+                result.append(item)
+            return result, pos
+        if tag == T_CELLS:
+            count, pos = _read_varint(view, pos)
+            _check_length(view, pos, (count + 3) // 4)
+            result = []
+            for index in range(count):
+                packed = view[pos + index // 4]
+                result.append(CELLS[(packed >> ((index % 4) * 2)) & 0b11])
+            return result, pos + (count + 3) // 4
+        if tag == T_NONE:
+            return None, pos
+        if tag == T_TRUE:
+            return True, pos
+        if tag == T_FALSE:
+            return False, pos
+        if tag == T_FLOAT:
+            _check_length(view, pos, FLOAT.size)
+            return FLOAT.unpack_from(view, pos)[0], pos + FLOAT.size
+        if tag == T_BYTES:
+            length, pos = _read_varint(view, pos)
+            _check_length(view, pos, length)
+            return bytes(view[pos:pos + length]), pos + length
+        raise CodecError(f'未知的類型字節: {tag}')
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(view, pos):
+    if pos < len(view) and view[pos] < 0x80:
+        return view[pos], pos + 1  # 單字節的快速路徑
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = view[pos]
+        except IndexError:
+            raise CodecError('消息不完整')
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _check_length(view, pos, length):
+    if pos + length > len(view):
+        raise CodecError('消息不完整')
+
+
+CODECS = {codec.codec_id: codec for codec in (JsonCodec(), BinaryCodec())}
+CODEC_NAMES = {codec.name: codec.codec_id for codec in CODECS.values()}
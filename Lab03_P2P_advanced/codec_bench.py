@@ -0,0 +1,92 @@
+import argparse
+import json
+import time
+
+from codec import CODECS
+
+
+def sample_messages(players=50, rooms=20, games=20):
+    """大廳與遊戲連線上現有的各類消息"""
+    roster = {f'player{i}': ('idle' if i % 3 else 'playing') for i in range(players)}
+    room_list = {
+        f'room{i}': {'type': 'public', 'creator': f'player{i}', 'status': 'waiting' if i % 2 else 'playing'}
+        for i in range(rooms)
+    }
+    game_list = [
+        {'name': f'game{i}', 'publisher': f'player{i}', 'description': f'第 {i} 個社群遊戲'}
+        for i in range(games)
+    ]
+    board = ['X', 'O', ' ', ' ', 'X', ' ', 'O', ' ', ' ']
+    return {
+        'login 請求': {'action': 'login', 'username': 'player1', 'password': 'secret', 'request_id': 'login_140234'},
+        'login 回覆': {'status': 'success', 'message': 'Login successful.', 'players': roster,
+                     'username': 'player1', 'request_id': 'login_140234'},
+        'create_room 請求': {'action': 'create_room', 'room_type': 'public', 'room_name': 'room1',
+                           'request_id': 'create_room_140234'},
+        'list_rooms 回覆': {'status': 'success', 'rooms': room_list, 'request_id': 'list_rooms_140234'},
+        'list_games 回覆': {'status': 'success', 'games': game_list, 'message': '成功獲取遊戲列表',
+                          'request_id': 'list_games_140234'},
+        'broadcast 通知': {'status': 'notification', 'message': 'Lobby boardcasting: player1 已加入大廳'},
+        'invite 推送': {'status': 'invite', 'room_name': 'room1', 'inviter': 'player1'},
+        'game_start 推送': {'status': 'game_start', 'ip': '140.113.235.151', 'port': 23456,
+                          'game_type': 'tictactoe'},
+        '井字棋棋盤': {'board': board, 'move': 4},
+        '井字棋落子': {'move': 4},
+        '猜拳結果': {'result': '房主贏', 'host_choice': '1', 'client_choice': '2',
+                 'scores': {'host': 1, 'client': 0}},
+    }
+
+
+def measure(func, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(arg)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def run(repeat, players, rooms, games):
+    results = []
+    for label, message in sample_messages(players, rooms, games).items():
+        for codec in CODECS.values():
+            payload = codec.encode(message)
+            assert codec.decode(payload) == json.loads(json.dumps(message)), (label, codec.name)
+            results.append({
+                'message': label,
+                'codec': codec.name,
+                'bytes': len(payload),
+                'encode_us': measure(codec.encode, message, repeat),
+                'decode_us': measure(codec.decode, payload, repeat),
+            })
+    return results
+
+
+def print_table(results):
+    print("{:<18} {:<8} {:>8} {:>12} {:>12}".format("消息", "編碼", "bytes", "encode(us)", "decode(us)"))
+    print("-" * 62)
+    for row in results:
+        print("{:<18} {:<8} {:>8} {:>12.2f} {:>12.2f}".format(
+            row['message'], row['codec'], row['bytes'], row['encode_us'], row['decode_us']))
+    print("-" * 62)
+    for codec in CODECS.values():
+        rows = [row for row in results if row['codec'] == codec.name]
+        print("{:<8} 總字節 {:>8}  encode {:>10.2f}us  decode {:>10.2f}us".format(
+            codec.name,
+            sum(row['bytes'] for row in rows),
+            sum(row['encode_us'] for row in rows),
+            sum(row['decode_us'] for row in rows)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='比較 JSON 與二進制編碼的大小與編解碼耗時')
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--players', type=int, default=50, help='login 回覆中的在線玩家數')
+    parser.add_argument('--rooms', type=int, default=20, help='list_rooms 回覆中的房間數')
+    parser.add_argument('--games', type=int, default=20, help='list_games 回覆中的遊戲數')
+    parser.add_argument('--json', metavar='PATH', help='把結果另存為 JSON')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.players, args.rooms, args.games)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
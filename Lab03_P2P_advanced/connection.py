@@ -0,0 +1,158 @@
+import collections
+import socket
+import threading
+
+from protocol import detect_protocol
+from replay import ReplayCache
+
+# 每個連線出站隊列的上限；隊列非空時再放入會超出上限，即視為接收過慢並斷開。
+# 單條超過上限的消息在隊列為空時仍然允許發送。
+MAX_OUTBOUND_BYTES = 1024 * 1024
+
+
+def set_nodelay(sock):
+    """關閉 Nagle 算法：請求和回覆都是小消息，不能等對方的延遲確認（約 40ms）才送出"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
+
+
+class BaseConnection:
+    """單個客戶端連線：負責協議協商與消息編解碼"""
+
+    def __init__(self, addr=None):
+        self.addr = addr
+        self.username = None  # 登錄成功後設置
+        self.replay = ReplayCache()  # 最近請求的回覆，登錄或恢復會話後換成會話的快取
+        self.closed = False
+        self.protocol = None  # 收到第一批數據後協商
+        self.pending = b''
+        self.verified = {}  # 本連線已驗證過的 username -> 憑證摘要
+
+    def receive(self, data):
+        """處理收到的原始數據，返回其中所有完整的請求"""
+        if self.protocol is None:
+            self.pending += data
+            detected = detect_protocol(self.pending)
+            if detected is None:
+                return []
+            self.protocol, reply, data = detected
+            self.pending = b''
+            if reply:
+                self.write(reply)
+        return self.protocol.feed(data)
+
+    def send_message(self, message):
+        if self.protocol is None:
+            return  # 尚未完成協商，無法編碼
+        self.write(self.protocol.encode(message))
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def drop_slow_consumer(self):
+        """出站隊列溢出：對方接收太慢，斷開連線而不是阻塞發送方"""
+        print(f"客戶端 {self.username or self.addr} 接收過慢，出站隊列已滿，斷開連線")
+        self.abort()
+
+
+class ThreadedConnection(BaseConnection):
+    """阻塞 socket 連線（執行緒模式，每個連線一個讀執行緒和一個寫執行緒）
+
+    write 只把數據放入有上限的出站隊列，由寫執行緒負責 sendall，
+    因此廣播給慢客戶端不會阻塞處理請求的執行緒。
+    """
+
+    def __init__(self, client_socket, addr=None, max_outbound_bytes=MAX_OUTBOUND_BYTES):
+        super().__init__(addr)
+        self.client_socket = client_socket
+        set_nodelay(client_socket)
+        self.max_outbound_bytes = max_outbound_bytes
+        self.outbound = collections.deque()
+        self.outbound_bytes = 0
+        self.outbound_ready = threading.Condition()
+        self.writer_thread = threading.Thread(target=self.drain_outbound)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def write(self, data):
+        with self.outbound_ready:
+            if self.closed:
+                return
+            overflow = self.outbound_bytes and self.outbound_bytes + len(data) > self.max_outbound_bytes
+            if not overflow:
+                self.outbound.append(data)
+                self.outbound_bytes += len(data)
+                self.outbound_ready.notify()
+        if overflow:
+            self.drop_slow_consumer()
+
+    def drain_outbound(self):
+        """寫執行緒：把隊列中已排隊的消息合併後一次送出，連線關閉且隊列清空後關閉 socket"""
+        try:
+            while True:
+                with self.outbound_ready:
+                    while not self.outbound and not self.closed:
+                        self.outbound_ready.wait()
+                    if not self.outbound:
+                        break
+                    data = b''.join(self.outbound)
+                    self.outbound.clear()
+                    self.outbound_bytes = 0
+                self.client_socket.sendall(data)
+        except OSError:
+            self.abort()
+        finally:
+            self.client_socket.close()
+
+    def abort(self):
+        # 讓阻塞中的 recv / sendall 立即返回，讀執行緒隨後清理連線
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.outbound_ready:
+            if self.closed:
+                return
+            self.closed = True
+            self.outbound_ready.notify()
+
+
+class AsyncConnection(BaseConnection):
+    """asyncio 連線（單執行緒事件迴圈模式）
+
+    write 只把數據放進 transport 的寫緩衝區（即出站隊列），由事件迴圈負責送出，
+    不會阻塞事件迴圈，因此必須在事件迴圈執行緒中呼叫。
+    """
+
+    def __init__(self, reader, writer, max_outbound_bytes=MAX_OUTBOUND_BYTES):
+        super().__init__(writer.get_extra_info('peername'))
+        self.reader = reader
+        self.writer = writer
+        # 監聽 socket 以 proto=0 建立，asyncio 不會自動為接受的連線設置 TCP_NODELAY
+        set_nodelay(writer.get_extra_info('socket'))
+        self.max_outbound_bytes = max_outbound_bytes
+
+    def write(self, data):
+        if self.closed or self.writer.is_closing():
+            return
+        buffered = self.writer.transport.get_write_buffer_size()
+        if buffered and buffered + len(data) > self.max_outbound_bytes:
+            self.drop_slow_consumer()
+            return
+        self.writer.write(data)
+
+    def abort(self):
+        self.writer.transport.abort()
+
+    async def drain(self):
+        if not self.closed:
+            await self.writer.drain()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
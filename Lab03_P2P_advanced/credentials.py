@@ -0,0 +1,135 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import LatencyHistogram
+
+HASH_SCHEME = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = 100000
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS, salt=None):
+    """返回 'pbkdf2_sha256$迭代次數$鹽$雜湊' 格式的密碼雜湊"""
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f'{HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}'
+
+
+def is_hashed(stored):
+    return stored.startswith(HASH_SCHEME + '$')
+
+
+def verify_password(password, stored):
+    """比較密碼與保存的雜湊；舊數據中的明文密碼直接比較"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, iterations, salt, expected = stored.split('$')
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+class PendingResponse:
+    """要等後台工作完成才能給出的回覆
+
+    future 完成後，在持有 self.lock（執行緒模式）或事件迴圈中（asyncio 模式）
+    調用 finish(future 的結果) 得到真正的回覆。
+    """
+
+    def __init__(self, future, finish):
+        self.future = future
+        self.finish = finish
+
+    def then(self, callback):
+        """返回在 finish 之後再處理一次回覆的 PendingResponse
+
+        finish 又得到 PendingResponse 時（例如 batch 中接着的 login），callback 延後到它完成之後。
+        """
+        finish = self.finish
+
+        def chained(result):
+            response = finish(result)
+            if isinstance(response, PendingResponse):
+                return response.then(callback)
+            return callback(response)
+        return PendingResponse(self.future, chained)
+
+
+class CredentialService:
+    """在有限大小的執行緒池中計算密碼雜湊，不佔用大廳處理請求的執行緒或事件迴圈
+
+    pbkdf2_hmac 計算時會釋放 GIL，因此執行緒池可以真正並行。
+    同時排隊的任務超過 max_pending 時直接拒絕，避免登錄風暴無限堆積。
+    驗證成功後在連線上記下憑證摘要，同一連線重新登錄時不再重新計算。
+    """
+
+    def __init__(self, workers=None, max_pending=256, iterations=DEFAULT_ITERATIONS):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='credentials')
+        self.max_pending = max_pending
+        self.iterations = iterations
+        self.session_key = os.urandom(32)  # 只用於本行程內的驗證快取
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.latency = LatencyHistogram()  # 排隊加計算的時間
+
+    def submit(self, func, *args):
+        """提交雜湊任務，排隊已滿時返回 None"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            self.pending += 1
+        future = self.executor.submit(self.timed, func, time.perf_counter(), *args)
+        future.add_done_callback(self.task_done)
+        return future
+
+    def timed(self, func, queued, *args):
+        result = func(*args)
+        seconds = time.perf_counter() - queued
+        with self.lock:
+            self.latency.record(seconds)
+        return result
+
+    def task_done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def hash(self, password):
+        return self.submit(hash_password, password, self.iterations)
+
+    def verify(self, password, stored):
+        return self.submit(verify_password, password, stored)
+
+    def session_digest(self, password, stored):
+        return hmac.new(self.session_key, f'{stored}\0{password}'.encode('utf-8'), 'sha256').digest()
+
+    def cached(self, connection, username, password, stored):
+        """這個連線之前是否已用同樣的密碼驗證過（保存的雜湊未變）"""
+        digest = connection.verified.get(username)
+        if digest is not None and hmac.compare_digest(digest, self.session_digest(password, stored)):
+            self.cache_hits += 1
+            return True
+        return False
+
+    def remember(self, connection, username, password, stored):
+        connection.verified[username] = self.session_digest(password, stored)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'rejected': self.rejected,
+                'cache_hits': self.cache_hits,
+                'count': self.latency.count,
+                'p50_ms': round(self.latency.percentile(0.50) * 1000, 3),
+                'p99_ms': round(self.latency.percentile(0.99) * 1000, 3),
+            }
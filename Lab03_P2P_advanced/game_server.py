@@ -1,7 +1,7 @@
 import socket
-import json
 import threading
 import random
+from protocol import MessageSocket
 
 class GameServer:
     def __init__(self, game_type, port):
@@ -16,6 +16,7 @@ class GameServer:
             self.port = self.server_socket.getsockname()[1]
         self.server_socket.listen(1)
         self.client_socket = None
+        self.client = None  # 協商好編碼的消息連線
         self.game_state = {}
         
     def start(self):
@@ -36,6 +37,7 @@ class GameServer:
             }
             
         self.client_socket, addr = self.server_socket.accept()
+        self.client = MessageSocket.accept(self.client_socket)
         print(f"玩家已連接：{addr}")
         
         if self.game_type == "rockpaperscissors":
@@ -48,11 +50,11 @@ class GameServer:
         while self.game_state["rounds"] < 3:  # 三兩勝
             print(f"\n第 {self.game_state['rounds'] + 1} 回合")
             # 等待雙方選擇
-            self.client_socket.send(json.dumps({"message": "請選擇"}).encode())
+            self.client.send({"message": "請選擇"})
             print("等待對方選擇...")
             
-            client_data = self.client_socket.recv(1024).decode()
-            self.game_state["client_choice"] = json.loads(client_data)["choice"]
+            client_data = self.client.recv()
+            self.game_state["client_choice"] = client_data["choice"]
             
             self.game_state["host_choice"] = input("請選擇 (1:石頭 2:剪刀 3:布): ")
             
@@ -69,7 +71,7 @@ class GameServer:
             print("=====================")
             
             # 發送結果給客戶端
-            self.client_socket.send(json.dumps({
+            self.client.send({
                 "result": result,
                 "host_choice": self.game_state["host_choice"],
                 "client_choice": self.game_state["client_choice"],
@@ -77,7 +79,7 @@ class GameServer:
                     "host": self.game_state["host_score"],
                     "client": self.game_state["client_score"]
                 }
-            }).encode())
+            })
         
         print("\n===== 遊戲結束 =====")
         if self.game_state["host_score"] > self.game_state["client_score"]:
@@ -94,14 +96,14 @@ class GameServer:
         print("==================")
         
         # 發送最終結果給客戶端
-        self.client_socket.send(json.dumps({
+        self.client.send({
             "game_over": True,
             "final_result": client_result,
             "final_scores": {
                 "host": self.game_state["host_score"],
                 "client": self.game_state["client_score"]
             }
-        }).encode())
+        })
 
     def judge_rps(self):
         choices = {
@@ -144,14 +146,13 @@ class GameServer:
                 # 房主回合
                 move = int(input("請輸入位置 (0-8): "))
                 if self.make_move(move):
-                    self.client_socket.send(json.dumps({
+                    self.client.send({
                         "board": self.game_state["board"],
                         "move": move
-                    }).encode())
+                    })
             else:
                 print("等待對方下棋...")
-                data = self.client_socket.recv(1024).decode()
-                move_data = json.loads(data)
+                move_data = self.client.recv()
                 self.make_move(move_data["move"])
             
             # 檢查勝負
@@ -177,10 +178,10 @@ class GameServer:
                 print("==================")
                 
                 # 發送結果給客戶端
-                self.client_socket.send(json.dumps({
+                self.client.send({
                     "winner": winner,
                     "board": self.game_state["board"]
-                }).encode())
+                })
                 break
 
     def make_move(self, position):
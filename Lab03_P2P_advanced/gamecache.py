@@ -0,0 +1,80 @@
+import json
+import os
+from collections import OrderedDict
+
+from protocol import file_sha256
+
+
+class GameCache:
+    """客戶端已下載遊戲的本地快取
+
+    遊戲文件仍保存在 Client/download_games/<遊戲名>.py，另外用一個索引文件記下
+    每個遊戲的 sha256 與大小。下載前把本地的雜湊帶給服務器，內容沒變時只收到 not_modified。
+    使用快取前重新計算雜湊，文件被改動或損壞時當作沒有快取。
+    總大小超過 max_bytes 時刪除最久沒有使用的遊戲。
+    """
+
+    INDEX_NAME = '.cache_index.json'
+
+    def __init__(self, directory='Client/download_games', max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, self.INDEX_NAME)
+        self.entries = OrderedDict()  # game_name -> {'sha256', 'size'}，最近使用的在最後
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                self.entries = OrderedDict(json.load(file))
+        except (OSError, ValueError):
+            self.entries = OrderedDict()
+
+    def save(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file)
+        os.replace(temp_path, self.index_path)
+
+    def path(self, game_name):
+        return os.path.join(self.directory, f"{game_name}.py")
+
+    def lookup(self, game_name):
+        """返回本地快取的 sha256；沒有快取或文件與記錄不符時返回 None"""
+        entry = self.entries.get(game_name)
+        if entry is None:
+            return None
+        try:
+            valid = file_sha256(self.path(game_name)) == entry['sha256']
+        except OSError:
+            valid = False
+        if not valid:
+            del self.entries[game_name]
+            self.save()
+            return None
+        return entry['sha256']
+
+    def touch(self, game_name):
+        """服務器確認沒有變化：記為最近使用"""
+        self.entries.move_to_end(game_name)
+        self.hits += 1
+        self.save()
+
+    def put(self, game_name, sha256=None):
+        """新下載的文件已寫入 path(game_name)，登記並按需淘汰舊的遊戲；sha256 為 None 時自行計算"""
+        path = self.path(game_name)
+        self.entries[game_name] = {'sha256': sha256 or file_sha256(path), 'size': os.path.getsize(path)}
+        self.entries.move_to_end(game_name)
+        self.misses += 1
+        total = sum(entry['size'] for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            old_name, old_entry = self.entries.popitem(last=False)
+            total -= old_entry['size']
+            try:
+                os.remove(self.path(old_name))
+            except OSError:
+                pass
+        self.save()
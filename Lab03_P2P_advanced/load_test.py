@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from async_client import AsyncClient
+from metrics import LatencyHistogram
+
+LAB_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERS = {
+    'lab02': os.path.join(LAB_DIR, '..', 'Lab02_P2P', 'server.py'),
+    'lab03': os.path.join(LAB_DIR, 'server1.py'),
+}
+
+
+class LoadStats:
+    """按動作統計延遲與錯誤"""
+
+    def __init__(self):
+        self.latency = {}  # action -> LatencyHistogram
+        self.errors = {}  # action -> 錯誤次數
+        self.error_messages = {}  # 錯誤訊息 -> 次數，方便查看失敗原因
+
+    async def timed(self, action, awaitable):
+        start = time.perf_counter()
+        response = await awaitable
+        self.record(action, time.perf_counter() - start, response)
+        return response
+
+    def record(self, action, seconds, response):
+        self.latency.setdefault(action, LatencyHistogram()).record(seconds)
+        if response is None or response.get('status') not in ('success', 'invite'):
+            self.errors[action] = self.errors.get(action, 0) + 1
+            message = f"{action}: {response.get('message') if response else '沒有收到推送'}"
+            self.error_messages[message] = self.error_messages.get(message, 0) + 1
+
+    def total(self):
+        return sum(histogram.count for histogram in self.latency.values())
+
+    def report(self):
+        actions = {}
+        for action in sorted(self.latency):
+            histogram = self.latency[action]
+            errors = self.errors.get(action, 0)
+            actions[action] = {
+                'count': histogram.count,
+                'errors': errors,
+                'error_rate': round(errors / histogram.count, 4),
+                'p50_ms': round(histogram.percentile(0.50) * 1000, 3),
+                'p99_ms': round(histogram.percentile(0.99) * 1000, 3),
+                'p999_ms': round(histogram.percentile(0.999) * 1000, 3),
+                'max_ms': round(histogram.max * 1000, 3),
+            }
+        return actions
+
+
+async def user_pair(index, args, stats):
+    """一對虛擬玩家：註冊、登錄，之後每輪
+    list_rooms → 房主建公開房間、對方加入、結束遊戲 → 房主建私人房間、邀請、對方接受、結束遊戲，
+    最後登出。"""
+    host = AsyncClient(args.host, args.port, track_presence=False)
+    guest = AsyncClient(args.host, args.port, track_presence=False)
+    host.REQUEST_TIMEOUT = guest.REQUEST_TIMEOUT = args.timeout
+    await host.connect()
+    await guest.connect()
+    try:
+        names = (f'{args.prefix}h{index}', f'{args.prefix}g{index}')
+        for client, name in zip((host, guest), names):
+            await stats.timed('register', client.register(name, 'load-test'))
+            response = await stats.timed('login', client.login(name, 'load-test'))
+            if response['status'] != 'success':
+                return  # 沒登錄成功，後面的動作都沒有意義
+
+        for round_index in range(args.rounds):
+            await stats.timed('list_rooms', guest.list_rooms())
+
+            room_name = f'{args.prefix}pub{index}-{round_index}'
+            await stats.timed('create_room', host.create_room('public', room_name))
+            await stats.timed('join_room', guest.join_room(room_name))
+            await stats.timed('finish_game', host.finish_game(room_name))
+
+            room_name = f'{args.prefix}pri{index}-{round_index}'
+            await stats.timed('create_room', host.create_room('private', room_name))
+            invited = guest.wait_for_push('invite', args.timeout)
+            start = time.perf_counter()
+            await stats.timed('invite_player', host.invite_player(room_name, names[1]))
+            try:
+                push = await invited
+            except asyncio.TimeoutError:
+                push = None
+            stats.record('invite_push', time.perf_counter() - start, push)  # 從發出邀請到對方收到推送
+            await stats.timed('respond_to_invite', guest.respond_to_invite(room_name, True))
+            await stats.timed('finish_game', host.finish_game(room_name))
+
+        for client in (host, guest):
+            await stats.timed('logout', client.logout())
+    finally:
+        await host.close()
+        await guest.close()
+
+
+def server_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def sample_rss(pid, samples, interval=0.2):
+    while True:
+        rss = server_rss_kb(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(interval)
+
+
+async def run(args, server=None):
+    stats = LoadStats()
+    samples = []
+    sampler = asyncio.ensure_future(sample_rss(server.pid, samples)) if server else None
+    rss_start = server_rss_kb(server.pid) if server else None
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_pair(i, args, stats) for i in range(args.users // 2)))
+    duration = time.perf_counter() - start
+
+    if sampler:
+        sampler.cancel()
+    server_stats = None
+    async with AsyncClient(args.host, args.port, track_presence=False) as client:
+        response = await client.get_stats()
+        if response['status'] == 'success':
+            server_stats = response['stats']
+    rss_end = server_rss_kb(server.pid) if server else (server_stats or {}).get('rss_kb')
+
+    requests = stats.total()
+    errors = sum(stats.errors.values())
+    return {
+        'lab': args.lab,
+        'mode': args.mode,
+        'users': args.users // 2 * 2,
+        'rounds': args.rounds,
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_s': round(duration, 3),
+        'requests': requests,
+        'throughput_rps': round(requests / duration, 1) if duration else 0,
+        'errors': errors,
+        'error_rate': round(errors / requests, 4) if requests else 0,
+        'error_messages': stats.error_messages,
+        'actions': stats.report(),
+        'server_rss_kb': {'start': rss_start, 'peak': max(samples, default=rss_end), 'end': rss_end},
+        'server_stats': server_stats,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir):
+    """在臨時目錄中啟動大廳，用戶數據和遊戲文件不會寫進倉庫"""
+    command = [sys.executable, os.path.abspath(SERVERS[args.lab]), '--host', args.host,
+               '--port', str(args.port), '--mode', args.mode]
+    server = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'服務器啟動失敗，退出碼 {server.returncode}')
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('等待服務器啟動超時')
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def print_report(result, baseline=None):
+    print(f"\n{result['lab']} ({result['mode']})  {result['users']} 個虛擬玩家 × {result['rounds']} 輪")
+    print(f"耗時 {result['duration_s']}s  請求 {result['requests']}  吞吐量 {result['throughput_rps']} req/s  "
+          f"錯誤率 {result['error_rate']:.2%}")
+    rss = result['server_rss_kb']
+    print(f"服務器 RSS (KB): 開始 {rss['start']}  峰值 {rss['peak']}  結束 {rss['end']}")
+    print("\n{:<18} {:>7} {:>7} {:>10} {:>10} {:>10} {:>10}".format(
+        "動作", "次數", "錯誤", "p50(ms)", "p99(ms)", "p999(ms)", "max(ms)"))
+    print("-" * 78)
+    for action, row in result['actions'].items():
+        line = "{:<18} {:>7} {:>7} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            action, row['count'], row['errors'], row['p50_ms'], row['p99_ms'], row['p999_ms'], row['max_ms'])
+        old = (baseline or {}).get('actions', {}).get(action)
+        if old and old['p99_ms']:
+            line += f"   p99 {row['p99_ms'] / old['p99_ms']:.2f}x"
+        print(line)
+    for message, count in sorted(result['error_messages'].items(), key=lambda item: -item[1])[:5]:
+        print(f"錯誤 {count} 次: {message}")
+    if baseline:
+        print(f"\n與基準比較: 吞吐量 {result['throughput_rps'] / baseline['throughput_rps']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='大廳壓力測試：模擬多個玩家並統計各動作的延遲')
+    parser.add_argument('--lab', choices=sorted(SERVERS), default='lab03', help='啟動哪一個實驗的大廳')
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread', help='服務器的運行模式')
+    parser.add_argument('--users', type=int, default=100, help='虛擬玩家數（兩兩一組）')
+    parser.add_argument('--rounds', type=int, default=5, help='每組玩家重複房間流程的次數')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 表示自動選擇空閒端口')
+    parser.add_argument('--connect', action='store_true', help='不啟動服務器，直接測試 --host/--port 上已運行的大廳')
+    parser.add_argument('--timeout', type=float, default=30, help='單個請求的超時（秒）')
+    parser.add_argument('--prefix', default='', help='用戶名與房間名前綴，重複測試同一個服務器時避免衝突')
+    parser.add_argument('--json', metavar='PATH', help='把結果另存為 JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='與之前保存的 JSON 結果比較')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    if args.connect:
+        result = asyncio.run(run(args))
+    else:
+        args.port = args.port or free_port()
+        with tempfile.TemporaryDirectory(prefix='lobby-load-') as workdir:
+            server = start_server(args, workdir)
+            try:
+                result = asyncio.run(run(args, server))
+            finally:
+                server.terminate()
+                server.wait()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
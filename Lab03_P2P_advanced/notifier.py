@@ -0,0 +1,63 @@
+import time
+
+
+class NotificationBatcher:
+    """合併一個時間窗口內的大廳通知
+
+    窗口內只有一條通知時照舊推送 'notification'，
+    多條時合併為一條 'notifications' 推送，每個客戶端只需發送一次。
+    """
+
+    REPORT_INTERVAL = 10  # 秒，定期打印節省的發送次數
+
+    def __init__(self, deliver, call_later, window=0.05):
+        self.deliver = deliver  # deliver(message) -> 收到推送的客戶端數
+        self.call_later = call_later
+        self.window = window
+        self.pending = []
+        self.scheduled = False
+        self.events = 0  # 收到的通知數
+        self.flushes = 0  # 實際廣播的次數
+        self.sends = 0  # 實際發送給客戶端的消息數
+        self.sends_saved = 0  # 合併後少發送的消息數
+        self.last_report = time.monotonic()
+
+    def add(self, text):
+        self.pending.append(text)
+        self.events += 1
+        if self.window <= 0:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.call_later(self.window, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        events, self.pending = self.pending, []
+        if not events:
+            return
+        if len(events) == 1:
+            message = {'status': 'notification', 'message': events[0]}
+        else:
+            message = {'status': 'notifications', 'messages': events}
+        recipients = self.deliver(message)
+        self.flushes += 1
+        self.sends += recipients
+        self.sends_saved += (len(events) - 1) * recipients
+        self.maybe_report()
+
+    def maybe_report(self):
+        now = time.monotonic()
+        if self.sends_saved and now - self.last_report >= self.REPORT_INTERVAL:
+            self.last_report = now
+            print(f"通知合併: {self.events} 條通知 -> {self.flushes} 次廣播, "
+                  f"發送 {self.sends} 次, 節省 {self.sends_saved} 次")
+
+    def stats(self):
+        return {
+            'window': self.window,
+            'events': self.events,
+            'flushes': self.flushes,
+            'sends': self.sends,
+            'sends_saved': self.sends_saved,
+        }
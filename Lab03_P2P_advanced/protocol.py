@@ -0,0 +1,249 @@
+import codecs
+import collections
+import hashlib
+import json
+import socket
+import struct
+
+from codec import CODECS, CodecError
+
+# 連線建立後客戶端先送出 FRAME_MAGIC + 編碼代號，服務器回覆相同格式確認。
+# 之後每條消息都是 4 字節大端長度 + 內容。
+# 沒有送出前導碼的舊版客戶端仍然使用直接串接的 JSON。
+FRAME_MAGIC = b'NPF1'
+HELLO_SIZE = len(FRAME_MAGIC) + 1
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+CODEC_JSON = 0
+CODEC_BINARY = 1
+
+# 數據連線：客戶端連上同一個端口後先送出 DATA_MAGIC + 傳輸令牌，
+# 之後直接傳輸文件內容，不再經過消息分幀與編碼。令牌由控制連線上的請求取得。
+DATA_MAGIC = b'NPD1'
+TRANSFER_TOKEN_SIZE = 16
+DATA_PREAMBLE_SIZE = len(DATA_MAGIC) + TRANSFER_TOKEN_SIZE
+
+# 上傳時服務器在數據連線上回送確認：8 字節已收到的字節數 + 1 字節狀態。
+# 客戶端據此限制未確認的數據量；最後一個確認帶上校驗結果。
+UPLOAD_ACK = struct.Struct('!QB')
+UPLOAD_RECEIVING = 0
+UPLOAD_DONE = 1
+UPLOAD_CORRUPT = 2
+
+
+class ProtocolError(Exception):
+    """收到不符合協議的數據"""
+
+
+def encode_frame(payload):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f'消息過大: {len(payload)} bytes')
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """增量解析 長度 + 內容 的幀
+
+    每次 feed 只從上次停下的位置往後讀取幀頭，已解析的數據直接從緩衝區前端刪除，
+    大消息分多次到達時不會重複掃描已收到的內容。
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.expected = None  # 當前幀的內容長度（已讀到幀頭時）
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        end = len(buffer)
+        while True:
+            if self.expected is None:
+                if end - pos < HEADER.size:
+                    break
+                (self.expected,) = HEADER.unpack_from(buffer, pos)
+                if self.expected > self.max_frame_size:
+                    raise ProtocolError(f'幀長度超出上限: {self.expected} bytes')
+                pos += HEADER.size
+            if end - pos < self.expected:
+                break
+            frames.append(bytes(buffer[pos:pos + self.expected]))
+            pos += self.expected
+            self.expected = None
+        if pos:
+            del buffer[:pos]
+        return frames
+
+
+class FramedProtocol:
+    """長度前綴分幀，內容使用協商好的編碼（JSON 或二進制）"""
+
+    framed = True
+
+    def __init__(self, codec_id=CODEC_JSON):
+        self.codec_id = codec_id
+        self.codec = CODECS[codec_id]
+        self.decoder = FrameDecoder()
+
+    def encode(self, message):
+        return encode_frame(self.codec.encode(message))
+
+    def feed(self, data):
+        try:
+            return [self.codec.decode(payload) for payload in self.decoder.feed(data)]
+        except (CodecError, ValueError) as e:
+            raise ProtocolError(f'無法解碼的消息: {e}')
+
+
+class LegacyProtocol:
+    """舊版協議：直接串接的 JSON 物件，沒有長度信息"""
+
+    framed = False
+    codec_id = CODEC_JSON
+    max_buffer_size = 1024 * 1024
+
+    def __init__(self):
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+
+    def encode(self, message):
+        return CODECS[CODEC_JSON].encode(message)
+
+    def feed(self, data):
+        self.buffer += self.text_decoder.decode(data)
+        messages = []
+        pos = 0
+        while pos < len(self.buffer):
+            while pos < len(self.buffer) and self.buffer[pos].isspace():
+                pos += 1
+            if pos == len(self.buffer):
+                break
+            try:
+                message, pos = self.json_decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                break  # 消息不完整，等待更多數據
+            messages.append(message)
+        self.buffer = self.buffer[pos:]
+        if len(self.buffer) > self.max_buffer_size:
+            raise ProtocolError('未完成的消息過大')
+        return messages
+
+
+class DataChannel:
+    """數據連線：不承載消息，由服務器按令牌傳輸文件"""
+
+    framed = False
+    codec_id = None
+
+    def __init__(self, token, data=b''):
+        self.token = token
+        self.initial = data  # 前導碼之後已收到的數據
+
+    def feed(self, data):
+        self.initial += data
+        return []
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """文件內容的 sha256，上傳、下載與快取校驗都用它"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def data_preamble(token):
+    return DATA_MAGIC + token
+
+
+def hello(codec_id=CODEC_JSON):
+    return FRAME_MAGIC + bytes([codec_id])
+
+
+def detect_protocol(data):
+    """服務器端：根據連線最先收到的數據判斷協議
+
+    返回 (protocol, 需要回覆的握手數據, 剩餘數據)；數據不足以判斷時返回 None。
+    """
+    if data[:len(DATA_MAGIC)] == DATA_MAGIC[:len(data)]:
+        if len(data) < DATA_PREAMBLE_SIZE:
+            return None
+        return DataChannel(bytes(data[len(DATA_MAGIC):DATA_PREAMBLE_SIZE])), b'', data[DATA_PREAMBLE_SIZE:]
+    if data[:len(FRAME_MAGIC)] == FRAME_MAGIC[:len(data)]:
+        if len(data) < HELLO_SIZE:
+            return None
+        # 不支持的編碼代號回退到 JSON
+        codec_id = data[HELLO_SIZE - 1]
+        protocol = FramedProtocol(codec_id if codec_id in CODECS else CODEC_JSON)
+        return protocol, hello(protocol.codec_id), data[HELLO_SIZE:]
+    return LegacyProtocol(), b'', data
+
+
+def client_handshake(sock, codec_id=CODEC_JSON):
+    """客戶端：送出前導碼並等待服務器確認，返回協商好的協議"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 消息都很小，不等延遲確認
+    sock.sendall(hello(codec_id))
+    reply = b''
+    while len(reply) < HELLO_SIZE:
+        data = sock.recv(HELLO_SIZE - len(reply))
+        if not data:
+            raise ProtocolError('服務器在握手時關閉連線')
+        reply += data
+    return parse_hello_reply(reply)
+
+
+def parse_hello_reply(reply):
+    """檢查服務器的握手確認，返回協商好的協議"""
+    if reply[:len(FRAME_MAGIC)] != FRAME_MAGIC or reply[-1] not in CODECS:
+        raise ProtocolError('服務器不支持分幀協議')
+    return FramedProtocol(reply[-1])
+
+
+class MessageSocket:
+    """阻塞 socket 上的消息收發，遊戲連線使用"""
+
+    def __init__(self, sock, protocol, data=b''):
+        self.sock = sock
+        self.protocol = protocol
+        self.inbox = collections.deque(protocol.feed(data) if data else ())
+
+    @classmethod
+    def connect(cls, sock, codec_id=CODEC_JSON):
+        """主動連線的一方：送出前導碼協商編碼"""
+        return cls(sock, client_handshake(sock, codec_id))
+
+    @classmethod
+    def accept(cls, sock):
+        """接受連線的一方：根據對方最先送出的數據判斷協議"""
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('對方在握手時關閉連線')
+            data += chunk
+            detected = detect_protocol(data)
+            if detected is not None:
+                break
+        protocol, reply, data = detected
+        if reply:
+            sock.sendall(reply)
+        return cls(sock, protocol, data)
+
+    def send(self, message):
+        self.sock.sendall(self.protocol.encode(message))
+
+    def recv(self):
+        while not self.inbox:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('連線已關閉')
+            self.inbox.extend(self.protocol.feed(data))
+        return self.inbox.popleft()
+
+    def close(self):
+        self.sock.close()
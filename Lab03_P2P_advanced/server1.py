@@ -1,175 +1,372 @@
 import socket
 import threading
-import json
-import csv
 import os
+import argparse
+import asyncio
+import time
+from connection import ThreadedConnection, AsyncConnection
+from notifier import NotificationBatcher
+from metrics import RequestMetrics, current_rss_kb
+from rooms import RoomRegistry
+from presence import PresenceRegistry, PresenceFeed
+from sessions import SessionRegistry
+from userstore import UserStore
+from credentials import CredentialService, PendingResponse, is_hashed
+from catalog import GameCatalog
+from transfers import TransferRegistry, UploadSink
+from blobstore import BlobStore, is_sha256
+from protocol import DataChannel, file_sha256
+from codec import PreparedMessage
 
 class LobbyServer:
-    def __init__(self, host='140.113.235.151', port=12222):
+    SWEEP_INTERVAL = 30  # 秒，檢查超時房間的間隔
+    MAX_BATCH = 32  # 一個 batch 請求最多包含的子請求數
+    # 會改變狀態的請求：重發時返回第一次的回覆，不再執行一次；只讀的請求重新執行即可。
+    # begin_upload 不在其中：它發出的令牌只能使用一次，重發時必須拿到新令牌（續傳位置由臨時文件決定）
+    REPLAYED_ACTIONS = frozenset({
+        'register', 'login', 'logout', 'resume_session', 'create_room', 'join_room', 'invite_player',
+        'respond_to_invite', 'set_game_server', 'finish_game',
+        'upload_game', 'upload_game_chunk', 'batch',
+    })
+
+    def __init__(self, host='140.113.235.151', port=12222, notify_window=0.05,
+                 waiting_ttl=600, playing_ttl=7200, hash_workers=None, session_grace=30):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((host, port))
-        self.server_socket.listen(5)
-        self.players = {}  # Stores usernames and passwords
-        self.player_status = {}  # Stores player statuses
-        self.client_sockets = {}  # Stores connected clients
-        self.rooms = {}  # Stores room information
+        self.server_socket.listen(1024)
+        self.lock = threading.RLock()  # 執行緒模式下保護共享狀態
+        self.player_status = PresenceRegistry()  # Stores player statuses (並按狀態索引)
+        self.client_sockets = {}  # Stores connected clients (username -> connection)
+        self.rooms = RoomRegistry()  # Stores room information
+        self.room_list_cache = {}  # (篩選條件, 游標, 頁大小) -> 預先編碼的 list_rooms 回覆
+        self.room_list_version = self.rooms.version
         self.game_servers = {}  # 存储游戏服务器信息
-        self.games = {}  # 存储游戏信息
-        self.load_users()
+        self.room_ttls = {'waiting': waiting_ttl, 'playing': playing_ttl}  # 房間在各狀態最多停留的秒數
+        self.loop = None  # asyncio 模式下的事件迴圈
+        self.notifier = NotificationBatcher(self.broadcast, self.call_later, notify_window)
+        self.presence_feed = PresenceFeed(self.player_status, self.broadcast, self.call_later, notify_window)
+        self.player_status.on_change = self.presence_feed.changed  # 在線狀態變化以增量推送
+        self.sessions = SessionRegistry(self.call_later, self.logout, session_grace)  # 斷線後可在寬限期內恢復
+        self.metrics = RequestMetrics()
+        self.handlers = {}  # action -> handler
+        self.replayed = 0  # 重發的請求直接返回快取回覆的次數
+        self.setup_handlers()
+        self.players = UserStore('users.db', self.call_later)  # Stores usernames and password hashes (按需查詢，批量寫入)
+        self.credentials = CredentialService(hash_workers)  # 密碼雜湊在執行緒池中計算
+        self.games = GameCatalog('Lobby/games.csv', self.call_later)  # 存储游戏信息 (內存中的目錄，批量寫回)
+        self.uploads = {}  # 上傳中的遊戲 -> (publisher, description)，文件完整後才加入目錄
+        self.transfers = TransferRegistry(self.call_later)  # 數據連線上的文件傳輸
+        self.blobs = BlobStore('Lobby', 'Lobby/games')  # 按內容雜湊保存的遊戲文件
 
-    def load_users(self):
-        """從CSV文件加載用戶信息"""
-        try:
-            with open('users.csv', mode='r', newline='', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                for row in reader:
-                    username, password = row
-                    self.players[username] = password  
-        except FileNotFoundError:
-            print("用戶文件未找到，將創建新文件。")
-
-    def save_user(self, username, password):
-        """將新用戶信息寫入CSV文件"""
-        with open('users.csv', mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow([username, password]) 
-
-    def send_message(self, client_socket, message):
+    def send_message(self, connection, message):
         try:
-            message_str = json.dumps(message)
-            client_socket.send(message_str.encode('utf-8'))
+            connection.send_message(message)
         except Exception as e:
             print(f"發送消息時出錯: {e}")
 
-    def handle_client(self, client_socket):
-        username = None
+    def handle_client(self, client_socket, addr=None):
+        """執行緒模式：每個連線一個執行緒，阻塞讀取請求"""
+        connection = ThreadedConnection(client_socket, addr)
         while True:
             try:
-                request = client_socket.recv(1024).decode('utf-8')
-                if not request:
+                data = client_socket.recv(65536)
+                if not data:
                     break  # Client has disconnected
-                response = self.process_request(request, client_socket, username)
-                
-                # Update username if successfully logged in
-                if response and response['status'] == 'success' and 'username' in response:
-                    username = response['username']
-                
-                if response:
-                    self.send_message(client_socket, response)
+                for request in connection.receive(data):
+                    with self.lock:
+                        response = self.process_request(request, connection)
+                    while isinstance(response, PendingResponse):  # batch 中可能有多個要等待的子請求
+                        result = response.future.result()  # 在鎖外等待雜湊完成，不阻塞其他連線
+                        with self.lock:
+                            response = response.finish(result)
+                    if response:
+                        self.send_message(connection, response)
+                if isinstance(connection.protocol, DataChannel):
+                    self.serve_data_channel(connection)
+                    break
             except Exception as e:
                 print(f"處理客戶端請求時出錯: {e}")
                 break
-        
+
         # Clean up after client disconnects
-        if username:
-            self.logout(username)
-        client_socket.close()
+        with self.lock:
+            self.disconnect(connection)
 
-    def process_request(self, request, client_socket, username):
-        # print("Received request data:", request)
-        data = json.loads(request)
-        action = data.get('action')
-        request_id = data.get('request_id')
+    async def handle_client_async(self, reader, writer):
+        """asyncio 模式：所有連線共用一個事件迴圈，閒置連線只佔用一個協程"""
+        connection = AsyncConnection(reader, writer)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break  # Client has disconnected
+                for request in connection.receive(data):
+                    response = self.process_request(request, connection)
+                    while isinstance(response, PendingResponse):
+                        result = await asyncio.wrap_future(response.future)  # 等待期間事件迴圈繼續服務其他連線
+                        response = response.finish(result)
+                    if response:
+                        self.send_message(connection, response)
+                if isinstance(connection.protocol, DataChannel):
+                    await self.serve_data_channel_async(connection)
+                    break
+                await connection.drain()
+        except Exception as e:
+            print(f"處理客戶端請求時出錯: {e}")
+        finally:
+            self.disconnect(connection)
 
-        # print(f"Received request: {data}")
-        if action == 'register':
-            response = self.register(data['username'], data['password'], client_socket)
-        elif action == 'login':
-            response = self.login(data['username'], data['password'], client_socket)
-        elif action == 'logout':
-            response = self.logout(username)
-        elif action == 'create_room':
-            response = self.create_room(data['room_type'], username, data['room_name'])
-        elif action == 'join_room':
-            response = self.join_room(data['room_name'], username)
-        elif action == 'list_rooms':
-            response = self.list_rooms()
-        elif action == 'invite_player':
-            response = self.invite_player(data['room_name'], username, data['invited_player'])
-        elif action == 'respond_to_invite':
-            response = self.handle_invite_response(data['room_name'], username, data['response'])
-        elif action == 'set_game_server':
-            response = self.set_game_server(data['room_name'], data['ip'], data['port'], data['game_type'])
-        elif action == 'get_game_server':
-            response = self.get_game_server(data['room_name'])
-        elif action == 'upload_game':
-            response = self.handle_game_upload(
+    def disconnect(self, connection):
+        """連線斷開：有會話令牌時保留玩家狀態等待重新連線，否則直接登出"""
+        username = connection.username
+        if username and self.client_sockets.get(username) is connection:
+            del self.client_sockets[username]  # 寬限期內不再向這個連線推送
+            if not self.sessions.detach(username):
+                self.logout(username)
+        connection.close()
+
+    def setup_handlers(self):
+        """建立 action -> handler 的分派表，每個 handler 都包裝了耗時統計"""
+        handlers = {
+            'register': lambda data, conn: self.register(data['username'], data['password'], conn),
+            'login': lambda data, conn: self.login(data['username'], data['password'], conn, self.presence_since(data)),
+            'logout': lambda data, conn: self.logout(conn.username),
+            'resume_session': lambda data, conn: self.resume_session(
+                data['session_token'], conn, self.presence_since(data)),
+            'create_room': lambda data, conn: self.create_room(data['room_type'], conn.username, data['room_name']),
+            'join_room': lambda data, conn: self.join_room(data['room_name'], conn.username),
+            'list_rooms': lambda data, conn: self.list_rooms(
+                data.get('room_status'), data.get('creator'), data.get('cursor'), data.get('limit')),
+            'sync_presence': lambda data, conn: self.presence_feed.delta(int(data['since']), data.get('epoch')),
+            'list_players': lambda data, conn: self.list_players(
+                data.get('player_status'), data.get('cursor'), data.get('limit')),
+            'invite_player': lambda data, conn: self.invite_player(data['room_name'], conn.username, data['invited_player']),
+            'respond_to_invite': lambda data, conn: self.handle_invite_response(data['room_name'], conn.username, data['response']),
+            'set_game_server': lambda data, conn: self.set_game_server(data['room_name'], data['ip'], data['port'], data['game_type']),
+            'get_game_server': lambda data, conn: self.get_game_server(data['room_name']),
+            'finish_game': lambda data, conn: self.finish_game(data['room_name'], conn.username),
+            'upload_game': lambda data, conn: self.handle_game_upload(
                 game_name=data['game_name'],
                 game_content=data['game_content'],
                 description=data['description'],
-                publisher=username,
+                publisher=conn.username,
                 chunk_index=data.get('chunk_index', 0),
                 total_chunks=data.get('total_chunks', 1)
-            )
-        elif action == 'upload_game_chunk':
-            response = self.handle_game_upload(
+            ),
+            'begin_upload': lambda data, conn: self.begin_upload(
+                data['game_name'], data['description'], conn.username, data['size'], data['sha256']),
+            'upload_game_chunk': lambda data, conn: self.handle_game_upload(
                 game_name=data['game_name'],
                 game_content=data['game_content'],
-                description="",  
-                publisher=username,
+                description="",
+                publisher=conn.username,
                 chunk_index=data['chunk_index'],
                 total_chunks=data.get('total_chunks', 1)
-            )
-        elif action == 'list_games':
-            response = self.list_games()
-        elif action == 'download_game':
-            response = self.handle_game_download(data['game_name'])
+            ),
+            'list_games': lambda data, conn: self.list_games(data.get('since'), data.get('epoch')),
+            'search_games': lambda data, conn: self.search_games(data.get('query', ''), data.get('cursor'), data.get('limit')),
+            'download_game': lambda data, conn: self.handle_game_download(
+                data['game_name'], data.get('stream', False), data.get('sha256')),
+            'stats': lambda data, conn: self.get_stats(),
+            'batch': lambda data, conn: self.process_batch(data['requests'], conn, data.get('stop_on_error', False)),
+        }
+        for action, handler in handlers.items():
+            self.handlers[action] = self.metrics.wrap(action, handler)
+
+    def process_request(self, data, connection):
+        action = data.get('action')
+        request_id = data.get('request_id')
+
+        replay = connection.replay if request_id is not None and action in self.REPLAYED_ACTIONS else None
+        if replay is not None:
+            if request_id in replay:
+                # 重發的請求；第一次還在處理中時返回 None，不回覆，第一次的回覆送達時同樣作答
+                self.replayed += 1
+                return replay.get(request_id)
+            replay.begin(request_id)
+
+        handler = self.handlers.get(action)
+        if handler is not None:
+            try:
+                response = handler(data, connection)
+            except (KeyError, TypeError, ValueError) as e:
+                response = {'status': 'error', 'message': f'請求格式錯誤: {e!r}'}  # 缺少字段或參數類型不對
+            except Exception:
+                if replay is not None:
+                    replay.discard(request_id)  # 不能讓這個 request_id 一直停在處理中
+                raise
         else:
+            self.metrics.record('invalid', 0.0, error=True)
             response = {'status': 'error', 'message': 'Invalid action.'}
-        
+
+        if isinstance(response, PendingResponse):
+            return response.then(lambda result: self.complete_request(action, request_id, result, connection, replay))
+        return self.complete_request(action, request_id, response, connection, replay)
+
+    def complete_request(self, action, request_id, response, connection, replay=None):
+        # Update username if successfully logged in
+        if response['status'] == 'success' and 'username' in response:
+            connection.username = response['username']
+        elif action == 'logout' and response['status'] == 'success':
+            connection.username = None
+
         if request_id:
-            response['request_id'] = request_id
-        
+            if isinstance(response, PreparedMessage):
+                response = response.with_fields(request_id=request_id)
+            else:
+                response['request_id'] = request_id
+
+        if replay is not None:
+            replay.finish(request_id, response)
         return response
 
-    def register(self, username, password, client_socket):
+    def process_batch(self, requests, connection, stop_on_error=False):
+        """按順序執行一組子請求，合併成一個回覆，一次往返完成登錄、列出房間、同步遊戲目錄等多個操作
+
+        子請求與單獨發送時的處理完全相同，前面的 login 成功後，後面的子請求已是登錄狀態。
+        stop_on_error 為真時，遇到第一個失敗的子請求就不再執行後面的請求。
+        """
+        if not isinstance(requests, list) or len(requests) > self.MAX_BATCH:
+            return {'status': 'error', 'message': f'batch 必須是最多 {self.MAX_BATCH} 個請求的列表'}
+        return self.continue_batch(requests, [], connection, stop_on_error)
+
+    def continue_batch(self, requests, responses, connection, stop_on_error):
+        """執行還沒有回覆的子請求；遇到要等待雜湊的子請求時返回 PendingResponse，
+        雜湊完成後從下一個子請求接着執行，後面的子請求不會搶在它之前執行"""
+        while len(responses) < len(requests):
+            if stop_on_error and responses and responses[-1]['status'] == 'error':
+                break
+            request = requests[len(responses)]
+            if not isinstance(request, dict) or request.get('action') == 'batch':
+                response = {'status': 'error', 'message': 'Invalid action.'}
+            else:
+                response = self.process_request(request, connection) or {
+                    'status': 'error', 'message': '相同 request_id 的請求還在處理中'}
+            if isinstance(response, PendingResponse):
+                return response.then(lambda result: self.continue_batch(
+                    requests, responses + [result], connection, stop_on_error))
+            if isinstance(response, PreparedMessage):
+                response = response.to_dict()  # 嵌套在合併的回覆中，不能單獨使用預先編碼的內容
+            responses.append(response)
+        return {'status': 'success', 'responses': responses}
+
+    def register(self, username, password, connection):
         if username in self.players:
             return {'status': 'error', 'message': 'User already exists.'}
-        self.players[username] = password
-        self.save_user(username, password)  # 註冊時保存用戶信息
+        future = self.credentials.hash(password)
+        if future is None:
+            return {'status': 'error', 'message': '服務器繁忙，請稍後再試'}
+        return PendingResponse(future, lambda hashed: self.finish_register(username, hashed))
+
+    def finish_register(self, username, hashed):
+        if not self.players.add(username, hashed):  # 註冊的用戶批量寫入數據庫
+            return {'status': 'error', 'message': 'User already exists.'}
         return {'status': 'success', 'message': 'Registration successful.'}
 
-    def login(self, username, password, client_socket):
-        if username not in self.players:
+    def login(self, username, password, connection, presence_version=None):
+        stored = self.players.get(username)
+        if stored is None:
             return {'status': 'error', 'message': 'User does not exist.'}
-        elif self.players[username] != password:
+        if self.credentials.cached(connection, username, password, stored):
+            return self.finish_login(username, password, stored, connection, presence_version, True)
+        future = self.credentials.verify(password, stored)
+        if future is None:
+            return {'status': 'error', 'message': '服務器繁忙，請稍後再試'}
+        return PendingResponse(future, lambda ok: self.finish_login(
+            username, password, stored, connection, presence_version, ok))
+
+    def finish_login(self, username, password, stored, connection, presence_version, ok):
+        if not ok:
             return {'status': 'error', 'message': 'Incorrect password.'}
+        if not is_hashed(stored):
+            # 從舊 users.csv 導入的明文密碼：驗證通過後先換成 PBKDF2 雜湊再完成登錄，明文不再留在數據庫中
+            future = self.credentials.hash(password)
+            if future is not None:
+                return PendingResponse(future, lambda hashed: self.rehash_login(
+                    username, password, hashed, connection, presence_version))
+            # 雜湊執行緒池已滿時這次不升級，照常登錄，下次登錄再升級
+        if connection.closed:
+            return {'status': 'error', 'message': '連線已關閉'}  # 驗證期間客戶端已斷開
+        self.credentials.remember(connection, username, password, stored)
+        if username not in self.client_sockets and username in self.player_status:
+            self.abandon_rooms(username)  # 斷線後沒有恢復會話而是重新登錄，之前的房間作廢
+        self.player_status[username] = 'idle'
+        self.client_sockets[username] = connection
+        self.notifier.add(f'Lobby boardcasting: {username} 已加入大廳')  # 廣播登錄通知
+        return {
+            'status': 'success',
+            'message': 'Login successful.',
+            'username': username,
+            'session_token': self.sessions.issue(username, connection.replay),
+            **self.presence_snapshot(presence_version),
+        }
+
+    def rehash_login(self, username, password, hashed, connection, presence_version):
+        self.players.set_password(username, hashed)
+        return self.finish_login(username, password, hashed, connection, presence_version, True)
+
+    def presence_snapshot(self, presence_version=None):
+        """客戶端帶著上次的版本時只返回增量，否則返回第一頁快照（其餘用 list_players 分頁獲取）"""
+        snapshot = {'presence_version': self.player_status.version, 'presence_epoch': self.player_status.epoch}
+        changes = None if presence_version is None else self.player_status.changes_since(int(presence_version))
+        if changes is not None:
+            snapshot['changes'] = changes
         else:
-            self.player_status[username] = 'idle' 
-            self.client_sockets[username] = client_socket
-            self.broadcast({'status': 'notification', 'message': f'Lobby boardcasting: {username} 已加入大廳'})  # 廣播登錄通知
-            return {
-                'status': 'success', 
-                'message': 'Login successful.', 
-                'players': self.get_all_players(),
-                'username': username 
-            }
+            snapshot.update(self.player_status.list_page())
+        return snapshot
+
+    def presence_since(self, data):
+        """請求中客戶端上次看到的在線狀態版本；來自服務器之前的運行（epoch 不同）時當作沒有"""
+        if data.get('presence_epoch') != self.player_status.epoch:
+            return None
+        return data.get('presence_version')
+
+    def resume_session(self, token, connection, presence_version=None):
+        """用會話令牌恢復斷線前的登錄狀態：狀態和房間都不變，也不廣播上下線"""
+        username = self.sessions.resume(token)
+        if username is None:
+            return {'status': 'error', 'message': '會話已過期，請重新登錄'}
+        old = self.client_sockets.get(username)
+        if old is not None and old is not connection:
+            old.username = None  # 服務器還沒發現舊連線已斷開，關閉時不要再清理
+            old.close()
+        self.client_sockets[username] = connection
+        connection.replay = self.sessions.replays[token]  # 斷線前發出、重連後重發的請求在這裡找到回覆
+        return {
+            'status': 'success',
+            'message': 'Session resumed.',
+            'username': username,
+            'session_token': token,
+            'player_status': self.player_status.get(username),
+            'rooms': self.rooms.rooms_of(username),
+            **self.presence_snapshot(presence_version),
+        }
 
     def logout(self, username):
+        self.sessions.revoke(username)
+        self.abandon_rooms(username)
         if username in self.client_sockets:
             del self.client_sockets[username]
         if username in self.player_status:
             del self.player_status[username]
-        self.broadcast({'status': 'notification', 'message': f'Lobby boardcasting: {username} 已退出大廳'})  # 廣播登出通知
+        self.notifier.add(f'Lobby boardcasting: {username} 已退出大廳')  # 廣播登出通知
         #if username in self.players:
         #del self.players[username]  
         return {'status': 'success', 'message': 'Logout successful.'}
 
-    def get_all_players(self):
-        return {username: status for username, status in self.player_status.items()}
+    def list_players(self, status=None, cursor=None, limit=None):
+        """分頁列出在線玩家，可按狀態篩選（例如只列出 idle 的玩家）"""
+        return {'status': 'success', **self.player_status.list_page(status, cursor, limit)}
 
     def create_room(self, room_type, creator, room_name):
         if not creator:
             return {'status': 'error', 'message': 'User must be logged in to create a room.'}
-        self.rooms[room_name] = {
-            'type': room_type,
-            'status': 'waiting',
-            'players': [creator],
-            'creator': creator,
-            'invited_players':[]
-        }
+        if room_name in self.rooms:
+            return {'status': 'error', 'message': 'Room already exists.'}
+        self.rooms.create(room_name, room_type, creator)
         self.player_status[creator] = 'in room'
-        self.broadcast({'status': 'notification', 'message': f'Lobby boardcasting: {creator} 創建了房間 {room_name} 作為 {room_type} 房間'})  # 廣播創建房間通知
+        self.notifier.add(f'Lobby boardcasting: {creator} 創建了房間 {room_name} 作為 {room_type} 房間')  # 廣播創建房間通知
         return {'status': 'success', 'message': f'{room_name} created as {room_type} room.'}
 
     def join_room(self, room_name, username):
@@ -181,9 +378,9 @@ class LobbyServer:
         
         room = self.rooms[room_name]
         if room['status'] == 'waiting':
-            room['players'].append(username)
+            self.rooms.add_player(room_name, username)
             if len(room['players']) > 1:
-                room['status'] = 'playing'
+                self.rooms.set_status(room_name, 'playing')
                 for player in room['players']:
                     self.player_status[player] = 'playing'
                 
@@ -195,19 +392,25 @@ class LobbyServer:
                         'room_name': room_name,
                         'player': username
                     }
-                    self.client_sockets[creator].send(json.dumps(accept_message).encode('utf-8'))
+                    self.send_message(self.client_sockets[creator], accept_message)
                 
             return {'status': 'success', 'message': f'Joined {room_name}.'}
         else:
             return {'status': 'error', 'message': 'Room is already in game.'}
 
-    def list_rooms(self):
-        available_rooms = {
-            room_name: {'type': room['type'], 'creator': room['creator'], 'status': room['status']}
-            for room_name, room in self.rooms.items() if room['type'] == 'public'
-
-        }
-        return {'status': 'success', 'rooms': available_rooms}
+    def list_rooms(self, room_status=None, creator=None, cursor=None, limit=None):
+        """分頁列出公開房間，同一頁的回覆在房間變化前只構建和編碼一次"""
+        if self.room_list_version != self.rooms.version:
+            self.room_list_cache.clear()
+            self.room_list_version = self.rooms.version
+        key = (room_status, creator, cursor, limit)
+        response = self.room_list_cache.get(key)
+        if response is None:
+            page = self.rooms.list_public(room_status, creator, cursor, limit)
+            response = PreparedMessage({'status': 'success', **page})
+            if len(self.room_list_cache) < 256:
+                self.room_list_cache[key] = response
+        return response
     
     def invite_player(self, room_name, inviter, invited_player):
         if room_name not in self.rooms:
@@ -227,16 +430,24 @@ class LobbyServer:
                 'room_name': room_name,
                 'inviter': inviter
             }
-            self.client_sockets[invited_player].send(json.dumps(invite_message).encode('utf-8'))
+            self.send_message(self.client_sockets[invited_player], invite_message)
             room['invited_players'].append(invited_player)
             return {'status': 'success', 'message': f'已向 {invited_player} 发送邀请'}
         return {'status': 'error', 'message': '玩家不在线'}
 
     def handle_invite_response(self, room_name, username, response):
+        if room_name not in self.rooms:
+            return {'status': 'error', 'message': '房间不存在'}
         room = self.rooms[room_name]
         creator = room['creator']
+        if username not in room['invited_players'] or room['status'] != 'waiting':
+            return {'status': 'error', 'message': '邀请已失效'}  # 没有收到邀请，或房间已开始游戏
+        room['invited_players'].remove(username)
         if response:  # 接受邀请
-            room['players'].append(username)
+            self.rooms.add_player(room_name, username)
+            self.rooms.set_status(room_name, 'playing')
+            for player in room['players']:
+                self.player_status[player] = 'playing'
             # 通知房主邀请已被接受
             if creator in self.client_sockets:
                 accept_message = {
@@ -244,7 +455,7 @@ class LobbyServer:
                     'room_name': room_name,
                     'player': username
                 }
-                self.client_sockets[creator].send(json.dumps(accept_message).encode('utf-8'))
+                self.send_message(self.client_sockets[creator], accept_message)
             return {'status': 'success', 'message': '已接受邀请'}
         else:  # 拒绝邀请
             # 通知房主邀请已被拒绝
@@ -254,11 +465,13 @@ class LobbyServer:
                     'room_name': room_name,
                     'player': username
                 }
-                self.client_sockets[creator].send(json.dumps(reject_message).encode('utf-8'))
+                self.send_message(self.client_sockets[creator], reject_message)
             return {'status': 'error', 'message': '已拒绝邀请'}
 
     def set_game_server(self, room_name, ip, port, game_type):
         """設置遊戲服務器信息並通知其他玩家"""
+        if room_name not in self.rooms:
+            return {'status': 'error', 'message': '房间不存在'}
         self.game_servers[room_name] = {
             'ip': ip, 
             'port': port,
@@ -275,31 +488,149 @@ class LobbyServer:
                     'port': port,
                     'game_type': game_type 
                 }
-                self.client_sockets[player].send(json.dumps(server_info).encode('utf-8'))
+                self.send_message(self.client_sockets[player], server_info)
         return {'status': 'success', 'message': '遊戲服務器信息已設置'}
 
     def get_game_server(self, room_name):
         if room_name in self.game_servers:
             return {'status': 'success', 'server_info': self.game_servers[room_name]}
         return {'status': 'error', 'message': '游戏服务器信息不存在'}
+
+    def finish_game(self, room_name, username):
+        """房間內的玩家回報遊戲結束，房間立即回收"""
+        room = self.rooms.get(room_name)
+        if room is None:
+            return {'status': 'success', 'message': '房間已回收'}  # 另一位玩家已經回報過
+        if username not in room['players']:
+            return {'status': 'error', 'message': '你不在這個房間中'}
+        self.close_room(room_name, 'finished')
+        return {'status': 'success', 'message': f'{room_name} 遊戲結束'}
+
+    def close_room(self, room_name, state, reason=None):
+        """房間進入終止狀態 (finished / abandoned) 後回收：刪除房間、索引和遊戲服務器信息，在線玩家回到 idle"""
+        self.rooms.set_status(room_name, state)
+        room = self.rooms.remove(room_name, reason or state)
+        self.game_servers.pop(room_name, None)
+        for player in set(room['players']):
+            if player in self.player_status and not self.rooms.rooms_of(player):
+                self.player_status[player] = 'idle'
+
+    def abandon_rooms(self, username):
+        """玩家離開大廳時，他創建或參與的房間都無法再繼續，標記為 abandoned 並回收"""
+        for room_name in self.rooms.rooms_of(username):
+            self.close_room(room_name, 'abandoned')
+
+    def sweep_rooms(self):
+        """回收在 waiting / playing 停留過久的房間（例如遊戲結束後沒有回報），然後重新排程"""
+        expired = self.rooms.expired(self.room_ttls)
+        for room_name in expired:
+            self.close_room(room_name, 'abandoned', 'expired')
+        if expired:
+            print(f"回收了 {len(expired)} 個超時房間")
+        self.call_later(self.SWEEP_INTERVAL, self.sweep_rooms)
+
+    def get_stats(self):
+        """各 action 的調用次數、錯誤次數與延遲百分位數，以及房間與記憶體佔用"""
+        return {
+            'status': 'success',
+            'stats': {
+                'uptime': round(time.time() - self.metrics.started, 1),
+                'online': len(self.client_sockets),
+                'players': self.player_status.counts(),
+                'presence_version': self.player_status.version,
+                'sessions': self.sessions.stats(),
+                'replayed': self.replayed,
+                'actions': self.metrics.snapshot(),
+                'notifications': self.notifier.stats(),
+                'rooms': self.rooms.counts(),
+                'rooms_reclaimed': dict(self.rooms.reclaimed),
+                'game_servers': len(self.game_servers),
+                'rss_kb': current_rss_kb(),
+                'users': self.players.stats(),
+                'credentials': self.credentials.stats(),
+                'games': self.games.stats(),
+                'transfers': self.transfers.stats(),
+                'blobs': self.blobs.stats(),
+            }
+        }
     
     def broadcast(self, message):
-        """廣播消息給所有連接的客戶端"""
-        for client_socket in self.client_sockets.values():
-            self.send_message(client_socket, message)
+        """廣播消息給所有連接的客戶端，返回收到消息的客戶端數"""
+        encoded = {}  # 相同協議與編碼的連線只編碼一次
+        sent = 0
+        for connection in list(self.client_sockets.values()):
+            protocol = connection.protocol
+            if protocol is None:
+                continue
+            key = (protocol.framed, protocol.codec_id)
+            try:
+                if key not in encoded:
+                    encoded[key] = protocol.encode(message)
+                connection.write(encoded[key])
+                sent += 1
+            except Exception as e:
+                print(f"發送消息時出錯: {e}")
+        return sent
+
+    def call_later(self, delay, callback):
+        """延遲執行 callback：asyncio 模式用事件迴圈計時，執行緒模式用計時器執行緒並持有 self.lock"""
+        if self.loop is not None:
+            return self.loop.call_later(delay, callback)
+        timer = threading.Timer(delay, self.run_locked, args=(callback,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def run_locked(self, callback):
+        with self.lock:
+            callback()
 
     def run(self):
+        """執行緒模式（每個連線一個執行緒）"""
         print("Lobby server is running...")
-        while True:
-            client_socket, addr = self.server_socket.accept()
-            print(f"Connection from {addr}")
-            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
-            client_handler.start()
+        self.call_later(self.SWEEP_INTERVAL, self.sweep_rooms)
+        try:
+            while True:
+                client_socket, addr = self.server_socket.accept()
+                print(f"Connection from {addr}")
+                client_handler = threading.Thread(target=self.handle_client, args=(client_socket, addr))
+                client_handler.daemon = True
+                client_handler.start()
+        finally:
+            with self.lock:
+                self.players.close()  # 寫入尚未保存的註冊
+                self.games.flush()
+
+    def run_async(self):
+        """asyncio 模式（單一行程、單一事件迴圈服務所有連線）"""
+        raise_fd_limit()
+        print("Lobby server is running (asyncio)...")
+        try:
+            asyncio.run(self.serve_async())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.players.close()  # 寫入尚未保存的註冊
+            self.games.flush()
+
+    async def serve_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.call_later(self.SWEEP_INTERVAL, self.sweep_rooms)
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_client_async, sock=self.server_socket)
+        async with server:
+            await server.serve_forever()
     
    
 
     def handle_game_upload(self, game_name, game_content, description, publisher, chunk_index=0, total_chunks=1):
         """處理遊戲上傳"""
+        # 與 begin_upload 相同的檢查：舊的分塊上傳同樣會發布到目錄
+        if publisher is None:
+            return {'status': 'error', 'message': '請先登錄再上傳遊戲'}
+        game_name = os.path.basename(game_name)
+        if not game_name.endswith('.py'):
+            return {'status': 'error', 'message': '只能上傳 .py 遊戲文件'}
         try:
             game_name_without_ext = game_name.replace('.py', '')
             
@@ -310,21 +641,15 @@ class LobbyServer:
             # 解析轉義後的內容
             game_content = bytes(game_content, 'utf-8').decode('unicode_escape')
             
-            # 如果是第一個塊，保存游戲信息到CSV
+            # 如果是第一個塊，記下游戲信息，文件完整後再加入目錄
             if chunk_index == 0:
-                # 使用不带后缀的名称保存到 CSV
-                self.save_game_info(game_name_without_ext, publisher, description)
-                print("\n=== 保存游戲信息 ===")
-                print(f"遊戲名稱: {game_name_without_ext}")
-                print(f"發布者: {publisher}")
-                print(f"描述: {description}")
-                print("==================\n")
+                self.uploads[game_name_without_ext] = (publisher, description)
 
             print(f"正在處理塊 {chunk_index + 1}/{total_chunks}")
             
-            # 文件仍然使用原始名称（带 .py）保存
-            temp_path = os.path.join('Lobby/games', game_name)
+            # 文件仍然使用原始名称（带 .py）保存，上傳過程中寫入臨時文件
             final_path = os.path.join('Lobby/games', game_name)
+            temp_path = final_path + '.part'
             
             # 寫入模式：第一個塊是 'w'，後續塊是 'a'
             mode = 'w' if chunk_index == 0 else 'a'
@@ -333,10 +658,17 @@ class LobbyServer:
             
             # 如果是最後一個塊，完成上傳
             if chunk_index == total_chunks - 1:
-                # 重命名臨時文件
-                if os.path.exists(final_path):
-                    os.remove(final_path)
-                os.rename(temp_path, final_path)
+                # 臨時文件移入內容倉庫，再鏈接到遊戲名稱
+                sha256 = self.blobs.store(temp_path)
+
+                # 使用不带后缀的名称保存到目錄，並更新搜尋索引
+                publisher, description = self.uploads.pop(game_name_without_ext, (publisher, description))
+                self.publish_game(game_name, sha256, publisher, description)
+                print("\n=== 保存游戲信息 ===")
+                print(f"遊戲名稱: {game_name_without_ext}")
+                print(f"發布者: {publisher}")
+                print(f"描述: {description}")
+                print("==================\n")
                 
                 return {
                     'status': 'success',
@@ -358,76 +690,30 @@ class LobbyServer:
                 'message': f'上傳失敗: {str(e)}'
             }
 
-    def save_game_info(self, game_name, publisher, description):
-        """將遊戲信息保存到CSV文件"""
-        try:
-            # 確保目錄存在
-            os.makedirs('Lobby', exist_ok=True)
-            
-            csv_path = 'Lobby/games.csv'
-            file_exists = os.path.exists(csv_path)
-            
-            with open(csv_path, mode='a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                
-                # 如果文件不存在，寫入表頭
-                if not file_exists:
-                    writer.writerow(['game_name', 'publisher', 'description'])
-                
-                # 寫入遊戲信息
-                writer.writerow([game_name, publisher, description])
-                
-            # 更新内存中的游戏信息
-            self.games[game_name] = {
-                'publisher': publisher,
-                'description': description
-            }
-            
-            print(f"遊戲信息已保存到 {csv_path}")
-            
-        except Exception as e:
-            print(f"保存遊戲信息時出錯: {e}")
-            raise
+    def save_game_info(self, game_name, publisher, description, sha256=None):
+        """更新內存中的遊戲目錄，CSV 由目錄批量寫回"""
+        self.games.upsert(game_name, publisher, description, sha256)
 
-    def list_games(self):
-        """返回所有遊戲列表"""
-        try:
-            games_dict = {}
-            csv_path = 'Lobby/games.csv'
-            
-            if not os.path.exists(csv_path):
-                return {
-                    'status': 'success',
-                    'games': [],
-                    'message': '目前沒有任何遊戲'
-                }
-            
-            with open(csv_path, mode='r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    games_dict[row['game_name']] = {
-                        'name': row['game_name'],
-                        'publisher': row['publisher'],
-                        'description': row['description']
-                }
-                    
-            # 将字典值转换为列表
-            games_list = list(games_dict.values())
-            return {
-                'status': 'success',
-                'games': games_list,
-                'message': '成功獲取遊戲列表'
-            }
-            
-        except Exception as e:
-            print(f"讀取遊戲列表時出錯: {e}")
-            return {
-                'status': 'error',
-                'message': f'獲取遊戲列表失敗: {str(e)}'
-            }
+    def publish_game(self, game_name, sha256, publisher, description):
+        """把倉庫中的內容鏈接到 Lobby/games/<game_name> 並加入目錄"""
+        self.blobs.link(sha256, game_name)
+        self.save_game_info(game_name.replace('.py', ''), publisher, description, sha256)
+
+    def list_games(self, since=None, epoch=None):
+        """返回遊戲列表（內存中的目錄，不讀磁盤）；帶上次看到的版本時只返回變化的遊戲"""
+        return self.games.list_response(since, epoch)
+
+    def search_games(self, query='', cursor=None, limit=None):
+        """按名稱、發布者、描述中的詞（前綴）搜尋遊戲，分頁返回"""
+        return {'status': 'success', **self.games.search(query, cursor, limit)}
+
+    def handle_game_download(self, game_name, stream=False, cached_sha256=None):
+        """處理遊戲下載請求
 
-    def handle_game_download(self, game_name):
-        """處理遊戲下載請求"""
+        stream 為 True 時不在回覆中附帶內容，而是發出傳輸令牌，
+        客戶端憑令牌開一條數據連線，由 sendfile 直接從文件發送。
+        客戶端帶上本地快取的 sha256 且與當前版本相同時只回覆 not_modified。
+        """
         try:
             game_path = os.path.join('Lobby/games', f"{game_name}.py")
             
@@ -436,6 +722,28 @@ class LobbyServer:
                     'status': 'error',
                     'message': '遊戲文件不存在'
                 }
+
+            game = self.games.get(game_name)
+            sha256 = game and game.get('sha256') or file_sha256(game_path)  # 舊的目錄記錄沒有雜湊
+            if cached_sha256 == sha256:
+                return {
+                    'status': 'not_modified',
+                    'sha256': sha256,
+                    'message': '遊戲沒有變化，使用本地快取'
+                }
+
+            if stream:
+                # 現在就打開文件，傳輸期間即使遊戲被重新上傳，發送的仍是這一版完整的內容
+                game_file = open(game_path, 'rb')
+                size = os.fstat(game_file.fileno()).st_size
+                token = self.transfers.register('download', file=game_file, size=size)
+                return {
+                    'status': 'success',
+                    'transfer_token': token.hex(),
+                    'size': size,
+                    'sha256': sha256,
+                    'message': '請通過數據連線接收遊戲文件'
+                }
             
             with open(game_path, 'r', encoding='utf-8') as f:
                 game_content = f.read()
@@ -443,6 +751,7 @@ class LobbyServer:
             return {
                 'status': 'success',
                 'game_content': game_content,
+                'sha256': sha256,
                 'message': '遊戲下載成功'
             }
             
@@ -452,9 +761,184 @@ class LobbyServer:
                 'message': f'下載失敗: {str(e)}'
             }
 
+    def begin_upload(self, game_name, description, publisher, size, sha256):
+        """登記一次數據連線上的上傳，返回令牌、續傳位置與窗口參數
+
+        文件以原始字節分塊送出，客戶端可以有 WINDOW 塊未確認，
+        服務器收齊後校驗 sha256，一致才加入目錄。
+        倉庫中已有同樣的內容時直接發布，不需要再傳輸（complete 為 True）；
+        之前中斷過的上傳從 offset 處續傳。
+        """
+        if publisher is None:
+            return {'status': 'error', 'message': '請先登錄再上傳遊戲'}
+        game_name = os.path.basename(game_name)
+        if not game_name.endswith('.py'):
+            return {'status': 'error', 'message': '只能上傳 .py 遊戲文件'}
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            return {'status': 'error', 'message': '無效的文件大小'}
+        if size > self.transfers.MAX_UPLOAD_SIZE:
+            return {'status': 'error', 'message': '遊戲文件過大'}
+        if not is_sha256(sha256):
+            return {'status': 'error', 'message': '無效的校驗值'}  # 校驗值會用作文件名，只接受小寫十六進制
+        if self.blobs.has(sha256):
+            self.blobs.dedup_hits += 1
+            self.publish_game(game_name, sha256, publisher, description)
+            return {'status': 'success', 'complete': True, 'message': '遊戲上傳成功（內容已存在）'}
+        if self.transfers.busy(sha256, publisher):
+            return {'status': 'error', 'message': '其他用戶正在上傳相同的內容，請稍後再試'}
+
+        offset = self.blobs.partial_size(sha256)
+        if offset > size:
+            offset = 0
+        elif offset:
+            self.blobs.resumed += 1
+        token = self.transfers.register('upload', game_name=game_name, description=description,
+                                        publisher=publisher, size=size, sha256=sha256, offset=offset)
+        return {
+            'status': 'success',
+            'transfer_token': token.hex(),
+            'offset': offset,
+            'chunk_size': self.transfers.CHUNK_SIZE,
+            'window': self.transfers.WINDOW,
+            'message': '請通過數據連線上傳遊戲文件'
+        }
+
+    def open_upload(self, transfer):
+        # 臨時文件以內容雜湊命名，中斷後同樣內容的上傳（不論遊戲名稱）都可以接著寫
+        return UploadSink(self.blobs.partial_path(transfer['sha256']), transfer['size'], transfer['sha256'],
+                          self.transfers.CHUNK_SIZE, transfer['offset'])
+
+    def finish_upload(self, transfer, sink, ok):
+        """上傳結束後更新目錄（執行緒模式下在持有 self.lock 時調用），ok 為 None 表示中途斷線"""
+        self.transfers.upload_done(transfer, sink, ok)
+        if ok is None:
+            print(f"遊戲 {transfer['game_name']} 上傳中斷，已收到 {sink.received}/{sink.size} 字節")
+            return
+        if not ok:
+            print(f"遊戲 {transfer['game_name']} 上傳校驗失敗，已丟棄")
+            return
+        self.blobs.commit(transfer['sha256'], sink.path)
+        self.publish_game(transfer['game_name'], transfer['sha256'], transfer['publisher'], transfer['description'])
+        print(f"遊戲 {transfer['game_name']} 上傳完成（{sink.received} 字節，發布者 {transfer['publisher']}）")
+
+    def serve_data_channel(self, connection):
+        """執行緒模式：按令牌在數據連線上傳輸文件，傳輸在鎖外進行"""
+        token = connection.protocol.token
+        with self.lock:
+            transfer = self.transfers.claim(token, connection)
+        if transfer is None:
+            return  # 令牌無效或已過期，直接關閉連線
+        if transfer['kind'] == 'download':
+            with transfer['file'] as game_file:
+                sent = connection.client_socket.sendfile(game_file)  # Linux 上使用 os.sendfile，不經過用戶空間
+            with self.lock:
+                self.transfers.bytes_sent += sent
+            return
+
+        sink = self.open_upload(transfer)
+        buffer = bytearray(self.transfers.CHUNK_SIZE)
+        view = memoryview(buffer)
+        data = connection.protocol.initial
+        ack = ok = None
+        connection.client_socket.settimeout(self.transfers.IDLE_TIMEOUT)  # 超時拋出 socket.timeout，保留臨時文件
+        try:
+            while True:
+                ack = sink.feed(data)
+                if ack:
+                    connection.write(ack)
+                if sink.complete():
+                    break
+                n = connection.client_socket.recv_into(view)
+                if not n:
+                    break
+                data = view[:n]
+        finally:
+            if sink.complete():
+                ack, ok = sink.finish()
+            else:
+                sink.abort()
+            with self.lock:
+                self.finish_upload(transfer, sink, ok)
+        if ok is not None:
+            connection.write(ack)
+
+    async def serve_data_channel_async(self, connection):
+        """asyncio 模式：下載用 loop.sendfile，在支持時同樣走 os.sendfile"""
+        token = connection.protocol.token
+        transfer = self.transfers.claim(token, connection)
+        if transfer is None:
+            return
+        if transfer['kind'] == 'download':
+            with transfer['file'] as game_file:
+                sent = await self.loop.sendfile(connection.writer.transport, game_file)
+            await connection.drain()
+            self.transfers.bytes_sent += sent
+            return
+
+        sink = self.open_upload(transfer)
+        data = connection.protocol.initial
+        ack = ok = None
+        try:
+            while True:
+                ack = sink.feed(data)
+                if ack:
+                    connection.write(ack)
+                    await connection.drain()
+                if sink.complete():
+                    break
+                try:
+                    data = await asyncio.wait_for(connection.reader.read(self.transfers.CHUNK_SIZE),
+                                                  self.transfers.IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise ConnectionError('數據連線空閒超時')
+                if not data:
+                    break
+        finally:
+            if sink.complete():
+                ack, ok = sink.finish()
+            else:
+                sink.abort()
+            self.finish_upload(transfer, sink, ok)
+        if ok is not None:
+            connection.write(ack)
+            await connection.drain()
+
+def raise_fd_limit():
+    """盡量提高可開啟的文件描述符上限，以容納大量閒置連線"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
 if __name__ == "__main__":
-    server = LobbyServer()
-    server.run()
+    parser = argparse.ArgumentParser(description='遊戲大廳服務器')
+    parser.add_argument('--host', default='140.113.235.151')
+    parser.add_argument('--port', type=int, default=12222)
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread',
+                        help='thread: 每個連線一個執行緒; async: 單執行緒 asyncio 事件迴圈')
+    parser.add_argument('--notify-window', type=float, default=0.05,
+                        help='合併大廳通知的時間窗口（秒），0 表示立即推送')
+    parser.add_argument('--waiting-ttl', type=float, default=600,
+                        help='房間等待玩家的最長時間（秒），超時回收')
+    parser.add_argument('--playing-ttl', type=float, default=7200,
+                        help='房間遊戲中的最長時間（秒），超時回收')
+    parser.add_argument('--hash-workers', type=int, default=None,
+                        help='計算密碼雜湊的執行緒數，預設為 CPU 核心數（最多 4）')
+    parser.add_argument('--session-grace', type=float, default=30,
+                        help='斷線後保留會話等待重新連線的時間（秒）')
+    args = parser.parse_args()
+
+    server = LobbyServer(args.host, args.port, notify_window=args.notify_window,
+                         waiting_ttl=args.waiting_ttl, playing_ttl=args.playing_ttl,
+                         hash_workers=args.hash_workers, session_grace=args.session_grace)
+    if args.mode == 'async':
+        server.run_async()
+    else:
+        server.run()
 
 #所有公開遊戲的房間(包含創建者、遊戲類型、房間狀態)。
 #status 換成idle
\ No newline at end of file
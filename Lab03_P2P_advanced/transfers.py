@@ -0,0 +1,152 @@
+import hashlib
+import os
+
+from protocol import TRANSFER_TOKEN_SIZE, UPLOAD_ACK, UPLOAD_RECEIVING, UPLOAD_DONE, UPLOAD_CORRUPT
+
+
+class TransferRegistry:
+    """文件傳輸令牌
+
+    控制連線上的請求登記一次傳輸並拿到令牌，客戶端再開一條數據連線送出令牌取用。
+    令牌只能使用一次，TTL 秒內沒有被取用就作廢並釋放已打開的文件。
+    """
+
+    TTL = 30
+    CHUNK_SIZE = 256 * 1024  # 上傳時每收滿一塊確認一次
+    WINDOW = 8  # 客戶端最多可以有多少塊未確認
+    MAX_UPLOAD_SIZE = 64 * 1024 * 1024
+    IDLE_TIMEOUT = 30  # 秒，數據連線上這麼久收不到數據就斷開，客戶端無聲斷線時不會一直佔住上傳
+
+    def __init__(self, call_later):
+        self.call_later = call_later
+        self.pending = {}  # token -> transfer
+        self.started = 0
+        self.expired = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.uploads = 0
+        self.failed_uploads = 0
+        self.receiving = {}  # 正在接收的內容 sha256 -> 接收中的 transfer，同樣的內容同時只接收一份
+        self.superseded = 0
+        self.conflicts = 0
+
+    def register(self, kind, **transfer):
+        token = os.urandom(TRANSFER_TOKEN_SIZE)
+        transfer['kind'] = kind
+        self.pending[token] = transfer
+        self.call_later(self.TTL, lambda: self.expire(token))
+        return token
+
+    def busy(self, sha256, publisher):
+        """其他發布者正在接收同樣的內容時返回 True"""
+        current = self.receiving.get(sha256)
+        return current is not None and current['publisher'] != publisher
+
+    def claim(self, token, connection):
+        """取用令牌，令牌無效、已使用或內容正由其他發布者上傳時返回 None
+
+        同一發布者的同樣內容已有一條數據連線在接收時，說明客戶端多半已經無聲斷線後重試，
+        斷開舊的連線（它的臨時文件保留），由新的連線從斷點接着接收。
+        其他發布者的上傳不會被打斷，這次取用被拒絕，等前一次完成後再上傳即可直接去重。
+        """
+        transfer = self.pending.pop(token, None)
+        if transfer is None:
+            return None
+        if transfer['kind'] == 'upload':
+            stale = self.receiving.get(transfer['sha256'])
+            if stale is not None:
+                if stale['publisher'] != transfer['publisher']:
+                    self.conflicts += 1
+                    return None
+                stale['connection'].abort()
+                self.superseded += 1
+            transfer['connection'] = connection
+            self.receiving[transfer['sha256']] = transfer
+        self.started += 1
+        return transfer
+
+    def expire(self, token):
+        transfer = self.pending.pop(token, None)
+        if transfer is None:
+            return
+        self.expired += 1
+        if transfer.get('file') is not None:
+            transfer['file'].close()
+
+    def upload_done(self, transfer, sink, ok):
+        """上傳結束（ok 為 None 表示中途斷線，臨時文件保留以便續傳）"""
+        if self.receiving.get(transfer['sha256']) is transfer:
+            del self.receiving[transfer['sha256']]
+        self.bytes_received += sink.received - sink.offset
+        if ok:
+            self.uploads += 1
+        elif ok is not None:
+            self.failed_uploads += 1
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'started': self.started,
+            'expired': self.expired,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'uploads': self.uploads,
+            'failed_uploads': self.failed_uploads,
+            'superseded': self.superseded,
+            'conflicts': self.conflicts,
+        }
+
+
+class UploadSink:
+    """接收一次上傳：整個過程只打開一次臨時文件，邊寫邊計算 sha256
+
+    offset 不為 0 時在上次中斷的臨時文件後續寫，先讀一遍已有的部分讓雜湊跟上。
+    每跨過一個塊邊界產生一個確認；收齊後校驗，不一致時刪除臨時文件。
+    """
+
+    def __init__(self, path, size, sha256, chunk_size, offset=0):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.hasher = hashlib.sha256()
+        self.file = open(path, 'r+b' if offset else 'wb')
+        remaining = offset
+        while remaining:
+            block = self.file.read(min(remaining, 1024 * 1024))
+            if not block:
+                break  # 臨時文件比記錄的短，雜湊對不上，最後會校驗失敗
+            self.hasher.update(block)
+            remaining -= len(block)
+        self.file.seek(offset)
+        self.file.truncate()
+        self.received = offset
+
+    def feed(self, data):
+        """寫入收到的數據，返回要回送的確認（可能為空）"""
+        data = data[:self.size - self.received]  # 忽略超出聲明大小的部分
+        if not data:
+            return b''
+        before = self.received // self.chunk_size
+        self.file.write(data)
+        self.hasher.update(data)
+        self.received += len(data)
+        if self.received // self.chunk_size != before and not self.complete():
+            return UPLOAD_ACK.pack(self.received, UPLOAD_RECEIVING)
+        return b''
+
+    def complete(self):
+        return self.received >= self.size
+
+    def finish(self):
+        """關閉文件並校驗，返回最後一個確認與是否成功"""
+        self.file.close()
+        ok = self.complete() and self.hasher.hexdigest() == self.sha256
+        if not ok:
+            os.remove(self.path)
+        return UPLOAD_ACK.pack(self.received, UPLOAD_DONE if ok else UPLOAD_CORRUPT), ok
+
+    def abort(self):
+        """數據連線中途斷開：保留已寫入的部分，下次從這裡續傳"""
+        self.file.close()
@@ -0,0 +1,92 @@
+import csv
+import os
+import sqlite3
+
+
+class UserStore:
+    """以 SQLite 保存的用戶表，用戶名為主鍵
+
+    啟動時只打開數據庫，不讀入全部用戶；登錄時按主鍵查詢。
+    註冊先放入內存中的待寫表，在一個短窗口後或累積到 BATCH_SIZE 條時
+    用一個事務批量寫入。查詢會先看待寫表，因此剛註冊的用戶可以立即登錄。
+    """
+
+    FLUSH_DELAY = 0.05  # 秒，合併註冊寫入的時間窗口
+    BATCH_SIZE = 500
+
+    def __init__(self, path='users.db', call_later=None, legacy_csv='users.csv'):
+        self.path = path
+        self.call_later = call_later  # 為 None 時每次註冊立即寫入
+        is_new = not os.path.exists(path)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT NOT NULL)')
+        self.db.commit()
+        self.pending = {}  # 尚未寫入的註冊 username -> password
+        self.scheduled = False
+        self.flushes = 0
+        self.written = 0
+        if is_new and legacy_csv and os.path.exists(legacy_csv):
+            self.import_csv(legacy_csv)
+
+    def import_csv(self, csv_path):
+        """第一次建立數據庫時，把舊的 users.csv 導入（逐行讀取，不整個載入內存）"""
+        with open(csv_path, mode='r', newline='', encoding='utf-8') as file:
+            rows = (row for row in csv.reader(file) if len(row) == 2)
+            self.db.executemany('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)', rows)
+        self.db.commit()
+        print(f"已從 {csv_path} 導入用戶到 {self.path}")
+
+    def get(self, username, default=None):
+        """返回用戶的密碼，用戶不存在時返回 default"""
+        if username in self.pending:
+            return self.pending[username]
+        row = self.db.execute('SELECT password FROM users WHERE username = ?', (username,)).fetchone()
+        return row[0] if row else default
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __getitem__(self, username):
+        password = self.get(username)
+        if password is None:
+            raise KeyError(username)
+        return password
+
+    def add(self, username, password):
+        """登記新用戶，已存在時返回 False"""
+        if username in self:
+            return False
+        self.pending[username] = password
+        if self.call_later is None or len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.call_later(self.FLUSH_DELAY, self.flush)
+        return True
+
+    def set_password(self, username, password):
+        """替換已有用戶的密碼（例如把舊數據的明文換成雜湊），立即寫入"""
+        if username in self.pending:
+            self.pending[username] = password
+            return
+        with self.db:
+            self.db.execute('UPDATE users SET password = ? WHERE username = ?', (password, username))
+
+    def flush(self):
+        self.scheduled = False
+        if not self.pending:
+            return
+        rows, self.pending = list(self.pending.items()), {}
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)', rows)
+        self.flushes += 1
+        self.written += len(rows)
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def stats(self):
+        return {'pending': len(self.pending), 'flushes': self.flushes, 'written': self.written}